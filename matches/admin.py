@@ -1,11 +1,18 @@
-from django.contrib import admin
-from .models import Region, Team, Room, Match, Timeslot, TournamentRound, TournamentBracket
+from django.contrib import admin, messages
+from django.db import models
+from django.shortcuts import redirect
+from django.urls import path
+from django.utils import timezone
+from django.utils.html import format_html
+from django.views.decorators.http import require_POST
+from . import jobs
+from .models import Region, Team, Room, Match, Timeslot, TournamentRound, TournamentBracket, ResultSubmission, Job
+from .participation import refresh_participation, retime_participation
 
 # Register your models here.
 
 admin.site.register(Region)
 admin.site.register(Room)
-admin.site.register(Timeslot)
 admin.site.register(TournamentBracket)
 admin.site.register(TournamentRound)
 
@@ -21,4 +28,82 @@ class MatchAdmin(admin.ModelAdmin):
     list_filter = ('room',)
     ordering = ('match_number',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_participation([obj.pk])
 
+    def delete_model(self, request, obj):
+        downstream = list(Match.objects.filter(
+            models.Q(home_source_match=obj) | models.Q(away_source_match=obj)
+        ).values_list('pk', flat=True))
+        super().delete_model(request, obj)
+        refresh_participation(downstream)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        # Rebuilding every schedule is slow, so let the worker do it
+        jobs.enqueue('refresh_participation', dedup_key='refresh_participation')
+        messages.info(request, 'Team schedules will be rebuilt in the background.')
+
+@admin.register(Timeslot)
+class TimeslotAdmin(admin.ModelAdmin):
+    ordering = ('start_time',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        retime_participation(obj)
+
+@admin.register(ResultSubmission)
+class ResultSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('key', 'match', 'home_score', 'away_score', 'status', 'submitted_by', 'created')
+    list_filter = ('status',)
+    search_fields = ('key',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'progress_bar', 'attempts', 'created', 'started', 'finished')
+    list_filter = ('status', 'kind')
+    readonly_fields = [field.name for field in Job._meta.fields]
+    actions = ['retry']
+    # Jobs that staff can start from the job list, deduplicated by kind
+    QUEUE_BUTTONS = [
+        ('export_static', 'Rebuild static site'),
+        ('refresh_participation', 'Rebuild team schedules'),
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Progress')
+    def progress_bar(self, job):
+        return format_html('<progress max="100" value="{}"></progress> {}', job.progress, job.message)
+
+    @admin.action(description='Run selected jobs again')
+    def retry(self, request, queryset):
+        # Only one pending job may hold a key, so retry the newest selected job of each
+        chosen, keys = [], set()
+        for job in queryset.exclude(status__in=[Job.Status.PENDING, Job.Status.RUNNING]).exclude(
+            dedup_key__in=Job.objects.filter(status=Job.Status.PENDING).exclude(dedup_key='').values('dedup_key')
+        ).order_by('-pk'):
+            if job.dedup_key and job.dedup_key in keys:
+                continue
+            keys.add(job.dedup_key)
+            job.status, job.attempts, job.run_after, job.finished = Job.Status.PENDING, 0, timezone.now(), None
+            chosen.append(job)
+        count = sum(jobs.save_requeued(job, ['status', 'attempts', 'run_after', 'finished']) for job in chosen)
+        self.message_user(request, f'Queued {count} jobs again.')
+
+    def get_urls(self):
+        return [
+            path('queue/<str:kind>/', self.admin_site.admin_view(require_POST(self.queue_view)), name='matches_job_queue'),
+        ] + super().get_urls()
+
+    def queue_view(self, request, kind):
+        if kind not in dict(self.QUEUE_BUTTONS) or not self.has_change_permission(request):
+            return redirect('admin:matches_job_changelist')
+        job = jobs.enqueue(kind, dedup_key=kind)
+        self.message_user(request, f'Queued {job}.')
+        return redirect('admin:matches_job_changelist')
+
+    def changelist_view(self, request, extra_context=None):
+        return super().changelist_view(request, {**(extra_context or {}), 'queue_buttons': self.QUEUE_BUTTONS})
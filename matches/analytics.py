@@ -0,0 +1,273 @@
+"""Schedule analytics for organizers: room use, team waits and the bracket's critical path.
+
+Everything is computed with NumPy from a few flat queries: a Timeslot x
+Room occupancy matrix from one aggregate query over the matches, the
+confirmed start times of every team from the participation table, and the
+bracket's source links. Reports are cached by change stamp, so the page
+only recomputes after the tournament changes.
+"""
+import csv
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Max, Value, When
+from django.utils import timezone
+from django.utils.dateformat import format as format_date
+from django.utils.html import escape
+
+from . import refcache
+from .models import Change, Match, Room, Team, TeamParticipation, Timeslot
+
+# What is in a cell of the occupancy matrix
+EMPTY, OPEN, READY, COMPLETE = 0, 1, 2, 3
+STATE_NAMES = {EMPTY: '', OPEN: 'open', READY: 'ready', COMPLETE: 'complete'}
+STATE_COLORS = {OPEN: '#cfe2ff', READY: '#198754', COMPLETE: '#6c757d'}
+
+# Lower edges, in minutes, of the team wait-time histogram
+WAIT_BINS = (0, 30, 60, 120, 240)
+
+CACHE_SECONDS = 600
+
+# Heatmap geometry
+CELL_WIDTH = 10
+CELL_HEIGHT = 14
+LABEL_WIDTH = 130
+DAY_GAP = 26
+LABEL_EVERY = 6
+
+
+class Occupancy:
+    """Cell states of every Timeslot x Room, with the slots in time order and the rooms by name"""
+
+    def __init__(self):
+        self.slots = sorted(refcache.table(Timeslot).values(), key=lambda slot: slot.start_time)
+        self.rooms = sorted(refcache.table(Room).values(), key=lambda room: room.name)
+        self.starts = np.array([slot.start_time.timestamp() for slot in self.slots], dtype=np.float64)
+        # Local day of each slot, numbered, so gaps never span a night
+        dates = [timezone.localtime(slot.start_time).date() for slot in self.slots]
+        self.dates = sorted(set(dates))
+        self.days = np.searchsorted(np.array(self.dates, dtype='datetime64[D]'), np.array(dates, dtype='datetime64[D]'))
+
+        row = {slot.pk: i for i, slot in enumerate(self.slots)}
+        column = {room.pk: j for j, room in enumerate(self.rooms)}
+        cells = Match.objects.filter(timeslot__isnull=False, room__isnull=False).values_list(
+            'timeslot_id', 'room_id',
+        ).annotate(state=Max(Case(
+            When(is_complete=True, then=Value(COMPLETE)),
+            When(home_team__isnull=False, away_team__isnull=False, then=Value(READY)),
+            default=Value(OPEN), output_field=IntegerField(),
+        ))).order_by()
+        self.matrix = np.zeros((len(self.slots), len(self.rooms)), dtype=np.int8)
+        cells = np.array([(row[s], column[r], state) for s, r, state in cells], dtype=np.int64).reshape(-1, 3)
+        self.matrix[cells[:, 0], cells[:, 1]] = cells[:, 2]
+        self.busy = self.matrix > EMPTY
+
+    def day_of(self, timestamps):
+        """Day numbers of timestamps that are slot start times"""
+        if not self.slots:
+            return np.zeros(timestamps.size, dtype=np.int64)
+        return self.days[np.searchsorted(self.starts, timestamps).clip(max=len(self.slots) - 1)]
+
+    def slot_seconds(self):
+        """The shortest gap between slots, taken as the length of a match"""
+        gaps = np.diff(self.starts)
+        gaps = gaps[gaps > 0]
+        return float(gaps.min()) if gaps.size else 3600.0
+
+
+def room_stats(occupancy, length):
+    """Per room: matches, share of all slots used, and idle gaps between its first and last match each day"""
+    busy, starts, days = occupancy.busy, occupancy.starts, occupancy.days
+    used = busy.sum(axis=0)
+    slots = max(len(occupancy.slots), 1)
+    stats = []
+    for j, room in enumerate(occupancy.rooms):
+        taken = np.flatnonzero(busy[:, j])
+        same_day = days[taken[1:]] == days[taken[:-1]]
+        gaps = (starts[taken[1:]] - starts[taken[:-1]] - length)[same_day] / 60
+        gaps = gaps[gaps > 0]
+        stats.append({
+            'room': room.name,
+            'matches': int(used[j]),
+            'utilization': round(100 * float(used[j]) / slots, 1),
+            'gaps': int(gaps.size),
+            'idle_minutes': int(gaps.sum()),
+            'longest_gap': int(gaps.max()) if gaps.size else 0,
+        })
+    return stats
+
+
+def slot_load(occupancy):
+    """Fraction of rooms in use in each slot"""
+    return occupancy.busy.sum(axis=1) / max(len(occupancy.rooms), 1)
+
+
+def team_waits(occupancy, length):
+    """Distribution of the time teams wait between matches on the same day, from confirmed schedules"""
+    rows = np.array([
+        (team, start.timestamp()) for team, start in TeamParticipation.objects.filter(
+            confirmed=True, start_time__isnull=False,
+        ).values_list('team_id', 'start_time')
+    ], dtype=np.float64).reshape(-1, 2)
+    order = np.lexsort((rows[:, 1], rows[:, 0]))
+    teams, starts = rows[order, 0].astype(np.int64), rows[order, 1]
+    # Participations carry their timeslot's start time, so the slot gives the day
+    local_days = occupancy.day_of(starts)
+
+    following = (teams[1:] == teams[:-1]) & (local_days[1:] == local_days[:-1])
+    waits = (starts[1:] - starts[:-1] - length)[following] / 60
+    waiting = teams[1:][following]
+
+    # Overlapping matches show up as negative waits, and get a bin of their own
+    counts, _ = np.histogram(waits, bins=[-np.inf] + list(WAIT_BINS) + [np.inf])
+    labels = ['Overlapping'] + [f'{low}–{high} min' for low, high in zip(WAIT_BINS, WAIT_BINS[1:])] + [f'{WAIT_BINS[-1]}+ min']
+    clashes = waits < 0
+    longest = []
+    if waits.size:
+        ids, inverse = np.unique(waiting, return_inverse=True)
+        worst = np.full(ids.size, -np.inf)
+        np.maximum.at(worst, inverse, waits)
+        names = refcache.table(Team)
+        for k in np.argsort(worst)[::-1][:5]:
+            team = names.get(int(ids[k]))
+            longest.append({'team': team.display_name if team else ids[k], 'minutes': int(worst[k])})
+    return {
+        'count': int(waits.size),
+        'histogram': [
+            {'label': label, 'count': int(count), 'percent': round(100 * float(count) / max(waits.size, 1), 1)}
+            for label, count in zip(labels, counts)
+        ],
+        'median': int(np.median(waits)) if waits.size else 0,
+        'p90': int(np.percentile(waits, 90)) if waits.size else 0,
+        'back_to_back': int(np.count_nonzero(waits == 0)),
+        'clashes': int(np.count_nonzero(clashes)),
+        'longest': longest,
+    }
+
+
+def critical_path(occupancy, length):
+    """Longest chain of matches that feed each other, and how tightly the schedule follows it"""
+    rows = list(Match.objects.values_list('id', 'home_source_match_id', 'away_source_match_id', 'timeslot_id'))
+    if not rows:
+        return {'matches': 0, 'minimum_minutes': 0, 'span_minutes': 0, 'conflicts': 0, 'tight': 0}
+    ids = np.array([row[0] for row in rows])
+    order = np.argsort(ids)
+    ids = ids[order]
+
+    def index(values):
+        values = np.array([-1 if v is None else v for v in values])[order]
+        found = np.searchsorted(ids, values).clip(max=ids.size - 1)
+        return np.where((values >= 0) & (ids[found] == values), found, -1)
+
+    home, away = index(row[1] for row in rows), index(row[2] for row in rows)
+    slot_start = {slot.pk: slot.start_time.timestamp() for slot in occupancy.slots}
+    starts = np.array([slot_start.get(row[3], np.nan) for row in rows])[order]
+
+    # Each pass settles one more level of the bracket
+    depth = np.ones(ids.size, dtype=np.int64)
+    for _ in range(ids.size):
+        deeper = np.maximum(np.where(home >= 0, depth[home] + 1, 1), np.where(away >= 0, depth[away] + 1, 1))
+        if np.array_equal(deeper, depth):
+            break
+        depth = deeper
+
+    conflicts = tight = 0
+    for source in (home, away):
+        linked = (source >= 0) & ~np.isnan(starts)
+        linked[linked] &= ~np.isnan(starts[source[linked]])
+        slack = starts[linked] - (starts[source[linked]] + length)
+        conflicts += int(np.count_nonzero(slack < 0))
+        tight += int(np.count_nonzero(slack == 0))
+    scheduled = starts[~np.isnan(starts)]
+    return {
+        'matches': int(depth.max()),
+        'minimum_minutes': int(depth.max() * length / 60),
+        'span_minutes': int((scheduled.max() - scheduled.min() + length) / 60) if scheduled.size else 0,
+        # Matches set to start before a match they depend on has finished
+        'conflicts': conflicts,
+        'tight': tight,
+    }
+
+
+def heatmap(occupancy):
+    """SVG of the occupancy matrix: a band per day, a row per room, a column per slot"""
+    load = slot_load(occupancy)
+    parts, y, width = [], 0, LABEL_WIDTH
+    for day_number, day in enumerate(occupancy.dates):
+        rows = np.flatnonzero(occupancy.days == day_number)
+        width = max(width, LABEL_WIDTH + rows.size * CELL_WIDTH)
+        parts.append(f'<text x="0" y="{y + 16}" font-weight="bold">{format_date(day, "l, F j")}</text>')
+        y += DAY_GAP
+        # Times along the top
+        for k in range(0, rows.size, LABEL_EVERY):
+            label = format_date(timezone.localtime(occupancy.slots[rows[k]].start_time), 'g:i')
+            parts.append(f'<text x="{LABEL_WIDTH + k * CELL_WIDTH}" y="{y + 10}" font-size="10">{label}</text>')
+        y += CELL_HEIGHT
+        # How full each slot is, darker when every room is in use
+        parts.append(f'<text x="0" y="{y + 11}" font-size="11" fill="#dc3545">Rooms in use</text>')
+        for k, share in enumerate(load[rows]):
+            if share:
+                parts.append(
+                    f'<rect x="{LABEL_WIDTH + k * CELL_WIDTH}" y="{y}" width="{CELL_WIDTH}" height="{CELL_HEIGHT - 2}" '
+                    f'fill="#dc3545" fill-opacity="{share:.2f}"><title>{share:.0%}</title></rect>'
+                )
+        y += CELL_HEIGHT
+        for j, room in enumerate(occupancy.rooms):
+            states = occupancy.matrix[rows, j]
+            parts.append(f'<text x="0" y="{y + 11}" font-size="11">{escape(room.name)}</text>')
+            parts.append(
+                f'<rect x="{LABEL_WIDTH}" y="{y}" width="{rows.size * CELL_WIDTH}" height="{CELL_HEIGHT - 2}" fill="#f8f9fa"/>'
+            )
+            # One rectangle per run of equal cells
+            changes = np.flatnonzero(np.diff(states)) + 1
+            for first, end in zip(np.r_[0, changes], np.r_[changes, states.size]):
+                if states.size and states[first] != EMPTY:
+                    parts.append(
+                        f'<rect x="{LABEL_WIDTH + first * CELL_WIDTH}" y="{y}" width="{(end - first) * CELL_WIDTH}" '
+                        f'height="{CELL_HEIGHT - 2}" fill="{STATE_COLORS[states[first]]}"/>'
+                    )
+            y += CELL_HEIGHT
+        y += DAY_GAP // 2
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {y}" width="{width}" height="{y}" '
+        f'font-family="sans-serif" font-size="12">{"".join(parts)}</svg>'
+    )
+
+
+def report():
+    """Everything the analytics page shows, recomputed only when the tournament has changed"""
+    stamp = Change.latest()
+    key = f'analytics:{stamp}'
+    result = cache.get(key)
+    if result is None:
+        occupancy = Occupancy()
+        length = occupancy.slot_seconds()
+        load = slot_load(occupancy)
+        full = np.flatnonzero(load >= 1)
+        result = {
+            'slots': len(occupancy.slots),
+            'rooms': room_stats(occupancy, length),
+            'utilization': round(100 * float(occupancy.busy.mean()), 1) if occupancy.busy.size else 0,
+            'match_minutes': int(length / 60),
+            'full_slots': [occupancy.slots[i].start_time for i in full],
+            'idle_slots': int(np.count_nonzero(load == 0)),
+            'waits': team_waits(occupancy, length),
+            'critical_path': critical_path(occupancy, length),
+            'heatmap': heatmap(occupancy),
+        }
+        cache.set(key, result, CACHE_SECONDS)
+    return result
+
+
+def write_csv(output):
+    """The occupancy matrix as CSV: a row per slot, a column per room, and the share of rooms in use"""
+    occupancy = Occupancy()
+    load = slot_load(occupancy)
+    writer = csv.writer(output)
+    writer.writerow(['start'] + [room.name for room in occupancy.rooms] + ['rooms in use'])
+    for i, slot in enumerate(occupancy.slots):
+        writer.writerow(
+            [timezone.localtime(slot.start_time).isoformat()]
+            + [STATE_NAMES[state] for state in occupancy.matrix[i].tolist()]
+            + [f'{load[i]:.2f}']
+        )
@@ -0,0 +1,183 @@
+"""Read-only JSON API (api/v1/).
+
+Every endpoint returns {"version": ..., "results": [...], "deleted": [...]}.
+version is the change stamp the payload is current to. Passing it back as
+?since=<version> returns only the rows that changed after it (including
+rows whose flattened-in names changed) plus the ids of deleted rows, so a
+poller only ever downloads what is new.
+
+The endpoints are async views: under ASGI a poll does not hold a thread
+while it waits on the database.
+
+whatif/ is the odd one out: it returns a team's schedule under a set of
+hypothetical results rather than rows (see matches.whatif).
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from . import refcache, serializers, whatif
+from .microcache import micro_cache
+from .models import Change, Match, Region, Room, Team, Timeslot, TournamentBracket, TournamentRound
+
+
+class BadRequest(Exception):
+    pass
+
+
+async def changed_ids(since, model):
+    """Ids of model rows saved and deleted after change since"""
+    saved, deleted = set(), set()
+    changes = Change.objects.filter(pk__gt=since, model_name=model._meta.model_name).order_by('pk')
+    async for object_id, was_deleted in changes.values_list('object_id', 'deleted'):
+        if was_deleted:
+            deleted.add(object_id)
+            saved.discard(object_id)
+        else:
+            saved.add(object_id)
+            deleted.discard(object_id)
+    return saved, deleted
+
+
+def parse_since(request):
+    value = request.GET.get('since')
+    if value in (None, ''):
+        return None
+    try:
+        since = int(value)
+    except ValueError:
+        raise BadRequest("since must be a version number")
+    if since < 0:
+        raise BadRequest("since must be a version number")
+    return since
+
+
+def api_view(load):
+    """Wrap async load(since) -> (results, deleted ids) into a versioned JSON GET endpoint"""
+    @require_GET
+    @micro_cache
+    async def view(request):
+        try:
+            since = parse_since(request)
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        # Read the stamp first: anything saved while we load is sent again next time
+        version = await Change.alatest()
+        results, deleted = await load(since)
+        return JsonResponse({'version': version, 'results': results, 'deleted': sorted(deleted)})
+    view.__doc__ = load.__doc__
+    view.__name__ = load.__name__
+    return view
+
+
+async def load_matches(since):
+    """Matches, with round, room, start time and team names flattened in"""
+    queryset = Match.objects.all()
+    deleted = set()
+    if since is not None:
+        saved, deleted = await changed_ids(since, Match)
+        teams, _ = await changed_ids(since, Team)
+        rooms, _ = await changed_ids(since, Room)
+        timeslots, _ = await changed_ids(since, Timeslot)
+        rounds, _ = await changed_ids(since, TournamentRound)
+        queryset = queryset.filter(
+            Q(pk__in=saved) | Q(home_team__in=teams) | Q(away_team__in=teams) | Q(room__in=rooms)
+            | Q(timeslot__in=timeslots) | Q(tournament_round__in=rounds)
+        )
+    return [serializers.match_data(m) for m in await serializers.aload_matches(queryset)], deleted
+
+
+async def load_teams(since):
+    """Teams, with region name and colour flattened in"""
+    teams = (await refcache.atable(Team)).values()
+    deleted = set()
+    if since is not None:
+        saved, deleted = await changed_ids(since, Team)
+        regions, _ = await changed_ids(since, Region)
+        teams = [t for t in teams if t.pk in saved or t.region_id in regions]
+    return [serializers.team_data(t) for t in teams], deleted
+
+
+async def load_rooms(since):
+    """Rooms"""
+    rooms = (await refcache.atable(Room)).values()
+    deleted = set()
+    if since is not None:
+        saved, deleted = await changed_ids(since, Room)
+        rooms = [r for r in rooms if r.pk in saved]
+    return [serializers.room_data(r) for r in rooms], deleted
+
+
+async def load_timeslots(since):
+    """Timeslots in time order"""
+    timeslots = sorted((await refcache.atable(Timeslot)).values(), key=lambda t: t.start_time)
+    deleted = set()
+    if since is not None:
+        saved, deleted = await changed_ids(since, Timeslot)
+        timeslots = [t for t in timeslots if t.pk in saved]
+    return [serializers.timeslot_data(t) for t in timeslots], deleted
+
+
+async def load_brackets(since):
+    """Brackets in priority order, each with its rounds"""
+    brackets = sorted((await refcache.atable(TournamentBracket)).values(), key=lambda b: b.priority)
+    rounds = (await refcache.atable(TournamentRound)).values()
+    deleted = set()
+    if since is not None:
+        saved, deleted = await changed_ids(since, TournamentBracket)
+        changed_rounds, deleted_rounds = await changed_ids(since, TournamentRound)
+        if deleted_rounds:
+            # We no longer know which bracket a deleted round was in
+            saved = {b.pk for b in brackets}
+        saved |= {r.bracket_id for r in rounds if r.pk in changed_rounds}
+        brackets = [b for b in brackets if b.pk in saved]
+    return [serializers.bracket_data(b, rounds) for b in brackets], deleted
+
+
+matches = api_view(load_matches)
+teams = api_view(load_teams)
+rooms = api_view(load_rooms)
+timeslots = api_view(load_timeslots)
+brackets = api_view(load_brackets)
+
+
+def _numbers(request, name):
+    """A list of whole numbers from repeated or comma-separated query parameters"""
+    try:
+        return [int(value) for values in request.GET.getlist(name) for value in values.split(',') if value.strip()]
+    except ValueError:
+        raise BadRequest(f"{name} must be match numbers")
+
+
+def parse_scenario(request):
+    try:
+        team_id = int(request.GET.get('team', ''))
+    except ValueError:
+        raise BadRequest("team must be a team id")
+    winners = []
+    for value in request.GET.getlist('winner'):
+        number, _, team = value.partition(':')
+        try:
+            winners.append((int(number), int(team)))
+        except ValueError:
+            raise BadRequest("winner must be <match number>:<team id>")
+    return team_id, _numbers(request, 'won'), _numbers(request, 'lost'), winners
+
+
+@require_GET
+@micro_cache
+async def whatif_view(request):
+    """Where a team plays next if some results go a given way.
+
+    ?team=<id>&won=14&lost=22 plays the team's own matches, and
+    winner=<match number>:<team id> (repeatable) sets anyone else's. The
+    scenario is worked out on an in-memory copy of the bracket and nothing is
+    saved, so coaches can try as many as they like.
+    """
+    try:
+        team_id, won, lost, winners = parse_scenario(request)
+        result = await sync_to_async(whatif.schedule)(team_id, won, lost, winners)
+    except (BadRequest, whatif.ScenarioError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(result)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MatchesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'matches'
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401
+        # Before any connection opens, so every one gets the query timer
+        metrics.instrument_queries()
@@ -0,0 +1,172 @@
+"""Helpers shared by the benchmark and load-test commands"""
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+
+
+@contextmanager
+def scratch_database(options=None, conn_max_age=None):
+    """Point the default database at a fresh, migrated temporary SQLite file for the block.
+
+    options and conn_max_age temporarily replace the configured OPTIONS and
+    CONN_MAX_AGE, so the same code can be measured under different settings.
+    Every connection opened inside the block, on any thread, uses the file.
+    """
+    settings_dict = connection.settings_dict
+    saved = (settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE'], settings_dict['TEST'].get('NAME'))
+    directory = tempfile.mkdtemp(prefix='tourneyman-')
+    path = os.path.join(directory, 'scratch.sqlite3')
+
+    if options is not None:
+        settings_dict['OPTIONS'] = options
+    if conn_max_age is not None:
+        settings_dict['CONN_MAX_AGE'] = conn_max_age
+    settings_dict['TEST']['NAME'] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield path
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE'], settings_dict['TEST']['NAME'] = saved
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+def percentile(values, pct):
+    """The pct-th percentile of values (nearest rank), or 0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(ThreadedWSGIServer):
+    """Hands connections to a fixed pool of threads, as a threaded WSGI worker (gunicorn --threads) does"""
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def serve_wsgi(application, threads=None):
+    """Serve a WSGI application on a free loopback port; yields (host, port).
+
+    Connections get a thread each, or wait for one of a pool of threads.
+    """
+    if threads:
+        server = PooledWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=True, threads=threads)
+    else:
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=True)
+    server.set_app(application)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[:2]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextmanager
+def serve_asgi(application):
+    """Serve an ASGI application on a free loopback port from one event loop thread; yields (host, port).
+
+    A bare HTTP/1.1 front end, one request per connection with no keep-alive
+    or chunking, so that benchmarks need no ASGI server installed. Deploy
+    behind uvicorn or daphne instead.
+    """
+    loop = asyncio.new_event_loop()
+    address = concurrent.futures.Future()
+    stop = asyncio.Event()
+
+    async def serve():
+        server = await asyncio.start_server(lambda r, w: _asgi_connection(application, r, w), '127.0.0.1', 0)
+        address.set_result(server.sockets[0].getsockname()[:2])
+        async with server:
+            await stop.wait()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    thread.start()
+    try:
+        yield address.result()
+    finally:
+        loop.call_soon_threadsafe(stop.set)
+        thread.join()
+        loop.close()
+
+
+async def _asgi_connection(application, reader, writer):
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+        request_line, *lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = request_line.split(' ', 2)
+        headers = []
+        for line in filter(None, lines):
+            name, _, value = line.partition(':')
+            headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+        body = await reader.readexactly(int(dict(headers).get(b'content-length', 0)))
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        writer.close()
+        return
+
+    path, _, query = target.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': method, 'path': path, 'raw_path': path.encode('latin-1'),
+        'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+        'client': writer.get_extra_info('peername')[:2], 'server': writer.get_extra_info('sockname')[:2],
+    }
+    # Anything after the request, including end of file, means the client has gone
+    gone = asyncio.ensure_future(reader.read(1))
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.shield(gone)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            writer.write(
+                f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'.encode('latin-1')
+                + b''.join(name + b': ' + value + b'\r\n' for name, value in message.get('headers', ()))
+                + b'Connection: close\r\n\r\n'
+            )
+        elif message['type'] == 'http.response.body':
+            writer.write(message.get('body', b''))
+            await writer.drain()
+
+    try:
+        await application(scope, receive, send)
+    except ConnectionError:
+        pass
+    finally:
+        gone.cancel()
+        writer.close()
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models import Q
+from .models import Change, Match
+from .participation import refresh_participation
+
+
+def result_team_id(match, take_winner):
+    """Id of the team that a winner/loser slot fed by this match should hold"""
+    if not match.is_complete or match.home_score is None or match.away_score is None:
+        return None
+    if match.home_score == match.away_score:
+        return None
+    home_won = match.home_score > match.away_score
+    return match.home_team_id if home_won == take_winner else match.away_team_id
+
+
+def propagate_results(matches):
+    """Move winners and losers of the given matches into their destination slots.
+
+    This is a single pass over the affected part of the bracket: each level of
+    destinations is fetched with one query, destinations that already have a
+    result are followed further (so a corrected score flows all the way down),
+    and every changed row is written with one bulk_update at the end. Only
+    edges towards higher match numbers are followed, so a bad source link can
+    never send this round in circles. The team schedules of everything
+    downstream are refreshed in the same transaction.
+    """
+    loaded = {}
+    changed = {}
+    frontier = {m.pk: m for m in matches}
+
+    with transaction.atomic():
+        while frontier:
+            frontier = _propagate_level(frontier, loaded, changed)
+        Match.objects.bulk_update(changed.values(), ['home_team', 'away_team', 'version'])
+        Change.record(Match, changed.keys())
+        refresh_participation([m.pk for m in matches])
+    return list(changed.values())
+
+
+def _propagate_level(frontier, loaded, changed):
+    # Lock just the destination rows (a no-op on SQLite, which locks the whole file on write)
+    destinations = Match.objects.select_for_update().filter(
+        Q(home_source_match__in=frontier.keys()) | Q(away_source_match__in=frontier.keys())
+    )
+    next_frontier = {}
+    for dest in destinations:
+        # Reuse our copy if an earlier level already changed this row
+        dest = loaded.setdefault(dest.pk, dest)
+        updated = False
+        home_source = frontier.get(dest.home_source_match_id)
+        if home_source and home_source.match_number < dest.match_number:
+            team_id = result_team_id(home_source, dest.home_source_take_winner)
+            if dest.home_team_id != team_id:
+                dest.home_team_id = team_id
+                updated = True
+        away_source = frontier.get(dest.away_source_match_id)
+        if away_source and away_source.match_number < dest.match_number:
+            team_id = result_team_id(away_source, dest.away_source_take_winner)
+            if dest.away_team_id != team_id:
+                dest.away_team_id = team_id
+                updated = True
+        if updated:
+            if dest.pk not in changed:
+                dest.version += 1
+            changed[dest.pk] = dest
+            if dest.is_complete:
+                next_frontier[dest.pk] = dest
+    return next_frontier
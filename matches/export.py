@@ -0,0 +1,250 @@
+"""Writes the public site out as static files (see the export_static command).
+
+Every public page is saved as <path>/index.html, with its JSON equivalent
+next to it as <path>/index.json, so a plain file server can serve the site
+with the same URLs. The resized room maps the room pages link to are saved
+under /rooms/maps/ as well. The paged matches list is saved as /matches/ and
+/matches/page/<n>/, with its "later matches" links rewritten to suit.
+"""
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import resolve
+
+from . import export_worker, images, refcache, serializers
+from .models import Change, Match, Region, Room, Team, TeamParticipation, TournamentBracket, TournamentRound
+
+MATCHES_LIST = '/matches/'
+
+# More changes than this at once and rewriting everything is simpler
+AFFECTED_LIMIT = 200
+
+# Changes to these can alter almost any page
+SITEWIDE_MODELS = ('region', 'tournamentbracket', 'tournamentround')
+
+
+def default_output():
+    return os.path.join(settings.BASE_DIR, 'site')
+
+
+def all_paths():
+    """Every public page"""
+    paths = ['/', '/teams/', '/regions/', '/rooms/', MATCHES_LIST, '/brackets/']
+    for pk in Team.objects.values_list('pk', flat=True):
+        paths += [f'/teams/{pk}/', f'/teams/{pk}/calendar.ics']
+    paths += [f'/regions/{pk}/' for pk in Region.objects.values_list('pk', flat=True)]
+    for room in Room.objects.only('map', 'map_images'):
+        paths += [f'/rooms/{room.pk}/'] + images.image_paths(room)
+    paths += [f'/matches/{pk}/' for pk in Match.objects.values_list('pk', flat=True)]
+    return paths
+
+
+def affected_paths(changes):
+    """Pages that show any of the changed rows, or None if everything should be rewritten.
+
+    changes are (model_name, object_id, deleted) tuples from the change log.
+    """
+    if len(changes) > AFFECTED_LIMIT:
+        return None
+    paths = set()
+    match_ids, team_ids, room_ids, timeslot_ids = set(), set(), set(), set()
+    for model_name, object_id, deleted in changes:
+        if model_name in SITEWIDE_MODELS or deleted:
+            # A deleted row leaves pages behind that only a full export removes
+            return None
+        {'match': match_ids, 'team': team_ids, 'room': room_ids, 'timeslot': timeslot_ids}[model_name].add(object_id)
+
+    if team_ids:
+        paths.add('/teams/')
+        match_ids |= set(TeamParticipation.objects.filter(team__in=team_ids).values_list('match_id', flat=True))
+        paths |= {f'/regions/{pk}/' for pk in Team.objects.filter(pk__in=team_ids).values_list('region_id', flat=True)}
+    if room_ids:
+        paths.add('/rooms/')
+        match_ids |= set(Match.objects.filter(room__in=room_ids).values_list('pk', flat=True))
+    if timeslot_ids:
+        match_ids |= set(Match.objects.filter(timeslot__in=timeslot_ids).values_list('pk', flat=True))
+
+    if match_ids:
+        paths |= {MATCHES_LIST, '/brackets/'}
+        rows = Match.objects.filter(pk__in=match_ids).values_list('pk', 'room_id')
+        for pk, room_id in rows:
+            paths.add(f'/matches/{pk}/')
+            if room_id:
+                room_ids.add(room_id)
+        team_ids |= set(TeamParticipation.objects.filter(match__in=match_ids).values_list('team_id', flat=True))
+    for pk in team_ids:
+        paths |= {f'/teams/{pk}/', f'/teams/{pk}/calendar.ics'}
+    for room in Room.objects.filter(pk__in=room_ids).only('map', 'map_images'):
+        paths |= {f'/rooms/{room.pk}/', *images.image_paths(room)}
+    return paths
+
+
+def page_data(path):
+    """The JSON equivalent of a page, or None for pages without one"""
+    match = resolve(path)
+    kwargs = match.kwargs
+    if match.url_name == 'teams_list':
+        return [serializers.team_data(t) for t in refcache.table(Team).values()]
+    if match.url_name == 'regions_list':
+        return [serializers.region_data(r) for r in refcache.table(Region).values()]
+    if match.url_name == 'rooms_list':
+        return [serializers.room_data(r) for r in refcache.table(Room).values()]
+    if match.url_name == 'matches_list':
+        return serializers.all_matches()
+    if match.url_name == 'brackets':
+        rounds = refcache.table(TournamentRound).values()
+        return [serializers.bracket_data(b, rounds) for b in TournamentBracket.objects.order_by('priority')]
+    if match.url_name == 'team_detail':
+        team = refcache.table(Team)[kwargs['team_id']]
+        schedule = list(team.schedule())
+        matches = serializers.load_matches(Match.objects.filter(pk__in={p.match_id for p in schedule}))
+        confirmed = {p.match_id for p in schedule if p.confirmed}
+        return dict(serializers.team_data(team), matches=[
+            dict(serializers.match_data(m), confirmed=m.pk in confirmed) for m in matches
+        ])
+    if match.url_name == 'region_detail':
+        region = refcache.table(Region)[kwargs['region_id']]
+        teams = [t for t in refcache.table(Team).values() if t.region_id == region.pk]
+        return dict(serializers.region_data(region), teams=[serializers.team_data(t) for t in teams])
+    if match.url_name == 'room_detail':
+        room = refcache.table(Room)[kwargs['room_id']]
+        matches = serializers.load_matches(Match.objects.filter(room=room))
+        return dict(serializers.room_data(room), matches=[serializers.match_data(m) for m in matches])
+    if match.url_name == 'match_detail':
+        return serializers.match_data(serializers.load_matches(Match.objects.filter(pk=kwargs['match_id']))[0])
+    return None
+
+
+def file_for(output, path, name='index.html'):
+    """Where a page lives under output: directories get an index file"""
+    relative = path.strip('/')
+    if path.endswith('/'):
+        return os.path.join(output, relative, name)
+    return os.path.join(output, relative)
+
+
+def write_file(filename, content):
+    """Write atomically, so the file server never hands out half a page"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, filename)
+
+
+def site_client():
+    """A test client that passes the ALLOWED_HOSTS check of the real settings"""
+    hosts = [h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')]
+    return Client(HTTP_HOST=hosts[0] if hosts else 'localhost')
+
+
+def fetch(client, path):
+    response = client.get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f'{path} returned {response.status_code}')
+    # Room maps come back as streamed files
+    return response.getvalue()
+
+
+def export_paths(output, paths, progress=None):
+    """Render the given pages (and their JSON) into output; returns how many files were written.
+
+    progress, if given, is called with (pages done, pages in all) after each page.
+    """
+    client = site_client()
+    written = 0
+    with override_settings(MICRO_CACHE_SECONDS=0):
+        for done, path in enumerate(paths, 1):
+            if path == MATCHES_LIST:
+                written += export_matches_list(client, output)
+            else:
+                write_file(file_for(output, path), fetch(client, path))
+                written += 1
+            if path.endswith('/'):
+                data = page_data(path)
+                if data is not None:
+                    write_file(file_for(output, path, 'index.json'), json.dumps(data).encode())
+                    written += 1
+            if progress is not None:
+                progress(done, len(paths))
+    return written
+
+
+def build_site(output, workers=0, progress=None):
+    """Render every page into a fresh directory, then swap it in place of output; returns (files, pages).
+
+    With workers, pages are rendered by that many processes.
+    """
+    stamp = Change.latest()
+    paths = all_paths()
+    building = output.rstrip(os.sep) + '.building'
+    shutil.rmtree(building, ignore_errors=True)
+
+    if workers:
+        # Each worker opens its own database connection
+        connections.close_all()
+        chunks = [paths[i::workers * 4] for i in range(workers * 4)]
+        context = multiprocessing.get_context('spawn')
+        written = done = 0
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=export_worker.setup) as pool:
+            for chunk, count in zip(chunks, pool.map(export_worker.export_chunk, [building] * len(chunks), chunks)):
+                written += count
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, len(paths))
+    else:
+        written = export_paths(building, paths, progress)
+    write_stamp(building, stamp)
+
+    previous = output.rstrip(os.sep) + '.previous'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.isdir(output):
+        os.replace(output, previous)
+    os.replace(building, output)
+    shutil.rmtree(previous, ignore_errors=True)
+    return written, len(paths)
+
+
+def export_matches_list(client, output):
+    """Follow the matches list page by page, pointing each page's links at the saved copies"""
+    path, number = MATCHES_LIST, 1
+    while path:
+        html = fetch(client, path).decode()
+        cursor = re.search(r'href="\?after=([^"&]+)"', html)
+        html = re.sub(r'href="\?after=[^"&]+"', f'href="{MATCHES_LIST}page/{number + 1}/"', html)
+        html = html.replace('href="?"', f'href="{MATCHES_LIST}"')
+        saved = MATCHES_LIST if number == 1 else f'{MATCHES_LIST}page/{number}/'
+        write_file(file_for(output, saved), html.encode())
+        path = f'{MATCHES_LIST}?after={cursor.group(1)}' if cursor else None
+        number += 1
+
+    # Drop pages left over from when the list was longer
+    pages = os.path.join(output, MATCHES_LIST.strip('/'), 'page')
+    stale = number
+    while os.path.isdir(os.path.join(pages, str(stale))):
+        shutil.rmtree(os.path.join(pages, str(stale)))
+        stale += 1
+    return number - 1
+
+
+def read_stamp(output):
+    try:
+        with open(os.path.join(output, '.stamp')) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_stamp(output, stamp):
+    write_file(os.path.join(output, '.stamp'), str(stamp).encode())
+
+
+def changes_since(stamp, latest):
+    return list(Change.objects.filter(pk__gt=stamp, pk__lte=latest).values_list('model_name', 'object_id', 'deleted'))
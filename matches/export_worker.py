@@ -0,0 +1,19 @@
+"""Process pool entry points for export_static.
+
+Nothing here imports models at module level, so a freshly spawned worker
+can load this module before Django is set up.
+"""
+
+
+def setup():
+    import django
+    django.setup()
+
+
+def export_chunk(output, paths):
+    from django.db import connection
+    from matches.export import export_paths
+    try:
+        return export_paths(output, paths)
+    finally:
+        connection.close()
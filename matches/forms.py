@@ -1,6 +1,12 @@
 from django import forms
-from .models import Region, Team, Room, Timeslot, Match
-from datetime import datetime, timedelta
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.forms import BaseModelFormSet, modelformset_factory
+from .bracket import propagate_results
+from .models import Region, Team, Room, Timeslot, Match, MatchVersionConflict, QuestionEvent, Change, TournamentBracket, TournamentRound
+from .participation import refresh_participation
+from datetime import date, datetime, time, timedelta
+import re
 from django.utils import timezone
 
 class RegionForm(forms.ModelForm):
@@ -29,8 +35,51 @@ class TimeslotForm(forms.ModelForm):
             'start_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
         }
 
-class MatchForm(forms.ModelForm):
+class VersionedMatchFormMixin:
+    """Carries the Match version through the form so a save can detect edits made by someone else"""
+    # Fields listed when explaining a conflict
+    conflict_fields = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['version'] = forms.IntegerField(
+            widget=forms.HiddenInput, initial=self.instance.version, required=bool(self.instance.pk)
+        )
+
+    def save_versioned(self, instance, update_fields):
+        instance.version = self.cleaned_data['version']
+        instance.save_versioned(update_fields)
+
+    def conflict_value(self, match, name):
+        return getattr(match, name)
+
+    def show_conflict(self, current):
+        """Explain what changed underneath this form, and let a resubmit overwrite it"""
+        if current is None:
+            self.add_error(None, "This match was deleted by someone else.")
+            return
+        changes = []
+        for name in self.conflict_fields:
+            mine = self.cleaned_data.get(name)
+            theirs = self.conflict_value(current, name)
+            if mine != theirs:
+                changes.append(f"{self.fields[name].label}: you entered {mine if mine is not None else 'nothing'}, "
+                               f"it is now {theirs if theirs is not None else 'nothing'}")
+        self.add_error(None, "Someone else changed this match while you were editing it. "
+                             "Submit again to overwrite their changes.")
+        for change in changes:
+            self.add_error(None, change)
+        # Resubmitting this form now counts as having seen the newer version
+        self.data = self.data.copy()
+        self.data[self.add_prefix('version')] = current.version
+
+class MatchForm(VersionedMatchFormMixin, forms.ModelForm):
     slot_selection = forms.ChoiceField(choices=[])
+    conflict_fields = [
+        'match_number', 'slot_selection', 'tournament_round',
+        'home_team', 'home_source_match', 'home_source_take_winner',
+        'away_team', 'away_source_match', 'away_source_take_winner',
+    ]
     class Meta:
         model = Match
         fields = [
@@ -45,7 +94,7 @@ class MatchForm(forms.ModelForm):
         ]
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        taken = Match.objects.values_list('timeslot_id', 'room_id')
+        taken = Match.objects.exclude(pk=self.instance.pk).values_list('timeslot_id', 'room_id')
         available_choices = []
         for ts in Timeslot.objects.all():
             for rm in Room.objects.all():
@@ -54,6 +103,8 @@ class MatchForm(forms.ModelForm):
                         (f"{ts.id}-{rm.id}", f"{ts} (in {rm})")
                     )
         self.fields['slot_selection'].choices=available_choices
+        if self.instance.pk and self.instance.timeslot_id and self.instance.room_id:
+            self.fields['slot_selection'].initial = f"{self.instance.timeslot_id}-{self.instance.room_id}"
 
         if not self.instance.pk: # If we have a new record...
             used_numbers = set(Match.objects.values_list('match_number', flat=True))
@@ -62,13 +113,44 @@ class MatchForm(forms.ModelForm):
                 next_num += 1
             self.fields['match_number'].initial = next_num
     
+    def conflict_value(self, match, name):
+        if name == 'slot_selection':
+            return f"{match.timeslot_id}-{match.room_id}"
+        return super().conflict_value(match, name)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        slot = cleaned_data.get('slot_selection')
+        if slot:
+            start_time = Timeslot.objects.filter(pk=slot.split('-')[0]).values_list('start_time', flat=True).first()
+            for name in ('home_team', 'away_team'):
+                team = cleaned_data.get(name)
+                if not team:
+                    continue
+                clash = team.participations.filter(start_time=start_time, confirmed=True).exclude(
+                    match_id=self.instance.pk
+                ).select_related('match').first()
+                if clash:
+                    self.add_error(name, f"{team} already plays match {clash.match.match_number} at that time.")
+        return cleaned_data
+
     def save(self, commit=True):
         ts_id, rm_id = self.cleaned_data['slot_selection'].split('-')
-        self.instance.timeslot_id = ts_id
-        self.instance.room_id = rm_id
-        return super().save(commit)
+        self.instance.timeslot_id = int(ts_id)
+        self.instance.room_id = int(rm_id)
+        if not self.instance.pk:
+            instance = super().save(commit)
+        else:
+            instance = super().save(commit=False)
+            if commit:
+                fields = [name for name in self._meta.fields if name != 'slot_selection']
+                self.save_versioned(instance, fields + ['timeslot', 'room'])
+        if commit:
+            refresh_participation([instance.pk])
+        return instance
 
-class MatchResultForm(forms.ModelForm):
+class MatchResultForm(VersionedMatchFormMixin, forms.ModelForm):
+    conflict_fields = ['home_score', 'away_score']
     outcome = forms.ChoiceField(
         widget=forms.RadioSelect,
         required=True,
@@ -95,59 +177,281 @@ class MatchResultForm(forms.ModelForm):
     def save(self, commit=True):
         instance = super().save(commit=False)
         instance.is_complete = True
+        if commit:
+            self.save_versioned(instance, ['home_score', 'away_score', 'is_complete'])
+        return instance
+
+class BatchResultForm(VersionedMatchFormMixin, forms.ModelForm):
+    conflict_fields = ['home_score', 'away_score']
+
+    class Meta:
+        model = Match
+        fields = ['home_score', 'away_score']
+        widgets = {
+            'home_score': forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
+            'away_score': forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.instance._state.adding:
+            # The formset could not find this row among the matches awaiting results
+            raise ValidationError("This match already has a result or is no longer ready")
+        if (cleaned_data.get('home_score') is None) != (cleaned_data.get('away_score') is None):
+            raise ValidationError("Enter both scores, or leave both blank")
+        return cleaned_data
+
+    def has_result(self):
+        return self.cleaned_data.get('home_score') is not None
+
+class BaseBatchResultFormSet(BaseModelFormSet):
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        if not any(form.has_result() for form in self.forms):
+            raise ValidationError("No results were entered")
+
+    def save(self, commit=True):
+        """Save every entered result together, then propagate them through the bracket once.
+
+        Raises MatchVersionConflict, after marking the affected rows, if any
+        match changed since the page was loaded; nothing is saved then.
+        """
+        entered = [form for form in self.forms if form.has_result()]
+        matches = [form.instance for form in entered]
+        for match in matches:
+            match.is_complete = True
+        if commit:
+            with transaction.atomic():
+                # Lock only the rows in this batch while their versions are checked
+                current = Match.objects.select_for_update().in_bulk([m.pk for m in matches])
+                stale = []
+                for form in entered:
+                    latest = current.get(form.instance.pk)
+                    if latest is None or latest.version != form.cleaned_data['version']:
+                        form.show_conflict(latest)
+                        stale.append(latest)
+                if stale:
+                    raise MatchVersionConflict(stale)
+                for match in matches:
+                    match.version = current[match.pk].version + 1
+                Match.objects.bulk_update(matches, ['home_score', 'away_score', 'is_complete', 'version'])
+                Change.record(Match, [m.pk for m in matches])
+                propagate_results(matches)
+        return matches
+
+BatchResultFormSet = modelformset_factory(Match, form=BatchResultForm, formset=BaseBatchResultFormSet, extra=0)
+
+class BatchFilterForm(forms.Form):
+    """Picks the timeslot whose ready matches the batch page shows, so the page stays a round's worth of rows"""
+    UNSCHEDULED = 'none'
+    # Most rows on one page, for ready matches that have no timeslot
+    MAX_ROWS = 100
+
+    timeslot = forms.ChoiceField(required=False)
+
+    def __init__(self, *args, ready, **kwargs):
+        super().__init__(*args, **kwargs)
+        choices = [(str(slot.pk), slot.label) for slot in Timeslot.objects.filter(pk__in=ready.values('timeslot'))]
+        if ready.filter(timeslot__isnull=True).exists():
+            choices.append((self.UNSCHEDULED, 'Unscheduled'))
+        field = self.fields['timeslot']
+        field.choices = choices
+        field.widget.attrs['class'] = 'form-select form-select-sm'
+
+    def filter(self, ready):
+        """The ready matches of the chosen timeslot, or of the earliest one with any"""
+        choices = self.fields['timeslot'].choices
+        chosen = self.cleaned_data.get('timeslot') if self.is_valid() else None
+        if not chosen and choices:
+            chosen = choices[0][0]
+        if not chosen:
+            return ready.none()
+        if chosen == self.UNSCHEDULED:
+            return ready.filter(timeslot__isnull=True)[:self.MAX_ROWS]
+        return ready.filter(timeslot_id=chosen)
+
+class ResultSubmissionForm(forms.Form):
+    """One queued result from a scorekeeper device"""
+    key = forms.CharField(max_length=64)
+    match = forms.IntegerField()
+    version = forms.IntegerField(min_value=1)
+    home_score = forms.IntegerField()
+    away_score = forms.IntegerField()
+
+class QuestionEventForm(forms.ModelForm):
+    side = forms.ChoiceField(choices=[('home', 'Home'), ('away', 'Away')])
+    points = forms.IntegerField(required=False, min_value=-QuestionEvent.MAX_POINTS, max_value=QuestionEvent.MAX_POINTS)
+
+    class Meta:
+        model = QuestionEvent
+        fields = ['question', 'kind', 'points']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Fall back to the standard value for this kind of event
+        if cleaned_data.get('points') is None and cleaned_data.get('kind'):
+            cleaned_data['points'] = QuestionEvent.DEFAULT_POINTS[cleaned_data['kind']]
+        return cleaned_data
+
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        instance.is_home = self.cleaned_data['side'] == 'home'
         if commit:
             instance.save()
         return instance
 
-class GenerateTimeslotsForm(forms.Form):
-    start_date = forms.DateField(
-        widget=forms.DateInput(attrs={'type': 'date'}),
-        required=True,
-        label="Start date"
+class TimeslotPlanDayForm(forms.Form):
+    """One day's window of slots in the timeslot planner"""
+    date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'}))
+    start = forms.TimeField(widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control form-control-sm'}))
+    end = forms.TimeField(widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control form-control-sm'}))
+    interval = forms.IntegerField(
+        min_value=5, label="Interval (minutes)",
+        widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
     )
-    start_time = forms.TimeField(
-        widget=forms.TimeInput(attrs={'type': 'time'}),
-        required=True,
-        label="Start time"
+
+    @staticmethod
+    def first_day():
+        """Initial rows for a new plan: today, 8 to 5, in half hours"""
+        return [{'date': timezone.localdate(), 'start': time(8), 'end': time(17), 'interval': 30}]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['end'] <= cleaned_data['start']:
+            raise ValidationError("The day must end after it starts")
+        return cleaned_data
+
+class BaseTimeslotPlanDayFormSet(forms.BaseFormSet):
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        if not self.days():
+            raise ValidationError("Plan at least one day")
+
+    def days(self):
+        """(date, start, end, interval) of each filled in row"""
+        return [
+            (form.cleaned_data['date'], form.cleaned_data['start'], form.cleaned_data['end'], form.cleaned_data['interval'])
+            for form in self.forms if form.cleaned_data
+        ]
+
+TimeslotPlanDayFormSet = forms.formset_factory(TimeslotPlanDayForm, formset=BaseTimeslotPlanDayFormSet, extra=2)
+
+class TimeslotPlanForm(forms.Form):
+    """Breaks and rooms for the timeslot planner; the days come from TimeslotPlanDayFormSet"""
+    BREAK = re.compile(r'^(?:(\d{4}-\d{2}-\d{2})\s+)?(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})(?:\s+.*)?$')
+
+    blocked = forms.CharField(
+        required=False, label="Breaks",
+        widget=forms.Textarea(attrs={'rows': 3, 'class': 'form-control', 'placeholder': '12:00-13:00 Lunch'}),
+        help_text='One per line: "12:00-13:00 Lunch" every day, or "2025-06-14 08:00-08:30 Devotions" on one day',
     )
-    interval = forms.IntegerField(
-        widget=forms.NumberInput,
-        required=True,
-        label="Interval (minutes)"
+    rooms = forms.ModelMultipleChoiceField(
+        Room.objects.all(), required=False, widget=forms.CheckboxSelectMultiple,
+        label="Create empty matches in", help_text="One per room in each new slot, for the schedulers to fill in",
     )
-    count = forms.IntegerField(
-        widget=forms.NumberInput,
-        required=True,
-        label="# of time slots to generate"
+
+    def clean_blocked(self):
+        """(date or None, start, end) of each break"""
+        blocked = []
+        for number, line in enumerate(self.cleaned_data['blocked'].splitlines(), 1):
+            if not line.strip():
+                continue
+            found = self.BREAK.match(line.strip())
+            try:
+                day = date.fromisoformat(found.group(1)) if found.group(1) else None
+                start, end = time.fromisoformat(found.group(2).zfill(5)), time.fromisoformat(found.group(3).zfill(5))
+            except (AttributeError, ValueError):
+                raise ValidationError(f'Line {number} is not a break like "12:00-13:00 Lunch"')
+            if end <= start:
+                raise ValidationError(f'The break on line {number} must end after it starts')
+            blocked.append((day, start, end))
+        return blocked
+
+
+class SeedingForm(forms.Form):
+    """A bracket and its teams, best first, for the seeding engine"""
+    bracket = forms.ModelChoiceField(
+        TournamentBracket.objects.order_by('priority'), widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    teams = forms.CharField(
+        label="Teams",
+        widget=forms.Textarea(attrs={'rows': 12, 'class': 'form-control', 'placeholder': 'Team name, 1520'}),
+        help_text='One team per line, best first; or give each a rating after a comma ("Team name, 1520") to sort them by it',
+    )
+    separate_regions = forms.BooleanField(
+        required=False, initial=True, label="Keep regions apart",
+        help_text="Swap teams between seeds of the same band so teams of a region meet as late as possible",
     )
 
-    def save(self):
-        data = self.cleaned_data
-        start_dt = datetime.combine(data['start_date'], data['start_time'])
-        interval = data['interval']
-        count = data['count']
-
-        # 1. Generate aware datetimes
-        target_datetimes = []
-        for i in range(count):
-            dt = datetime.combine(data['start_date'], data['start_time']) + timedelta(minutes=i * interval)
-            # Make the datetime aware of your project's timezone
-            if timezone.is_naive(dt):
-                dt = timezone.make_aware(dt)
-            target_datetimes.append(dt)
-
-        # 2. Find existing (Django handles the DB comparison correctly for aware objects)
-        existing = set(
-            Timeslot.objects.filter(start_time__in=target_datetimes)
-            .values_list('start_time', flat=True)
-        )
+    def clean_teams(self):
+        """The teams, best first"""
+        lines = []
+        for number, line in enumerate(self.cleaned_data['teams'].splitlines(), 1):
+            if not line.strip():
+                continue
+            name, _, rating = line.rpartition(',')
+            try:
+                lines.append((number, name.strip(), float(rating)))
+            except ValueError:
+                lines.append((number, line.strip(), None))
+        if not lines:
+            raise ValidationError("List the teams to seed")
 
-        # 3. Filter and Bulk Create
-        new_slots = [
-            Timeslot(start_time=dt) 
-            for dt in target_datetimes 
-            if dt not in existing
-        ]
-        
-        return Timeslot.objects.bulk_create(new_slots)
+        rated = [rating is not None for _, _, rating in lines]
+        if any(rated) and not all(rated):
+            raise ValidationError("Give every team a rating, or none of them")
+        if all(rated):
+            lines.sort(key=lambda line: -line[2])
 
+        teams = {team.name.casefold(): team for team in Team.objects.select_related('region')}
+        found = []
+        for number, name, _ in lines:
+            team = teams.get(name.casefold())
+            if team is None:
+                raise ValidationError(f'There is no team called "{name}" (line {number})')
+            if team in found:
+                raise ValidationError(f'{team.name} is listed twice (line {number})')
+            found.append(team)
+        return found
+
+
+class MatchFilterForm(forms.Form):
+    """Narrows the matches list; every field is optional"""
+    STATUS_CHOICES = [('', 'All matches'), ('upcoming', 'Upcoming'), ('complete', 'Completed')]
+
+    day = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    room = forms.ModelChoiceField(Room.objects.all(), required=False, empty_label='All rooms')
+    bracket = forms.ModelChoiceField(TournamentBracket.objects.order_by('priority'), required=False, empty_label='All brackets')
+    tournament_round = forms.ModelChoiceField(
+        TournamentRound.objects.select_related('bracket').order_by('bracket__priority', 'id'),
+        required=False, empty_label='All rounds', label='Round',
+    )
+    status = forms.ChoiceField(choices=STATUS_CHOICES, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields.values():
+            field.widget.attrs['class'] = 'form-select form-select-sm' if hasattr(field, 'choices') else 'form-control form-control-sm'
+
+    def filter(self, queryset):
+        """Apply the valid filters to a Match queryset"""
+        data = self.cleaned_data
+        if data.get('day'):
+            # A day in the tournament's time zone, as a range so the start_time index applies
+            start = timezone.make_aware(datetime.combine(data['day'], time.min))
+            queryset = queryset.filter(
+                timeslot__start_time__gte=start, timeslot__start_time__lt=start + timedelta(days=1)
+            )
+        if data.get('room'):
+            queryset = queryset.filter(room=data['room'])
+        if data.get('bracket'):
+            queryset = queryset.filter(tournament_round__bracket=data['bracket'])
+        if data.get('tournament_round'):
+            queryset = queryset.filter(tournament_round=data['tournament_round'])
+        if data.get('status'):
+            queryset = queryset.filter(is_complete=data['status'] == 'complete')
+        return queryset
@@ -0,0 +1,180 @@
+"""Room maps, resized for the screens that show them.
+
+An uploaded map is kept as it came, but pages only show it until the
+process_room_map job (queued whenever a room's map changes) has written a set of
+width-bounded WebP and JPEG copies with the metadata stripped, and the room
+page offers them with srcset so each device downloads the smallest one that
+fills its screen. Copies are named by a hash of their content, so they can
+be cached forever; a new upload gets new names.
+"""
+import hashlib
+import io
+import os
+import re
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .models import Change, Room
+
+# Widths to make copies at; maps narrower than one of these stop at their own width
+MAP_WIDTHS = (480, 960, 1600)
+
+# Extension, Pillow format, content type and save options of each copy
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Folder in the media storage holding the copies
+DIRECTORY = 'maps'
+NAME_PATTERN = re.compile(r'^[0-9a-f]{16}-\d+w\.(webp|jpg)$')
+
+# How much of the page the map takes, for the browser to pick a width before layout
+SIZES = '50vw'
+
+
+def derivatives(data):
+    """(width, height, extension, bytes) of each resized copy of an image file's content"""
+    image = Image.open(io.BytesIO(data))
+    # JPEG scans can be decoded straight at a fraction of their size. The EXIF
+    # orientation is applied after, so either side may end up as the width.
+    image.draft('RGB', (max(MAP_WIDTHS), max(MAP_WIDTHS)))
+    # Turn the image the way its camera said it was held, before the EXIF that says so is dropped
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    widths = sorted({min(width, image.width) for width in MAP_WIDTHS})
+    copies = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image.copy()
+        for extension, (format, _, options) in FORMATS.items():
+            # A fresh image carries no EXIF, ICC or text chunks over from the upload
+            plain = Image.new(resized.mode, resized.size)
+            plain.paste(resized)
+            if format == 'JPEG':
+                plain = _flatten(plain)
+            output = io.BytesIO()
+            plain.save(output, format, **options)
+            copies.append((width, height, extension, output.getvalue()))
+    return copies
+
+
+def _flatten(image):
+    """Put a transparent image on white, as JPEG has no transparency"""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def save_derivatives(data):
+    """Write the copies of an image to storage; returns their descriptions for Room.map_images"""
+    images = []
+    for width, height, extension, content in derivatives(data):
+        name = f'{DIRECTORY}/{hashlib.sha256(content).hexdigest()[:16]}-{width}w.{extension}'
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(content))
+        images.append({'name': name, 'width': width, 'height': height, 'format': extension})
+    return images
+
+
+def process(room):
+    """Make the copies of a room's current map and record them; returns the number of copies"""
+    source = room.map.name if room.map else ''
+    if source:
+        with room.map.open('rb') as f:
+            images = save_derivatives(f.read())
+    else:
+        images = []
+    previous = room.map_images.get('images', [])
+    map_images = {'source': source, 'images': images}
+    # Only if the map is still the one that was processed; a room that never had one stores NULL
+    current = Q(map=source) | Q(map__isnull=True) if not source else Q(map=source)
+    if Room.objects.filter(current, pk=room.pk).update(map_images=map_images):
+        Change.record(Room, [room.pk])
+        room.map_images = map_images
+        _delete_unused(image['name'] for image in previous)
+    else:
+        # The map changed again meanwhile; the job queued for that makes its own copies
+        _delete_unused(image['name'] for image in images)
+    return len(images)
+
+
+def _delete_unused(names):
+    names = set(names)
+    if not names:
+        return
+    in_use = {image['name'] for images in Room.objects.values_list('map_images', flat=True)
+              for image in images.get('images', [])}
+    for name in names - in_use:
+        default_storage.delete(name)
+
+
+def is_stale(room):
+    """Whether a room's map has changed since its copies were made, or was cleared with copies left"""
+    source = room.map.name if room.map else ''
+    if not source:
+        return bool(room.map_images.get('images'))
+    return source != room.map_images.get('source', '')
+
+
+def picture(room):
+    """What the room page needs for its <picture>: a srcset per content type, and a fallback image.
+
+    None if the room has no map. Until the copies exist, the upload itself is shown.
+    """
+    if not room.map:
+        return None
+    images = _current_images(room)
+    if not images:
+        return {'sources': [], 'src': room.map.url, 'srcset': ''}
+
+    def srcset(extension):
+        return ', '.join(
+            f'{image_url(image["name"])} {image["width"]}w' for image in images if image['format'] == extension
+        )
+
+    largest = _largest(images)
+    return {
+        'sources': [(FORMATS['webp'][1], srcset('webp'))],
+        'src': image_url(largest['name']),
+        'srcset': srcset('jpg'),
+        'sizes': SIZES,
+        'width': largest['width'],
+        'height': largest['height'],
+    }
+
+
+def largest_url(room):
+    """The biggest JPEG copy of a room's map, or the upload itself until there is one"""
+    images = _current_images(room)
+    if images:
+        return image_url(_largest(images)['name'])
+    return room.map.url if room.map else None
+
+
+def image_paths(room):
+    """URLs of the copies a room's pages link to, for the static export"""
+    return [image_url(image['name']) for image in _current_images(room)]
+
+
+def _current_images(room):
+    return [] if is_stale(room) else room.map_images.get('images', [])
+
+
+def _largest(images):
+    return max((image for image in images if image['format'] == 'jpg'), key=lambda image: image['width'])
+
+
+def image_url(name):
+    return reverse('room_map_image', args=[os.path.basename(name)])
+
+
+def content_type(name):
+    return FORMATS[name.rsplit('.', 1)[1]][1]
@@ -0,0 +1,178 @@
+"""A small database-backed queue for work too slow to do inside a request.
+
+Views and admin actions call enqueue() and return at once; the run_jobs
+command claims ready jobs and runs them on a pool of threads. A job that
+raises is retried after a growing delay until it runs out of attempts.
+Jobs queued with the same dedup_key while one is still pending are merged:
+the newest arguments win and the work is done once.
+
+Handlers are registered with @handler('kind') and called as
+handler(job, **arguments); they can call job.set_progress() as they go.
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import export, images
+from .models import Job, Room
+from .participation import refresh_participation
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+# Delay before the first retry, doubled for each one after
+RETRY_SECONDS = 30
+
+# Progress is written at most this often, so a busy job does not hold the write lock
+PROGRESS_SECONDS = 0.5
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, dedup_key='', delay=0, max_attempts=3, **arguments):
+    """Queue a job, or update the pending job with the same dedup_key; returns the job"""
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    run_after = timezone.now() + timedelta(seconds=delay)
+    fields = {'kind': kind, 'arguments': arguments, 'run_after': run_after, 'max_attempts': max_attempts}
+    pending = Job.objects.filter(status=Job.Status.PENDING, dedup_key=dedup_key)
+    with transaction.atomic():
+        if dedup_key:
+            if pending.update(**fields):
+                return pending.get()
+        try:
+            with transaction.atomic():
+                return Job.objects.create(dedup_key=dedup_key, **fields)
+        except IntegrityError:
+            # Another process queued the same key in the meantime
+            pending.update(**fields)
+            return pending.get()
+
+
+def claim(worker):
+    """Mark the next ready job as running on worker and return it, or None if there is none"""
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.Status.PENDING, run_after__lte=timezone.now(),
+        ).order_by('run_after', 'pk').first()
+        if job is None:
+            return None
+        job.status = Job.Status.RUNNING
+        job.attempts += 1
+        job.worker = worker
+        job.started = timezone.now()
+        job.progress, job.message, job.finished = 0, '', None
+        job.save(update_fields=['status', 'attempts', 'worker', 'started', 'progress', 'message', 'finished'])
+    return job
+
+
+def run(job):
+    """Run a claimed job, then mark it done, failed, or pending again for a retry"""
+    try:
+        function = HANDLERS.get(job.kind)
+        if function is None:
+            raise LookupError(f'No handler for {job.kind} jobs')
+        function(ThrottledProgress(job), **job.arguments)
+    except Exception:
+        logger.exception('%s failed (attempt %d of %d)', job, job.attempts, job.max_attempts)
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts and not _superseded(job):
+            job.status = Job.Status.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_SECONDS * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.Status.FAILED
+            job.finished = timezone.now()
+    else:
+        job.status = Job.Status.DONE
+        job.progress, job.error = 100, ''
+        job.finished = timezone.now()
+    save_requeued(job, ['status', 'run_after', 'progress', 'message', 'error', 'finished'])
+    return job
+
+
+def save_requeued(job, fields):
+    """Save a job that may be going back to pending; if a newer job with its key was queued meanwhile, fail it instead
+
+    Returns whether the job was saved as it was.
+    """
+    try:
+        with transaction.atomic():
+            job.save(update_fields=fields)
+        return True
+    except IntegrityError:
+        job.status, job.finished = Job.Status.FAILED, timezone.now()
+        job.error = (job.error + '\n' if job.error else '') + 'Superseded by a newer pending job with the same key'
+        job.save(update_fields=list({*fields, 'status', 'finished', 'error'}))
+        return False
+
+
+def _superseded(job):
+    """Whether a newer job with the same key is already pending, making a retry pointless"""
+    return bool(job.dedup_key) and Job.objects.filter(status=Job.Status.PENDING, dedup_key=job.dedup_key).exists()
+
+
+def requeue_stale(minutes):
+    """Put jobs left running longer than minutes (their worker died) back in the queue; returns how many.
+
+    Jobs out of attempts, or with a newer pending job of the same key, are failed instead.
+    """
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    requeued = 0
+    for job in Job.objects.filter(status=Job.Status.RUNNING, started__lt=cutoff):
+        if job.attempts >= job.max_attempts or _superseded(job):
+            job.status, job.finished = Job.Status.FAILED, timezone.now()
+        else:
+            job.status, job.run_after = Job.Status.PENDING, timezone.now()
+        job.error = f'Abandoned by {job.worker}'
+        if save_requeued(job, ['status', 'run_after', 'finished', 'error']) and job.status == Job.Status.PENDING:
+            requeued += 1
+    return requeued
+
+
+class ThrottledProgress:
+    """The job as handlers see it, with set_progress() written no more than every PROGRESS_SECONDS"""
+
+    def __init__(self, job):
+        self.job = job
+        self.written = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.job, name)
+
+    def set_progress(self, done, total, message=''):
+        now = time.monotonic()
+        if now - self.written >= PROGRESS_SECONDS or done >= total:
+            self.written = now
+            self.job.set_progress(done, total, message)
+
+
+@handler('refresh_participation')
+def refresh_participation_job(job, match_ids=None):
+    job.set_progress(0, 1, 'Rebuilding team schedules')
+    refresh_participation(match_ids)
+
+
+@handler('export_static')
+def export_static_job(job, output=None, workers=0):
+    def progress(done, total):
+        job.set_progress(done, total, f'{done} of {total} pages')
+
+    export.build_site(output or export.default_output(), workers, progress)
+
+
+@handler('process_room_map')
+def process_room_map_job(job, room_id, force=False):
+    room = Room.objects.filter(pk=room_id).first()
+    if room is not None and (force or images.is_stale(room)):
+        job.set_progress(0, 1, f'Resizing the map of {room}')
+        images.process(room)
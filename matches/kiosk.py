@@ -0,0 +1,98 @@
+"""What a room's door tablet shows: the current match, the next ones, and when they will really start"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import refcache
+from .models import Change, Match, Timeslot
+
+# Matches shown on a kiosk: the current one and the next two
+KIOSK_MATCHES = 3
+
+# Used when the timeslots are too few to tell how long a match takes
+DEFAULT_MATCH_MINUTES = 30
+
+
+def match_length(timeslots=None):
+    """The shortest gap between consecutive timeslots, taken as the length of a match"""
+    if timeslots is None:
+        timeslots = refcache.table(Timeslot)
+    starts = sorted(t.start_time for t in timeslots.values())
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:]) if later > earlier]
+    return min(gaps) if gaps else timedelta(minutes=DEFAULT_MATCH_MINUTES)
+
+
+def room_queue(room, now=None):
+    """The room's next unfinished matches, each with a projected start time.
+
+    A match cannot start before its timeslot, nor before the match ahead of
+    it in the room has had a full slot; a current match that is running over
+    is assumed to finish any moment now.
+    """
+    matches = refcache.attach(list(_upcoming(room)))
+    return _project(matches, match_length(), now or timezone.now())
+
+
+async def aroom_queue(room, now=None):
+    """room_queue() for async views"""
+    matches = await refcache.aattach([m async for m in _upcoming(room)])
+    return _project(matches, match_length(await refcache.atable(Timeslot)), now or timezone.now())
+
+
+def _upcoming(room):
+    return (
+        Match.objects.filter(room=room, is_complete=False, timeslot__isnull=False)
+        .select_related('home_source_match', 'away_source_match')
+        .order_by('timeslot__start_time', 'match_number')[:KIOSK_MATCHES]
+    )
+
+
+def _project(matches, length, now):
+    queue = []
+    free_at = None
+    for match in matches:
+        start = match.start_time if free_at is None else max(match.start_time, free_at)
+        queue.append({'match': match, 'projected_start': start, 'delay': start - match.start_time})
+        free_at = max(start + length, now) if start <= now else start + length
+    return queue
+
+
+def room_changed(room, queue, since, latest):
+    """Whether any change in (since, latest] affects what the room's kiosk shows"""
+    shown, other_matches = _sort_changes(room, queue, _changes(since, latest))
+    if shown:
+        return True
+    # A match may have been moved into this room
+    return Match.objects.filter(pk__in=other_matches, room=room).exists() if other_matches else False
+
+
+async def aroom_changed(room, queue, since, latest):
+    """room_changed() for async views"""
+    shown, other_matches = _sort_changes(room, queue, [c async for c in _changes(since, latest)])
+    if shown:
+        return True
+    return await Match.objects.filter(pk__in=other_matches, room=room).aexists() if other_matches else False
+
+
+def _changes(since, latest):
+    return Change.objects.filter(pk__gt=since, pk__lte=latest).values_list('model_name', 'object_id')
+
+
+def _sort_changes(room, queue, changes):
+    """Whether changes touch what the kiosk shows, and the other matches they touch"""
+    match_ids = {entry['match'].pk for entry in queue}
+    team_ids = {
+        team_id for entry in queue
+        for team_id in (entry['match'].home_team_id, entry['match'].away_team_id) if team_id
+    }
+    other_matches = set()
+    for model_name, object_id in changes:
+        if model_name == 'timeslot' or (model_name == 'room' and object_id == room.pk):
+            return True, other_matches
+        if model_name == 'team' and object_id in team_ids:
+            return True, other_matches
+        if model_name == 'match':
+            if object_id in match_ids:
+                return True, other_matches
+            other_matches.add(object_id)
+    return False, other_matches
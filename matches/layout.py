@@ -0,0 +1,268 @@
+"""Server-side bracket drawings, kept current from the change log"""
+import threading
+
+from django.db.models import Max, Q
+from django.template.loader import render_to_string
+
+from . import refcache
+from .models import Change, Match
+
+BOX_WIDTH = 200
+BOX_HEIGHT = 46
+COLUMN_GAP = 48
+ROW_GAP = 14
+HEADER_HEIGHT = 28
+
+# Past this many changes since a cached layout was checked, rebuilding is cheaper than catching up
+CATCH_UP_LIMIT = 500
+
+# Bracket id -> BracketLayout, for this process
+_layouts = {}
+# Bracket id -> lock held while that bracket's layout is brought up to date;
+# _lock only guards the two dicts, so one bracket's rebuild never holds up another's
+_bracket_locks = {}
+_lock = threading.Lock()
+
+
+class BracketLayout:
+    """Where every match box and connector of one bracket is drawn.
+
+    version is the id of the last Change that altered the drawing, and
+    structure_version the last one that moved boxes around; a page drawn at
+    or after structure_version can be brought up to date box by box. A
+    rebuild keeps structure_version unless the boxes really did move (see
+    structure_changed_at).
+    """
+
+    def __init__(self, bracket, stamp):
+        self.bracket = bracket
+        self.checked = stamp
+        self.version = stamp
+        self.structure_version = stamp
+        self.nodes = {}
+        self.node_versions = {}
+        self.edges = []
+        self.columns = []
+        self.width = 0
+        self.height = 0
+        self.svg = None
+        self.svg_version = None
+
+    def node_edges(self, match_id):
+        return [edge for edge in self.edges if edge['source'] == match_id]
+
+
+def bracket_matches(queryset):
+    return refcache.attach(list(
+        queryset.select_related('home_source_match', 'away_source_match').order_by('match_number')
+    ))
+
+
+def structure_key(match):
+    """What a match contributes to the shape of its bracket"""
+    return (
+        match.match_number, match.tournament_round_id,
+        match.home_source_match_id, match.home_source_take_winner,
+        match.away_source_match_id, match.away_source_take_winner,
+    )
+
+
+def build_layout(bracket, stamp):
+    """Lay out a bracket in one pass over its matches in match number order.
+
+    Sources always come before the matches they feed, so each match can be
+    placed level with its sources as soon as it is seen; a match fed from
+    outside the bracket starts a new row. Each round is a column, in the
+    order its first match appears.
+    """
+    layout = BracketLayout(bracket, stamp)
+    rows = {}
+    column_of_round = {}
+    last_row_in_column = {}
+    next_row = 0
+
+    for match in bracket_matches(Match.objects.filter(tournament_round__bracket=bracket)):
+        column = column_of_round.setdefault(match.tournament_round_id, len(column_of_round))
+        if column == len(layout.columns):
+            layout.columns.append({'name': match.tournament_round.name, 'x': column * (BOX_WIDTH + COLUMN_GAP)})
+
+        sources = [
+            rows[source_id] for source_id in (match.home_source_match_id, match.away_source_match_id)
+            if source_id in rows and layout.nodes[source_id]['match'].match_number < match.match_number
+        ]
+        if sources:
+            row = sum(sources) / len(sources)
+        else:
+            row = next_row
+        # Never overlap the box above in the same column
+        row = max(row, last_row_in_column.get(column, -1) + 1)
+        last_row_in_column[column] = row
+        next_row = max(next_row, int(row) + 1)
+        rows[match.pk] = row
+
+        layout.nodes[match.pk] = {
+            'match': match,
+            'x': column * (BOX_WIDTH + COLUMN_GAP),
+            'y': HEADER_HEIGHT + row * (BOX_HEIGHT + ROW_GAP),
+            'key': structure_key(match),
+        }
+        layout.node_versions[match.pk] = stamp
+
+    for node in layout.nodes.values():
+        match = node['match']
+        for side, source_id, take_winner in (
+            ('home', match.home_source_match_id, match.home_source_take_winner),
+            ('away', match.away_source_match_id, match.away_source_take_winner),
+        ):
+            source = layout.nodes.get(source_id)
+            if not source or source['match'].match_number >= match.match_number:
+                continue
+            start_x = source['x'] + BOX_WIDTH
+            start_y = source['y'] + BOX_HEIGHT / 2
+            end_x = node['x']
+            end_y = node['y'] + BOX_HEIGHT * (0.3 if side == 'home' else 0.7)
+            middle_x = end_x - COLUMN_GAP / 2
+            layout.edges.append({
+                'id': f'bracket-edge-{source_id}-{match.pk}-{side}',
+                'source': source_id,
+                'loser': not take_winner,
+                'path': f'M{start_x:g} {start_y:g} H{middle_x:g} V{end_y:g} H{end_x:g}',
+            })
+
+    layout.width = max((n['x'] for n in layout.nodes.values()), default=0) + BOX_WIDTH
+    layout.height = max((n['y'] for n in layout.nodes.values()), default=0) + BOX_HEIGHT
+    return layout
+
+
+def structure_changed_at(layout, previous):
+    """The id of the last Change that moved the boxes of a freshly built layout about.
+
+    Against the layout it replaces, only the matches whose structure_key
+    differs, and the rounds if a column changed, are looked up in the change
+    log. With nothing to compare against, every match, round and deleted
+    match of the bracket is, which may be later than the real move but
+    never earlier.
+    """
+    keys = {pk: node['key'] for pk, node in layout.nodes.items()}
+    if previous is None:
+        moved, rounds = set(keys), True
+    else:
+        old = {pk: node['key'] for pk, node in previous.nodes.items()}
+        moved = {pk for pk in keys.keys() | old.keys() if keys.get(pk) != old.get(pk)}
+        rounds = layout.columns != previous.columns
+        if not moved and not rounds:
+            return previous.structure_version
+
+    changes = Q(model_name='match', object_id__in=moved)
+    if previous is None:
+        changes |= Q(model_name='match', deleted=True)
+    if rounds:
+        round_ids = {node['match'].tournament_round_id for node in layout.nodes.values()}
+        changes |= Q(model_name='tournamentround', object_id__in=round_ids)
+        changes |= Q(model_name='tournamentbracket', object_id=layout.bracket.pk)
+    found = Change.objects.filter(changes, pk__lte=layout.checked).aggregate(latest=Max('pk'))['latest']
+    if found is None:
+        # Nothing in the log ever touched a fresh bracket; a move it can't place counts as now
+        return 0 if previous is None else layout.checked
+    return found
+
+
+def catch_up(layout, stamp):
+    """Apply the changes since the layout was last checked, or return None if it needs rebuilding"""
+    changes = list(Change.objects.filter(pk__gt=layout.checked).order_by('pk').values_list(
+        'pk', 'model_name', 'object_id', 'deleted'
+    )[:CATCH_UP_LIMIT + 1])
+    if len(changes) > CATCH_UP_LIMIT:
+        return None
+
+    changed_matches = {}
+    changed_teams = {}
+    for pk, model_name, object_id, deleted in changes:
+        if model_name == 'match':
+            if deleted and object_id in layout.nodes:
+                return None
+            changed_matches[object_id] = pk
+        elif model_name == 'team':
+            changed_teams[object_id] = pk
+        elif model_name in ('tournamentbracket', 'tournamentround', 'region'):
+            # Rare during play, and they can rename or recolour everything
+            return None
+
+    for node_id, node in layout.nodes.items():
+        match = node['match']
+        for team_id in (match.home_team_id, match.away_team_id):
+            if team_id in changed_teams:
+                changed_matches[node_id] = max(changed_matches.get(node_id, 0), changed_teams[team_id])
+
+    if changed_matches:
+        for match in bracket_matches(Match.objects.filter(pk__in=changed_matches)):
+            in_bracket = match.tournament_round is not None and match.tournament_round.bracket_id == layout.bracket.pk
+            if in_bracket != (match.pk in layout.nodes):
+                return None
+            if not in_bracket:
+                continue
+            node = layout.nodes[match.pk]
+            if structure_key(match) != node['key']:
+                return None
+            node['match'] = match
+            layout.node_versions[match.pk] = changed_matches[match.pk]
+            layout.version = max(layout.version, changed_matches[match.pk])
+
+    layout.checked = stamp
+    return layout
+
+
+def current_layout(bracket):
+    """The bracket's layout as of the latest change, kept in this process between requests.
+
+    A plain dict rather than Django's cache: the layout holds model instances
+    and would be pickled and unpickled on every request otherwise.
+    """
+    with _lock:
+        bracket_lock = _bracket_locks.setdefault(bracket.pk, threading.Lock())
+    with bracket_lock:
+        stamp = Change.latest()
+        with _lock:
+            previous = layout = _layouts.get(bracket.pk)
+        if previous is not None and previous.checked > stamp:
+            # The change log went backwards, as when the database is replaced
+            previous = None
+        if layout is not None and layout.checked < stamp:
+            layout = catch_up(layout, stamp)
+        if layout is None or layout.checked > stamp:
+            layout = build_layout(bracket, stamp)
+            layout.structure_version = structure_changed_at(layout, previous)
+        if layout.svg_version != layout.version:
+            layout.svg = render_to_string('bracket-svg.html', {
+                'layout': layout,
+                'nodes': [node_context(layout, pk) for pk in layout.nodes],
+                'edges': [edge_context(layout, edge) for edge in layout.edges],
+            })
+            layout.svg_version = layout.version
+        with _lock:
+            _layouts[bracket.pk] = layout
+        return layout
+
+
+def node_context(layout, match_id):
+    node = layout.nodes[match_id]
+    return dict(node, width=BOX_WIDTH, height=BOX_HEIGHT)
+
+
+def edge_context(layout, edge):
+    source = layout.nodes[edge['source']]['match']
+    return dict(edge, decided=source.is_complete)
+
+
+def changed_fragments(layout, since):
+    """SVG fragments, by element id, for the boxes and connectors redrawn after version since"""
+    fragments = {}
+    for match_id, version in layout.node_versions.items():
+        if version <= since:
+            continue
+        fragments[f'bracket-match-{match_id}'] = render_to_string(
+            'bracket-svg-node.html', {'node': node_context(layout, match_id)}
+        )
+        for edge in layout.node_edges(match_id):
+            fragments[edge['id']] = render_to_string('bracket-svg-edge.html', {'edge': edge_context(layout, edge)})
+    return fragments
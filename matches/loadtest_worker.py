@@ -0,0 +1,131 @@
+"""Client processes for the loadtest command.
+
+Only the standard library is used here: a client process talks to the
+server over HTTP like any browser or scorekeeper device would, and never
+sets up Django or touches the database.
+"""
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+
+
+def request(host, port, method, path, timeout, body=None, headers=None):
+    """Make one request on a fresh connection; returns (status, body)"""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+class Client:
+    def __init__(self, plan, deadline, samples, lock):
+        self.plan = plan
+        self.deadline = deadline
+        self.samples = samples
+        self.lock = lock
+
+    def timed(self, route, method, path, timeout=30, **kwargs):
+        started = time.perf_counter()
+        try:
+            status, body = request(self.plan['host'], self.plan['port'], method, path, timeout, **kwargs)
+        except OSError:
+            status, body = 0, b''
+        with self.lock:
+            self.samples.append((route, time.perf_counter() - started, status))
+        return status, body
+
+    def spectator(self):
+        pages = self.plan['pages']
+        weights = [weight for _, _, weight in pages]
+        while time.time() < self.deadline:
+            route, path, _ = random.choices(pages, weights)[0]
+            self.timed(route, 'GET', path)
+
+    def kiosk(self, room_id):
+        self.timed('room_kiosk', 'GET', f'/rooms/{room_id}/kiosk/')
+        version = 0
+        while time.time() < self.deadline:
+            remaining = self.deadline - time.time()
+            started = time.perf_counter()
+            try:
+                # Held open by the server until something changes, so stop waiting when the run ends
+                status, body = request(self.plan['host'], self.plan['port'], 'GET',
+                                       f'/rooms/{room_id}/kiosk/poll/?version={version}', max(remaining, 0.1))
+            except TimeoutError:
+                break
+            except OSError:
+                status, body = 0, b''
+            with self.lock:
+                self.samples.append(('room_kiosk_poll', time.perf_counter() - started, status))
+            if status == 200:
+                version = json.loads(body)['version']
+            else:
+                time.sleep(1)
+
+    def listener(self, match_ids):
+        while time.time() < self.deadline:
+            match_id = random.choice(match_ids)
+            remaining = self.deadline - time.time()
+            started = time.perf_counter()
+            connection = http.client.HTTPConnection(self.plan['host'], self.plan['port'], timeout=max(remaining, 0.1))
+            try:
+                connection.request('GET', f'/matches/{match_id}/live/')
+                response = connection.getresponse()
+                response.readline()
+                with self.lock:
+                    self.samples.append(('match_live', time.perf_counter() - started, response.status))
+                # Stay on the page until the server ends the stream or the run ends
+                while response.readline():
+                    pass
+            except TimeoutError:
+                break
+            except OSError:
+                with self.lock:
+                    self.samples.append(('match_live', time.perf_counter() - started, 0))
+                time.sleep(1)
+            finally:
+                connection.close()
+
+    def scorekeeper(self, versions):
+        headers = {
+            'Content-Type': 'application/json',
+            'Cookie': f'sessionid={self.plan["session"]}; csrftoken={self.plan["csrf"]}',
+            'X-CSRFToken': self.plan['csrf'],
+        }
+        match_ids = list(versions)
+        while time.time() < self.deadline and match_ids:
+            match_id = random.choice(match_ids)
+            body = json.dumps({'submissions': [{
+                'key': uuid.uuid4().hex,
+                'match': match_id,
+                'version': versions[match_id],
+                'home_score': 10 * random.randint(0, 20),
+                'away_score': 10 * random.randint(0, 20),
+            }]})
+            status, reply = self.timed('scorekeeper_sync', 'POST', '/scorekeeper/sync/', body=body, headers=headers)
+            if status == 200:
+                # Conflicts report the current version too, so the next try can succeed
+                versions[match_id] = json.loads(reply)['results'][0]['version']
+
+
+def run(plan, roles, seconds, seed):
+    """Run one process's share of the clients for seconds; returns (route, seconds, status) samples.
+
+    roles is a list of ('spectator',), ('kiosk', room_id), ('listener', match_ids)
+    and ('scorekeeper', {match_id: version}) entries, one thread each.
+    """
+    random.seed(seed)
+    samples, lock = [], threading.Lock()
+    client = Client(plan, time.time() + seconds, samples, lock)
+    threads = [threading.Thread(target=getattr(client, role), args=args) for role, *args in roles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
@@ -0,0 +1,40 @@
+from matches.benchmarking import percentile
+from matches.management.commands import loadtest
+
+# Pages spectators load, as opposed to held-open streams and polls
+PAGE_ROUTES = {'home', 'matches_list', 'brackets', 'team_detail', 'room_detail', 'match_detail'}
+
+
+class Command(loadtest.Command):
+    help = ('Serves the site through the WSGI entry point (from a fixed pool of threads, like a production '
+            'worker) and then the ASGI one while many slow clients hold live score streams open, and compares '
+            'how quickly spectators still get their pages')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(listeners=200, spectators=16, kiosks=16, scorekeepers=2, seconds=30, wsgi_threads=32)
+
+    def handle(self, *args, **options):
+        results = {}
+        for server in loadtest.SERVERS:
+            results[server] = self.run({**options, 'server': server})
+
+        def ms(values, pct):
+            return f'{percentile(values, pct) * 1000:8.1f}'
+
+        self.stdout.write(
+            f'\n{"server":<6} {"pages/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+            f'{"streams":>8} {"errors":>6} {"threads":>7}'
+        )
+        for server, (samples, elapsed, threads) in results.items():
+            pages = [seconds for route, seconds, status in samples if route in PAGE_ROUTES and status == 200]
+            streams = sum(1 for route, _, status in samples if route == 'match_live' and status == 200)
+            errors = sum(1 for _, _, status in samples if status != 200)
+            self.stdout.write(
+                f'{server:<6} {len(pages) / elapsed:>8.1f} {ms(pages, 50)} {ms(pages, 95)} {ms(pages, 99)} '
+                f'{streams:>8} {errors:>6} {threads:>7}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Page times are for spectators; streams counts live score connections opened; '
+            'threads is the peak in the server process'
+        ))
@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import Client, override_settings
+import io
+import json
+import random
+import threading
+import time
+import uuid
+
+from matches.benchmarking import percentile, scratch_database
+from matches.models import Match, Team
+
+# Statements that need (and so may wait for) SQLite's write lock
+WRITE_STATEMENTS = ('BEGIN', 'INSERT', 'UPDATE', 'DELETE', 'COMMIT')
+
+class Command(BaseCommand):
+    help = 'Measures SQLite throughput and lock waits with concurrent spectators and scorekeepers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=16, help='Spectator threads browsing pages')
+        parser.add_argument('--writers', type=int, default=8, help='Scorekeeper threads submitting results')
+        parser.add_argument('--seconds', type=float, default=10, help='How long to run each mode')
+        parser.add_argument('--teams', type=int, default=64, help='Teams in the generated bracket')
+        parser.add_argument('--rooms', type=int, default=8, help='Rooms in the generated bracket')
+        parser.add_argument('--mode', choices=['default', 'production', 'both'], default='both',
+                            help="Django's stock SQLite settings, the ones in settings.py, or both")
+
+    def handle(self, *args, **options):
+        configured = settings.DATABASES['default']
+        modes = {
+            'default': ({}, 0),
+            'production': (dict(configured['OPTIONS']), configured['CONN_MAX_AGE']),
+        }
+        selected = ['default', 'production'] if options['mode'] == 'both' else [options['mode']]
+
+        # The test client talks to "testserver"
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name in selected:
+                db_options, conn_max_age = modes[name]
+                self.stdout.write(f'Running {name} mode for {options["seconds"]}s...')
+                with scratch_database(options=db_options, conn_max_age=conn_max_age):
+                    call_command('generate_mock_data', teams=options['teams'], rooms=options['rooms'],
+                                 tournament=True, stdout=io.StringIO())
+                    stats = self.run(options)
+                self.report(name, stats, options['seconds'])
+
+    def run(self, options):
+        stats = {'reads': [], 'writes': [], 'lock_waits': [], 'lock_errors': 0, 'conflicts': 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        team_ids = list(Team.objects.values_list('pk', flat=True))
+        match_ids = list(Match.objects.filter(
+            home_team__isnull=False, away_team__isnull=False
+        ).values_list('pk', flat=True))
+        staff = User.objects.create_user('benchmark', is_staff=True)
+
+        # Log the scorekeepers in up front so sessions aren't written during the run
+        writer_clients = []
+        for _ in range(options['writers']):
+            client = Client()
+            client.force_login(staff)
+            writer_clients.append(client)
+        connection.close()
+
+        threads = [
+            threading.Thread(target=self.spectator, args=(stop, stats, lock, team_ids))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=self.scorekeeper, args=(stop, stats, lock, client, match_ids))
+            for client in writer_clients
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return stats
+
+    def spectator(self, stop, stats, lock, team_ids):
+        client = Client()
+        paths = ['/matches/', '/scorekeeper/'] + [f'/teams/{pk}/' for pk in team_ids[:10]]
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    client.get(random.choice(paths))
+                except OperationalError:
+                    with lock:
+                        stats['lock_errors'] += 1
+                    continue
+                with lock:
+                    stats['reads'].append(time.perf_counter() - started)
+        finally:
+            connection.close()
+
+    def scorekeeper(self, stop, stats, lock, client, match_ids):
+        waited = [0.0]
+
+        def time_writes(execute, sql, params, many, context):
+            if not sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+                return execute(sql, params, many, context)
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                waited[0] += time.perf_counter() - started
+
+        try:
+            with connection.execute_wrapper(time_writes):
+                while not stop.is_set():
+                    match_id = random.choice(match_ids)
+                    waited[0] = 0.0
+                    started = time.perf_counter()
+                    try:
+                        version = Match.objects.filter(pk=match_id).values_list('version', flat=True).first()
+                        response = client.post('/scorekeeper/sync/', json.dumps({'submissions': [{
+                            'key': uuid.uuid4().hex,
+                            'match': match_id,
+                            'version': version,
+                            'home_score': 10 * random.randint(0, 20),
+                            'away_score': 10 * random.randint(0, 20),
+                        }]}), content_type='application/json')
+                    except OperationalError:
+                        with lock:
+                            stats['lock_errors'] += 1
+                        continue
+                    with lock:
+                        stats['writes'].append(time.perf_counter() - started)
+                        stats['lock_waits'].append(waited[0])
+                        if response.json()['results'][0]['status'] == 'conflict':
+                            stats['conflicts'] += 1
+        finally:
+            connection.close()
+
+    def report(self, name, stats, seconds):
+        def ms(values, pct):
+            return f'{percentile(values, pct) * 1000:.1f}ms'
+
+        reads, writes, waits = stats['reads'], stats['writes'], stats['lock_waits']
+        style = self.style.SUCCESS if not stats['lock_errors'] else self.style.WARNING
+        self.stdout.write(style(
+            f'{name}: {len(reads) / seconds:.1f} reads/s, {len(writes) / seconds:.1f} writes/s, '
+            f'{stats["lock_errors"]} "database is locked" errors, {stats["conflicts"]} version conflicts'
+        ))
+        self.stdout.write(f'  read latency     p50 {ms(reads, 50)}  p95 {ms(reads, 95)}  p99 {ms(reads, 99)}')
+        self.stdout.write(f'  write latency    p50 {ms(writes, 50)}  p95 {ms(writes, 95)}  p99 {ms(writes, 99)}')
+        self.stdout.write(f'  write lock wait  p50 {ms(waits, 50)}  p95 {ms(waits, 95)}  max {ms(waits, 100)}')
@@ -0,0 +1,119 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from urllib.parse import urlencode
+import io
+import math
+import re
+
+from matches.benchmarking import scratch_database
+from matches.models import Match, Team, Room, Region, TeamParticipation
+
+# Tables that grow with the size of the tournament; a full scan of one of these is a regression
+LARGE_MODELS = [Match, TeamParticipation]
+
+class Command(BaseCommand):
+    help = 'Fails if any bracket or schedule query falls back to a full table scan on a large tournament'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=50000, help='Approximate number of matches to generate')
+        parser.add_argument('--rooms', type=int, default=8, help='Rooms to spread the matches over')
+        parser.add_argument('--show-plans', action='store_true', help='Print every query plan, not just failures')
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']), scratch_database():
+            self.stdout.write(f'Generating about {options["matches"]} matches...')
+            self.populate(options['matches'], options['rooms'])
+            failures = self.check_plans(options['show_plans'])
+
+        if failures:
+            raise CommandError(f'{failures} queries scan a whole table')
+        self.stdout.write(self.style.SUCCESS('No full table scans'))
+
+    def populate(self, match_count, rooms):
+        # Half the matches in one big bracket, the rest as stand-alone matches
+        bracket_teams = 2 ** max(1, math.floor(math.log2(max(2, match_count // 2))))
+        call_command('generate_mock_data', teams=bracket_teams, rooms=rooms, tournament=True, stdout=io.StringIO())
+        remaining = max(0, match_count - Match.objects.count())
+        if remaining >= 2:
+            call_command('generate_mock_data', teams=remaining // 2, rooms=rooms, stdout=io.StringIO())
+
+    def access_paths(self):
+        """Query sets the app relies on outside of page rendering"""
+        match = Match.objects.filter(home_source_match__isnull=False).order_by('-match_number').first()
+        sources = [match.home_source_match_id, match.away_source_match_id]
+        return [
+            ('upcoming matches', Match.objects.filter(is_complete=False).order_by('timeslot', 'match_number')),
+            ('scorekeeper desk', Match.objects.filter(is_complete=False).order_by('match_number')),
+            ('winner destination', Match.objects.filter(home_source_match=sources[0], home_source_take_winner=True)),
+            ('loser destination', Match.objects.filter(away_source_match=sources[1], away_source_take_winner=False)),
+            ('propagation', Match.objects.filter(Q(home_source_match__in=sources) | Q(away_source_match__in=sources))),
+            ('team matches', Team.objects.first().all_matches()),
+            ('team schedule', Team.objects.first().schedule()),
+            ('room matches', Room.objects.first().all_matches()),
+        ]
+
+    def pages(self):
+        """Pages whose queries should all be index lookups"""
+        match = Match.objects.filter(home_source_match__isnull=False).order_by('-match_number').first()
+        deep = Match.objects.filter(timeslot__isnull=False).select_related('timeslot').order_by('-match_number').first()
+        after = urlencode({'after': f'{deep.start_time.isoformat()}~{deep.match_number}'})
+        day = timezone.localdate(deep.start_time).isoformat()
+        return [
+            '/matches/',
+            f'/matches/?{after}',
+            f'/matches/?status=upcoming&{after}',
+            f'/matches/?day={day}&room={Room.objects.first().pk}',
+            f'/teams/{Team.objects.first().pk}/',
+            f'/teams/{Team.objects.first().pk}/calendar.ics',
+            f'/regions/{Region.objects.first().pk}/',
+            f'/matches/{match.pk}/',
+        ]
+
+    def check_plans(self, show_plans):
+        statements = [(label, str(qs.query), qs.explain()) for label, qs in self.access_paths()]
+
+        client = Client()
+        for path in self.pages():
+            with CaptureQueriesContext(connection) as captured:
+                response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f'{path} returned {response.status_code}')
+            seen = set()
+            for query in captured.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or sql in seen:
+                    continue
+                seen.add(sql)
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                statements.append((path, sql, plan))
+
+        failures = 0
+        for label, sql, plan in statements:
+            scans = self.full_scans(plan)
+            if scans:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'FULL SCAN in {label}: {", ".join(scans)}'))
+                self.stdout.write(f'  {sql}')
+            if scans or show_plans:
+                self.stdout.write(f'  {label}:\n    ' + plan.replace('\n', '\n    '))
+        return failures
+
+    def full_scans(self, plan):
+        """Plan steps that read a whole large table (scanning a partial index is fine)"""
+        partial_indexes = {
+            index.name for model in LARGE_MODELS for index in model._meta.indexes if index.condition is not None
+        }
+        tables = '|'.join(model._meta.db_table for model in LARGE_MODELS)
+        scans = []
+        for line in plan.splitlines():
+            step = re.search(rf'\bSCAN ({tables})\b(?: USING (?:COVERING )?INDEX (\w+))?', line)
+            if step and step.group(2) not in partial_indexes:
+                scans.append(step.group(0))
+        return scans
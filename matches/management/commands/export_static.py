@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+import os
+import time
+
+from matches import export
+from matches.models import Change
+
+class Command(BaseCommand):
+    help = 'Renders every public page, and its JSON, to a directory a static file server can serve'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=export.default_output(), help='Directory to write the site to')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes for a full build (0 renders in this process)')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running, rewriting the pages affected by each change')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between checks for changes in --watch mode')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        stamp = export.read_stamp(output)
+        if stamp is None or not options['watch']:
+            stamp = self.full_build(output, options['workers'])
+
+        while options['watch']:
+            time.sleep(options['interval'])
+            latest = Change.latest()
+            if latest == stamp:
+                continue
+            changes = export.changes_since(stamp, latest) if latest > stamp else None
+            paths = export.affected_paths(changes) if changes is not None else None
+            if paths is None:
+                stamp = self.full_build(output, options['workers'])
+                continue
+            started = time.perf_counter()
+            written = export.export_paths(output, sorted(paths))
+            export.write_stamp(output, latest)
+            stamp = latest
+            self.stdout.write(f'{len(changes)} changes: rewrote {written} files in {time.perf_counter() - started:.2f}s')
+
+    def full_build(self, output, workers):
+        """Render everything into a fresh directory, then swap it in place of the old one"""
+        started = time.perf_counter()
+        written, pages = export.build_site(output, workers)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} files for {pages} pages to {output} in {time.perf_counter() - started:.1f}s'
+        ))
+        return export.read_stamp(output)
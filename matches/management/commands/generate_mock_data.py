@@ -8,7 +8,11 @@ import math
 import csv
 
 # Import your models
-from matches.models import Team, Region, Room, Match
+from matches.bracket import propagate_results
+from matches.participation import refresh_participation
+from matches.models import Change, Team, Region, Room, Match, Timeslot, TournamentBracket, TournamentRound
+
+SLOT_MINUTES = 30
 
 class Command(BaseCommand):
     help = 'Generates mock data for tournament development'
@@ -20,34 +24,31 @@ class Command(BaseCommand):
         parser.add_argument('--file', type=str, default="", help='CSV file to create tournament from')
         parser.add_argument('--clear', action='store_true', help='Clear existing data before generating new data')
         parser.add_argument('--tournament', action='store_true', help='Create a tournament bracket structure')
-    
+
     def handle(self, *args, **options):
         if options['clear']:
             self.clear_data()
-        
+
         # Create fake data generator
         fake = faker.Faker()
-        
+
         if options['file'] != "":
             matches = self.create_bracket_from_file(options['file'])
-            if (matches > 0):
-                self.stdout.write(self.style.SUCCESS(f'Created tournament bracket with {len(matches)} matches'))
-            else:
-                self.stdout.write(self.style.SUCCESS(f'Created tournament bracket with {len(matches)} matches'))
+            self.stdout.write(self.style.SUCCESS(f'Created tournament bracket with {len(matches)} matches'))
             return
 
         # Create regions
         regions = self.create_regions(options['regions'], fake)
         self.stdout.write(self.style.SUCCESS(f'Created {len(regions)} regions'))
-        
+
         # Create teams
         teams = self.create_teams(options['teams'], regions, fake)
         self.stdout.write(self.style.SUCCESS(f'Created {len(teams)} teams'))
-        
+
         # Create rooms
         rooms = self.create_rooms(options['rooms'], fake)
         self.stdout.write(self.style.SUCCESS(f'Created {len(rooms)} rooms'))
-        
+
         # Create matches
         if options['tournament']:
             matches = self.create_tournament_bracket(teams, rooms, fake)
@@ -63,111 +64,126 @@ class Command(BaseCommand):
         Team.objects.all().delete()
         Region.objects.all().delete()
         Room.objects.all().delete()
+        Timeslot.objects.all().delete()
+        TournamentRound.objects.all().delete()
+        TournamentBracket.objects.all().delete()
         self.stdout.write(self.style.SUCCESS('All data cleared'))
-        
+
+    def record(self, objects):
+        """Log bulk-created or bulk-updated rows as Changes (bulk writes send no signals)"""
+        if objects:
+            Change.record(type(objects[0]), [obj.pk for obj in objects])
+        return objects
+
+    def unique_names(self, generate, count, taken=()):
+        """Draw count distinct names, numbering repeats once the generator runs dry"""
+        names = []
+        seen = set(taken)
+        for _ in range(count):
+            base = name = generate()
+            suffix = 2
+            while name in seen:
+                name = f'{base} {suffix}'
+                suffix += 1
+            seen.add(name)
+            names.append(name)
+        return names
+
     def create_regions(self, count, fake):
         """Create regions with random colors"""
-        region_names = [fake.unique.state() for _ in range(count)]
-        regions = []
-        
+        region_names = self.unique_names(fake.state, count, Region.objects.values_list('name', flat=True))
+
         # Sample colors
         colors = [
             'navy', 'blue', 'orange', 'black', 'indigo',
             'brown', 'gray', 'red', 'blue', 'green'
         ]
-        for i in range(count):
-            color = random.choice(colors)
-            region = Region.objects.create(
-                name=region_names[i],
-                color=color
-            )
-            regions.append(region)
-        
-        return regions
-        
+        regions = [Region(name=name, color=random.choice(colors)) for name in region_names]
+        return self.record(Region.objects.bulk_create(regions))
+
     def create_teams(self, count, regions, fake):
         """Create teams belonging to random regions"""
-        team_names = [fake.unique.city() for _ in range(count)]
-        team_emojis = [fake.unique.emoji() for _ in range(count)]
-        teams = []
-        
-        for i in range(count):
-            region = random.choice(regions)
-            team = Team.objects.create(
-                name=team_names[i],
-                emoji=team_emojis[i],
-                region=region
-            )
-            teams.append(team)
-            
-        return teams
-        
+        team_names = self.unique_names(fake.city, count, Team.objects.values_list('name', flat=True))
+        teams = [
+            Team(name=name, emoji=fake.emoji(), region=random.choice(regions))
+            for name in team_names
+        ]
+        return self.record(Team.objects.bulk_create(teams))
+
     def create_rooms(self, count, fake):
         """Create rooms for matches"""
-        rooms = []
-        
-        for i in range(count):
-            room = Room.objects.create(
-                name=f"Room {chr(65 + i)}",  # Room A, Room B, etc.
-            )
-            rooms.append(room)
-            
-        return rooms
-        
+        existing = Room.objects.count()
+        rooms = [
+            Room(name=f"Room {self.room_label(existing + i)}")  # Room A, Room B, etc.
+            for i in range(count)
+        ]
+        return self.record(Room.objects.bulk_create(rooms))
+
+    def room_label(self, index):
+        """A, B, ..., Z, AA, AB, ..."""
+        label = ''
+        index += 1
+        while index:
+            index, remainder = divmod(index - 1, 26)
+            label = chr(65 + remainder) + label
+        return label
+
+    def create_timeslots(self, count):
+        """Create count consecutive timeslots after any that already exist"""
+        latest = Timeslot.objects.order_by('-start_time').first()
+        if latest:
+            start = latest.start_time + timedelta(minutes=SLOT_MINUTES)
+        else:
+            start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        slots = [Timeslot(start_time=start + timedelta(minutes=i * SLOT_MINUTES)) for i in range(count)]
+        return self.record(Timeslot.objects.bulk_create(slots))
+
+    def next_match_number(self):
+        last = Match.objects.order_by('-match_number').values_list('match_number', flat=True).first()
+        return (last or 0) + 1
+
     @transaction.atomic
     def create_matches(self, count, teams, rooms, fake):
         """Create individual matches between teams"""
+        slots = self.create_timeslots(math.ceil(count / len(rooms)))
+        first_number = self.next_match_number()
         matches = []
-        
-        # Start time base (beginning of a tournament day)
-        start_date = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
-        
-        match_numbers = random.sample(range(1, 300), count)  # Unique match numbers
-        
-        for i, match_number in enumerate(match_numbers):
-            # Calculate a match time
-            day_offset = i // 10  # Every 10 matches move to next day
-            time_slot = i % 10    # 10 matches per day
-            
-            match_time = start_date + timedelta(days=day_offset, minutes=time_slot*30)
-            
+
+        for i in range(count):
             # Select two different teams
-            available_teams = list(teams)
-            home_team = random.choice(available_teams)
-            available_teams.remove(home_team)
-            away_team = random.choice(available_teams)
-            
-            # Select a room
-            room = random.choice(rooms)
-            
-            # Create the match
-            match = Match.objects.create(
-                match_number=match_number,
-                start_time=match_time,
-                room=room,
+            home_team, away_team = random.sample(teams, 2)
+            match = Match(
+                match_number=first_number + i,
+                timeslot=slots[i // len(rooms)],
+                room=rooms[i % len(rooms)],
                 home_team=home_team,
                 away_team=away_team
             )
-            
+
             # Randomly add scores to some matches (past matches)
             if random.random() < 0.7:  # 70% of matches have scores
                 match.home_score = 5*random.randint(0, 30)
                 match.away_score = 5*random.randint(0, 30)
                 match.is_complete = True
-                match.save()
-                
+
             matches.append(match)
-            
+
+        matches = self.record(Match.objects.bulk_create(matches))
+        refresh_participation([m.pk for m in matches])
         return matches
 
+    def schedule_round(self, matches, rooms):
+        """Give each match in a round its own (timeslot, room) pair"""
+        slots = self.create_timeslots(math.ceil(len(matches) / len(rooms)))
+        for i, match in enumerate(matches):
+            match.timeslot = slots[i // len(rooms)]
+            match.room = rooms[i % len(rooms)]
+
     @transaction.atomic
     def create_tournament_bracket(self, teams, rooms, fake):
         """Create a tournament bracket structure with dependent matches"""
         all_matches = []
-        
-        # Start time base for the tournament
-        start_date = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
-        
+
         # Use teams in powers of 2 for a proper bracket
         team_count = len(teams)
         team_power = 2 ** math.floor(math.log2(team_count))
@@ -175,84 +191,78 @@ class Command(BaseCommand):
             self.stdout.write(f"Using {team_power} teams for a clean bracket (original count: {team_count})")
             teams = teams[:team_power]
             team_count = team_power
-        
+
         # Calculate tournament structure
         rounds_needed = int(math.log2(team_count))
         matches_per_round = []
         for r in range(rounds_needed):
             matches_per_round.append(team_count // (2**(r+1)))
-        
+
         self.stdout.write(f"Creating a tournament with {rounds_needed} rounds")
         self.stdout.write(f"Teams per round: {team_count} -> {matches_per_round}")
-        
+
+        bracket_number = TournamentBracket.objects.count() + 1
+        bracket = TournamentBracket.objects.create(name=f'Championship {bracket_number}', priority=bracket_number)
+        rounds = self.record(TournamentRound.objects.bulk_create([
+            TournamentRound(bracket=bracket, name='Final' if r == rounds_needed - 1 else f'Round {r + 1}')
+            for r in range(rounds_needed)
+        ]))
+        match_number = self.next_match_number()
+
         # Create first round matches with teams assigned
         round1_matches = []
         for i in range(matches_per_round[0]):
-            match_time = start_date + timedelta(minutes=i*45)
-            room = rooms[i % len(rooms)]
-            
-            # Get the teams for this match
-            home_team = teams[i*2]
-            away_team = teams[i*2 + 1]
-            
-            match = Match.objects.create(
-                match_number=i+1,  # Start with match 1, 2, 3, etc.
-                start_time=match_time,
-                room=room,
-                home_team=home_team,
-                away_team=away_team
-            )
-            round1_matches.append(match)
-            all_matches.append(match)
-        
+            round1_matches.append(Match(
+                match_number=match_number,
+                tournament_round=rounds[0],
+                home_team=teams[i*2],
+                away_team=teams[i*2 + 1]
+            ))
+            match_number += 1
+        self.schedule_round(round1_matches, rooms)
+        round1_matches = self.record(Match.objects.bulk_create(round1_matches))
+        all_matches.extend(round1_matches)
+
         # Create subsequent rounds with dependencies
         last_round_matches = round1_matches
-        match_number = len(round1_matches) + 1
-        
         for round_idx in range(1, rounds_needed):
             current_round_matches = []
-            match_count = matches_per_round[round_idx]
-            day_offset = round_idx  # Each round happens on a new day
-            
-            for i in range(match_count):
-                match_time = start_date + timedelta(days=day_offset, minutes=i*45)
-                room = rooms[i % len(rooms)]
-                
+            for i in range(matches_per_round[round_idx]):
                 # Previous round matches that feed into this one
-                feed_idx_1 = i*2
-                feed_idx_2 = i*2 + 1
-                
-                if feed_idx_1 < len(last_round_matches) and feed_idx_2 < len(last_round_matches):
-                    match = Match.objects.create(
-                        match_number=match_number,
-                        start_time=match_time,
-                        room=room,
-                        home_from_match=last_round_matches[feed_idx_1],
-                        home_from_result='winner',
-                        away_from_match=last_round_matches[feed_idx_2],
-                        away_from_result='winner'
-                    )
-                    current_round_matches.append(match)
-                    all_matches.append(match)
-                    match_number += 1
-            
-            # Update for next round
-            last_round_matches = current_round_matches
-        
-        # Add some consolation matches using losers
-        for i in range(min(4, len(round1_matches))):
-            source_match = round1_matches[i]
-            
-            consolation_match = Match.objects.create(
-                match_number=900 + i,
-                start_time=start_date + timedelta(days=1, hours=i),
-                room=random.choice(rooms),
-                home_from_match=source_match,
-                home_from_result='loser'
-            )
-            all_matches.append(consolation_match)
-        
+                current_round_matches.append(Match(
+                    match_number=match_number,
+                    tournament_round=rounds[round_idx],
+                    home_source_match=last_round_matches[i*2],
+                    home_source_take_winner=True,
+                    away_source_match=last_round_matches[i*2 + 1],
+                    away_source_take_winner=True
+                ))
+                match_number += 1
+            self.schedule_round(current_round_matches, rooms)
+            last_round_matches = self.record(Match.objects.bulk_create(current_round_matches))
+            all_matches.extend(last_round_matches)
+
+        # Add some consolation matches between first round losers
+        consolation_count = min(2, len(round1_matches) // 2)
+        if consolation_count:
+            consolation = TournamentBracket.objects.create(name=f'Consolation {bracket_number}', priority=bracket_number + 100)
+            consolation_round = TournamentRound.objects.create(bracket=consolation, name='Round 1')
+            consolation_matches = []
+            for i in range(consolation_count):
+                consolation_matches.append(Match(
+                    match_number=match_number,
+                    tournament_round=consolation_round,
+                    home_source_match=round1_matches[i*2],
+                    home_source_take_winner=False,
+                    away_source_match=round1_matches[i*2 + 1],
+                    away_source_take_winner=False
+                ))
+                match_number += 1
+            self.schedule_round(consolation_matches, rooms)
+            all_matches.extend(self.record(Match.objects.bulk_create(consolation_matches)))
+
         # Complete some first round matches to trigger advancement
+        completed = []
         for i, match in enumerate(round1_matches):
             if i < len(round1_matches) // 2:  # Complete half of the first round
                 if random.random() > 0.5:
@@ -263,13 +273,15 @@ class Command(BaseCommand):
                     # Away team wins
                     match.home_score = random.randint(0, 49)
                     match.away_score = random.randint(50, 100)
-                
+
                 match.is_complete = True
-                match.save()
+                completed.append(match)
+        Match.objects.bulk_update(completed, ['home_score', 'away_score', 'is_complete'])
+        self.record(completed)
+        propagate_results(completed)
+        # bulk_create skipped the team schedules; everything hangs off the first round
+        refresh_participation([m.pk for m in round1_matches])
 
-                # Manually update next match since we can't rely on the model method yet
-                # self.update_next_matches(match)
-        
         return all_matches
 
     @transaction.atomic
@@ -282,64 +294,15 @@ class Command(BaseCommand):
                 match_id = row['match']
 
                 # Then, find the two teams
-                away = row['away']
+                home = Team.objects.filter(name__iexact=row['home']).first()
+                away = Team.objects.filter(name__iexact=row['away']).first()
                 match = Match.objects.create(
                     match_number=match_id,
                     home_team=home,
                     away_team=away,
                 )
                 matches.append(match)
-                
+
                 print(row)
+        refresh_participation([m.pk for m in matches])
         return matches
-
-    
-    def update_next_matches(self, match):
-        """Manually update the next matches based on match result"""
-        if not match.is_complete:
-            return
-        
-        winning_team = None
-        losing_team = None
-        
-        # Determine winner and loser
-        if match.home_score > match.away_score:
-            winning_team = match.home_team
-            losing_team = match.away_team
-        elif match.away_score > match.home_score:
-            winning_team = match.away_team
-            losing_team = match.home_team
-        
-        if not winning_team:
-            return
-        
-        # Find matches where this match is the source
-        winner_destinations = Match.objects.filter(
-            (models.Q(home_from_match=match) & models.Q(home_from_result='winner')) |
-            (models.Q(away_from_match=match) & models.Q(away_from_result='winner'))
-        )
-        
-        loser_destinations = Match.objects.filter(
-            (models.Q(home_from_match=match) & models.Q(home_from_result='loser')) |
-            (models.Q(away_from_match=match) & models.Q(away_from_result='loser'))
-        )
-        
-        # Update winner destinations
-        for dest in winner_destinations:
-            if dest.home_from_match == match and dest.home_from_result == 'winner':
-                dest.home_team = winning_team
-            
-            if dest.away_from_match == match and dest.away_from_result == 'winner':
-                dest.away_team = winning_team
-            
-            dest.save()
-        
-        # Update loser destinations
-        for dest in loser_destinations:
-            if dest.home_from_match == match and dest.home_from_result == 'loser':
-                dest.home_team = losing_team
-            
-            if dest.away_from_match == match and dest.away_from_result == 'loser':
-                dest.away_team = losing_team
-            
-            dest.save()
@@ -0,0 +1,173 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import io
+import multiprocessing
+import os
+import threading
+import time
+
+from matches import loadtest_worker
+from matches.benchmarking import percentile, scratch_database, serve_asgi, serve_wsgi
+from matches.models import Match, Room, Team
+
+# Tournament sizes, in the generate_mock_data command's terms
+SCENARIOS = {
+    'small': {'teams': 16, 'rooms': 3},
+    'medium': {'teams': 64, 'rooms': 8},
+    'large': {'teams': 256, 'rooms': 16},
+}
+
+
+# Entry points, by the setting that names them
+SERVERS = {'wsgi': 'WSGI_APPLICATION', 'asgi': 'ASGI_APPLICATION'}
+
+
+class Command(BaseCommand):
+    help = 'Starts the site on loopback and drives it with spectators, door kiosks and scorekeepers from other processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=SCENARIOS, default='medium', help='Size of the generated tournament')
+        parser.add_argument('--spectators', type=int, default=32, help='Clients browsing public pages')
+        parser.add_argument('--kiosks', type=int, default=4, help='Room door displays long-polling for updates')
+        parser.add_argument('--scorekeepers', type=int, default=4, help='Clients submitting results')
+        parser.add_argument('--listeners', type=int, default=0,
+                            help='Slow clients holding a live score stream open, like open match pages')
+        parser.add_argument('--server', choices=SERVERS, default='wsgi', help='Entry point to serve the site through')
+        parser.add_argument('--wsgi-threads', type=int, default=0,
+                            help='Serve WSGI from a pool of this many threads instead of a thread per connection')
+        parser.add_argument('--seconds', type=float, default=20, help='How long to run')
+        parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Client processes to spread the clients over')
+
+    def handle(self, *args, **options):
+        samples, elapsed, threads = self.run(options)
+        self.report(samples, elapsed)
+        self.stdout.write(f'Server process peaked at {threads} threads')
+
+    def run(self, options):
+        """Generate a tournament on a scratch database, serve it and drive it; returns (samples, seconds, peak threads)"""
+        configured = settings.DATABASES['default']
+        scenario = SCENARIOS[options['scenario']]
+        # Same database settings as production, on a throwaway file
+        with override_settings(ALLOWED_HOSTS=['127.0.0.1', 'testserver']), \
+                scratch_database(options=dict(configured['OPTIONS']), conn_max_age=configured['CONN_MAX_AGE']):
+            self.stdout.write(f'Generating a {options["scenario"]} tournament ({scenario["teams"]} teams)...')
+            call_command('generate_mock_data', tournament=True, stdout=io.StringIO(), **scenario)
+            plan, roles = self.plan(options)
+            connection.close()
+
+            application = import_string(getattr(settings, SERVERS[options['server']]))
+            if options['server'] == 'asgi':
+                server = serve_asgi(application)
+            else:
+                server = serve_wsgi(application, threads=options['wsgi_threads'])
+            with server as (plan['host'], plan['port']):
+                self.stdout.write(
+                    f'Serving {options["server"].upper()} on {plan["host"]}:{plan["port"]}; running '
+                    f'{options["spectators"]} spectators, {options["kiosks"]} kiosks, {options["listeners"]} '
+                    f'listeners and {options["scorekeepers"]} scorekeepers for {options["seconds"]}s...'
+                )
+                try:
+                    return self.drive(plan, roles, options)
+                finally:
+                    connection.close()
+
+    def plan(self, options):
+        """Everything the client processes need to know, plus each client's role"""
+        teams = list(Team.objects.values_list('pk', flat=True))
+        rooms = list(Room.objects.values_list('pk', flat=True))
+        matches = list(Match.objects.values_list('pk', flat=True))
+        if not teams or not rooms or not matches:
+            raise CommandError('The generated tournament is empty')
+        pages = [
+            ('home', '/', 5),
+            ('matches_list', '/matches/', 20),
+            ('matches_list', '/matches/?status=upcoming', 10),
+            ('brackets', '/brackets/', 10),
+        ]
+        pages += [('team_detail', f'/teams/{pk}/', 25 / len(teams)) for pk in teams]
+        pages += [('room_detail', f'/rooms/{pk}/', 15 / len(rooms)) for pk in rooms]
+        pages += [('match_detail', f'/matches/{pk}/', 15 / len(matches)) for pk in matches]
+
+        # Scorekeepers need a session and a CSRF token like a browser would have
+        staff = User.objects.create_user('loadtest', is_staff=True)
+        client = Client()
+        client.force_login(staff)
+        plan = {'pages': pages, 'session': client.cookies['sessionid'].value, 'csrf': get_random_string(32)}
+
+        # Each scorekeeper owns a share of the playable matches, so they only conflict through propagation
+        playable = dict(Match.objects.filter(
+            home_team__isnull=False, away_team__isnull=False
+        ).values_list('pk', 'version'))
+        shares = [{} for _ in range(options['scorekeepers'])]
+        for i, (pk, version) in enumerate(playable.items()):
+            if shares:
+                shares[i % len(shares)][pk] = version
+
+        roles = [('spectator',)] * options['spectators']
+        roles += [('kiosk', rooms[i % len(rooms)]) for i in range(options['kiosks'])]
+        roles += [('scorekeeper', share) for share in shares]
+        # Listeners watch matches still being played, whose streams stay open
+        live = list(Match.objects.filter(is_complete=False).values_list('pk', flat=True)) or matches
+        roles += [('listener', live)] * options['listeners']
+        return plan, roles
+
+    def drive(self, plan, roles, options):
+        processes = max(1, min(options['processes'], len(roles)))
+        chunks = [roles[i::processes] for i in range(processes)]
+        peak, done = [threading.active_count()], threading.Event()
+
+        def count_threads():
+            while not done.wait(0.2):
+                peak[0] = max(peak[0], threading.active_count())
+
+        sampler = threading.Thread(target=count_threads, daemon=True)
+        sampler.start()
+        # Spawned, so the clients share nothing with the server process
+        try:
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+                started = time.perf_counter()
+                futures = [pool.submit(loadtest_worker.run, plan, chunk, options['seconds'], seed)
+                           for seed, chunk in enumerate(chunks)]
+                samples = [sample for future in futures for sample in future.result()]
+                elapsed = time.perf_counter() - started
+        finally:
+            done.set()
+            sampler.join()
+        return samples, elapsed, peak[0]
+
+    def report(self, samples, elapsed):
+        def ms(values, pct):
+            return f'{percentile(values, pct) * 1000:8.1f}'
+
+        by_route = defaultdict(list)
+        errors = defaultdict(int)
+        for route, seconds, status in samples:
+            if status == 200:
+                by_route[route].append(seconds)
+            else:
+                errors[route] += 1
+
+        self.stdout.write(f'\n{"route":<18} {"requests":>8} {"req/s":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for route in sorted(set(by_route) | set(errors)):
+            times = by_route[route]
+            self.stdout.write(
+                f'{route:<18} {len(times):>8} {len(times) / elapsed:>8.1f} {errors[route]:>6} '
+                f'{ms(times, 50)} {ms(times, 95)} {ms(times, 99)}'
+            )
+        total = sum(len(times) for times in by_route.values())
+        style = self.style.SUCCESS if not sum(errors.values()) else self.style.WARNING
+        self.stdout.write(style(
+            f'{total} requests in {elapsed:.1f}s ({total / elapsed:.1f}/s), {sum(errors.values())} errors'
+        ))
+        self.stdout.write('room_kiosk_poll times include waiting for a change, so they measure how soon kiosks update')
+        if 'match_live' in by_route:
+            self.stdout.write('match_live times are to the first byte of the stream; listeners then stay connected')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+import time
+
+from matches import images, jobs
+from matches.models import Room
+
+class Command(BaseCommand):
+    help = 'Makes the resized copies of room maps uploaded before they were made automatically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Remake every map, e.g. after changing the sizes, not just those without copies')
+        parser.add_argument('--queue', action='store_true', help='Queue a job per map for run_jobs instead')
+
+    def handle(self, *args, **options):
+        rooms = [room for room in Room.objects.exclude(map='').exclude(map__isnull=True)
+                 if options['all'] or images.is_stale(room)]
+        for room in rooms:
+            if options['queue']:
+                jobs.enqueue('process_room_map', dedup_key=f'room-map-{room.pk}', room_id=room.pk, force=options['all'])
+                continue
+            started = time.perf_counter()
+            count = images.process(room)
+            self.stdout.write(f'{room}: {count} copies in {time.perf_counter() - started:.1f}s')
+        verb = 'Queued' if options['queue'] else 'Processed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(rooms)} room maps'))
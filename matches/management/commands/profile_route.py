@@ -0,0 +1,231 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import Resolver404, resolve
+from collections import Counter, defaultdict
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+from matches.benchmarking import percentile
+
+# Where a frame of Django's template engine renders one node
+RENDER_NODE = 'render_annotated'
+
+
+def template_location():
+    """The template line being rendered on this thread, or None outside of templates"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == RENDER_NODE:
+            node = frame.f_locals.get('self')
+            origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name or origin.name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryLog:
+    """connection.execute_wrapper keeping every query with its time and the template line that ran it"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        location = template_location()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - start, sql, repr(params), location))
+
+
+class StackSampler(threading.Thread):
+    """Samples the Python stacks of one thread, and of every thread started after it, into collapsed-stack counts.
+
+    An async view's own code runs on the event loop thread that the test
+    client's async_to_sync starts for each request, not on the thread making
+    the request.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = True
+        self.existing = set(sys._current_frames()) - {thread_id}
+
+    def run(self):
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or thread_id in self.existing:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if names:
+                    self.stacks[';'.join(reversed(names))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'Profiles repeated requests to one page: cProfile stats, flamegraph stacks and every SQL query. '
+        'Threads the request starts, such as the event loop running an async view, are profiled too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of a page, e.g. /teams/3/ or "/matches/?status=upcoming"')
+        parser.add_argument('--user', help='Username to log in as (pages look different to staff)')
+        parser.add_argument('--repeat', type=int, default=10, help='Requests to make in each pass')
+        parser.add_argument('--interval', type=float, default=1, help='Milliseconds between stack samples')
+        parser.add_argument('--output', default='profiles', help='Directory for the pstats, stacks and query files')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            match = resolve(path.split('?')[0])
+        except Resolver404:
+            raise CommandError(f'{path} is not a page of this site')
+        name = match.url_name or 'page'
+
+        client = Client()
+        if options['user']:
+            try:
+                client.force_login(get_user_model().objects.get(username=options['user']))
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'No user named {options["user"]}')
+
+        os.makedirs(options['output'], exist_ok=True)
+        prefix = os.path.join(options['output'], name)
+        repeat = max(1, options['repeat'])
+
+        # Every request should render, not come out of the micro-cache
+        with override_settings(ALLOWED_HOSTS=['testserver'], MICRO_CACHE_SECONDS=0):
+            self.request(client, path)  # warm up imports and in-process caches
+            timings, query_logs, stacks = self.sampled_pass(client, path, repeat, options['interval'] / 1000)
+            profile = self.profiled_pass(client, path, repeat)
+
+        profile.dump_stats(f'{prefix}.pstats')
+        with open(f'{prefix}.folded', 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f'{stack} {count}\n')
+        with open(f'{prefix}-queries.txt', 'w') as f:
+            f.write(self.query_report(query_logs[-1]))
+
+        counts = [len(log.queries) for log in query_logs]
+        sql_times = [sum(q[0] for q in log.queries) for log in query_logs]
+        self.stdout.write(f'{path} ({name}), {repeat} requests')
+        self.stdout.write(
+            f'  time     p50 {percentile(timings, 50) * 1000:.1f} ms  p95 {percentile(timings, 95) * 1000:.1f} ms'
+            f'  max {max(timings) * 1000:.1f} ms'
+        )
+        self.stdout.write(f'  queries  {max(counts)} per request, {percentile(sql_times, 50) * 1000:.1f} ms in SQL (p50)')
+
+        stream = io.StringIO()
+        profile.stream = stream
+        profile.sort_stats('cumulative').print_stats(15)
+        self.stdout.write(stream.getvalue())
+        self.stdout.write(self.duplicate_summary(query_logs[-1]))
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {prefix}.pstats, {prefix}.folded (for flamegraph.pl) and {prefix}-queries.txt'
+        ))
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'{path} returned {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    def sampled_pass(self, client, path, repeat, interval):
+        """Time each request, log its queries, and sample stacks for the flamegraph"""
+        timings, logs = [], []
+        switch = sys.getswitchinterval()
+        # Let the sampler get the GIL about as often as it asks to
+        sys.setswitchinterval(min(switch, interval))
+        sampler = StackSampler(threading.get_ident(), interval)
+        sampler.start()
+        try:
+            for _ in range(repeat):
+                log = QueryLog()
+                start = time.perf_counter()
+                with connection.execute_wrapper(log):
+                    self.request(client, path)
+                timings.append(time.perf_counter() - start)
+                logs.append(log)
+        finally:
+            sampler.stop()
+            sys.setswitchinterval(switch)
+        return timings, logs, sampler.stacks
+
+    def profiled_pass(self, client, path, repeat):
+        """cProfile stats of the requests, merged from this thread and every thread they started.
+
+        A cProfile.Profile only sees the thread that enabled it, so each new
+        thread enables its own as it starts.
+        """
+        profiles = [cProfile.Profile()]
+        lock = threading.Lock()
+
+        def profile_thread(*args):
+            profile = cProfile.Profile()
+            with lock:
+                profiles.append(profile)
+            # Replaces this hook for the rest of the thread
+            profile.enable()
+
+        threading.setprofile(profile_thread)
+        try:
+            for _ in range(repeat):
+                profiles[0].enable()
+                try:
+                    self.request(client, path)
+                finally:
+                    profiles[0].disable()
+        finally:
+            threading.setprofile(None)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def query_report(self, log):
+        lines = []
+        for seconds, sql, params, location in log.queries:
+            lines.append(f'{seconds * 1000:8.2f} ms  {location or "(view)"}\n  {sql}\n  params {params}\n')
+        return '\n'.join(lines)
+
+    def duplicate_summary(self, log):
+        """Queries run more than once in a request: identical ones, and ones differing only in parameters"""
+        identical = Counter((sql, params) for _, sql, params, _ in log.queries)
+        similar = defaultdict(list)
+        for seconds, sql, _, location in log.queries:
+            similar[sql].append((seconds, location))
+
+        lines = []
+        repeated = [(count, sql) for (sql, _), count in identical.items() if count > 1]
+        lines.append(f'Identical queries run more than once: {len(repeated)}')
+        for count, sql in sorted(repeated, reverse=True)[:10]:
+            lines.append(f'  {count}x  {sql[:160]}')
+        patterns = sorted(((len(runs), sql, runs) for sql, runs in similar.items() if len(runs) > 1), reverse=True)
+        lines.append(f'Queries repeated with different parameters: {len(patterns)}')
+        for count, sql, runs in patterns[:10]:
+            where = Counter(location or '(view)' for _, location in runs).most_common(3)
+            total = sum(seconds for seconds, _ in runs) * 1000
+            lines.append(f'  {count}x  {total:.1f} ms  from {", ".join(f"{loc} ({n})" for loc, n in where)}')
+            lines.append(f'       {sql[:160]}')
+        return '\n'.join(lines)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from matches.models import TeamParticipation
+from matches.participation import refresh_participation
+
+class Command(BaseCommand):
+    help = 'Rebuilds the team schedule table from the matches and bracket links'
+
+    def handle(self, *args, **options):
+        refresh_participation()
+        count = TeamParticipation.objects.count()
+        projected = TeamParticipation.objects.filter(confirmed=False).count()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} team participations ({projected} projected)'))
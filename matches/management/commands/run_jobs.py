@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+import os
+import socket
+import threading
+import time
+
+from matches import jobs
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (static export, schedule rebuilds) on a pool of threads until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Jobs to run at once')
+        parser.add_argument('--poll', type=float, default=1, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is ready instead of waiting')
+        parser.add_argument('--stale-minutes', type=float, default=60,
+                            help='Requeue jobs that have been running this long, whose worker must have died')
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        requeued = jobs.requeue_stale(options['stale_minutes'])
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} abandoned jobs')
+        connection.close()
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(f'{worker}/{i}', stop, options), daemon=True)
+            for i in range(options['threads'])
+        ]
+        self.stdout.write(f'Running jobs on {len(threads)} threads as {worker}')
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            # Let running jobs finish rather than leave them marked as running
+            self.stdout.write('Stopping after the running jobs...')
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self, worker, stop, options):
+        try:
+            while not stop.is_set():
+                job = jobs.claim(worker)
+                if job is None:
+                    if options['once']:
+                        return
+                    stop.wait(options['poll'])
+                    continue
+                started = time.perf_counter()
+                jobs.run(job)
+                style = self.style.SUCCESS if job.status == job.Status.DONE else self.style.WARNING
+                self.stdout.write(style(f'{job} after {time.perf_counter() - started:.1f}s'))
+        finally:
+            connection.close()
@@ -0,0 +1,211 @@
+"""Per-page request metrics, served in the Prometheus text format at /metrics.
+
+MetricsMiddleware records, for every request to a named URL of this app, how
+long it took, how many SQL queries it ran and how long they took, and how
+long its templates took to render. Each goes into a histogram labelled with
+the URL name. Histograms live in the memory of the process, so with several
+server processes each one reports its own share.
+
+Queries are timed by an execute wrapper put on every database connection as
+it opens, which adds to the recorder of the request it is running for. That
+recorder is found through an asgiref Local, so it follows an async view into
+the sync_to_async thread its ORM calls run in, on that thread's connection.
+
+With SLOW_REQUEST_SECONDS set, any request at least that slow is logged to
+the matches.metrics logger together with every query it ran.
+"""
+import logging
+import threading
+import time
+
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observations, one series per label value"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self.lock:
+            counts, total = self.series.get(label, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.series[label] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted((label, list(counts), total) for label, (counts, total) in self.series.items())
+        for label, counts, total in series:
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                lines.append(f'{self.name}_bucket{{view="{label}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_sum{{view="{label}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{view="{label}"}} {counts[-1]}')
+        return '\n'.join(lines)
+
+
+REQUEST_SECONDS = Histogram('tourneyman_request_seconds', 'Time to produce the response.', SECONDS_BUCKETS)
+QUERY_COUNT = Histogram('tourneyman_request_queries', 'SQL queries run per request.', QUERY_BUCKETS)
+QUERY_SECONDS = Histogram('tourneyman_request_query_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS)
+TEMPLATE_SECONDS = Histogram('tourneyman_template_render_seconds', 'Time spent rendering templates per request.', SECONDS_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, QUERY_COUNT, QUERY_SECONDS, TEMPLATE_SECONDS)
+
+# Template render time of the request being handled; follows an async request into
+# the thread its templates render in
+_templates = Local()
+# QueryRecorder of the request being handled, found the same way
+_queries = Local()
+_instrument_lock = threading.Lock()
+
+
+def instrument_templates():
+    """Time Template.render, counting only the outermost template so includes are not counted twice"""
+    with _instrument_lock:
+        if getattr(Template.render, 'metrics_instrumented', False):
+            return
+        original = Template.render
+
+        def render(self, context):
+            if getattr(_templates, 'depth', None) is None:
+                return original(self, context)
+            _templates.depth += 1
+            start = time.perf_counter()
+            try:
+                return original(self, context)
+            finally:
+                _templates.depth -= 1
+                if not _templates.depth:
+                    _templates.seconds += time.perf_counter() - start
+
+        render.metrics_instrumented = True
+        Template.render = render
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper on every connection, handing each query to the current request's recorder"""
+    recorder = getattr(_queries, 'recorder', None)
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def instrument_connection(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_queries():
+    """Time queries on connections opened from now on, and on those this thread already has; called from AppConfig.ready"""
+    connection_created.connect(instrument_connection, dispatch_uid='matches.metrics')
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(connection)
+
+
+class QueryRecorder:
+    """Times each query of one request, keeping the SQL only if asked to"""
+
+    def __init__(self, keep_sql):
+        self.keep_sql = keep_sql
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_sql:
+                self.queries.append((elapsed, sql))
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        instrument_templates()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        slow = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+        recorder = QueryRecorder(keep_sql=slow is not None)
+        _templates.depth, _templates.seconds = 0, 0.0
+        _queries.recorder = recorder
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            template_seconds = _templates.seconds
+            _templates.depth = _queries.recorder = None
+        return self.observe(request, response, elapsed, recorder, template_seconds, slow)
+
+    async def __acall__(self, request):
+        slow = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+        recorder = QueryRecorder(keep_sql=slow is not None)
+        _templates.depth, _templates.seconds = 0, 0.0
+        _queries.recorder = recorder
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            template_seconds = _templates.seconds
+            _templates.depth = _queries.recorder = None
+        return self.observe(request, response, elapsed, recorder, template_seconds, slow)
+
+    def observe(self, request, response, elapsed, recorder, template_seconds, slow):
+        match = request.resolver_match
+        # Only this app's pages: admin URLs are namespaced
+        if match is None or not match.url_name or match.namespace:
+            return response
+        view = match.url_name
+        REQUEST_SECONDS.observe(view, elapsed)
+        QUERY_COUNT.observe(view, recorder.count)
+        QUERY_SECONDS.observe(view, recorder.seconds)
+        TEMPLATE_SECONDS.observe(view, template_seconds)
+
+        if slow is not None and elapsed >= slow:
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs, %d queries in %.3fs, templates %.3fs\n%s',
+                request.method, request.get_full_path(), view, elapsed, recorder.count, recorder.seconds,
+                template_seconds, '\n'.join(f'  {seconds * 1000:8.2f} ms  {sql}' for seconds, sql in recorder.queries),
+            )
+        return response
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for staff and INTERNAL_IPS only"""
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise PermissionDenied
+    body = '\n\n'.join(h.render() for h in HISTOGRAMS) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,126 @@
+"""Whole-response caching of public pages for anonymous spectators"""
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import threading
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .models import Change
+
+# Key -> [lock, number of requests using it], so identical requests render once
+_inflight = {}
+# Key -> future of the cache entry an async view is rendering; async waiters can
+# be on any event loop (each WSGI request running an async view has its own)
+_pending = {}
+_inflight_lock = threading.Lock()
+
+
+def micro_cache(view):
+    """Serve anonymous GETs of a view from a cache for a few seconds (MICRO_CACHE_SECONDS).
+
+    The key includes the change stamp, so any save makes every cached page
+    stale at once. While one request renders a page, identical requests
+    wait for it and share the result instead of rendering it again. Logged
+    in users (staff especially) always get a fresh page, and a response that
+    sets a cookie is never stored. Works on sync and async views alike.
+    """
+    if iscoroutinefunction(view):
+        return _async_micro_cache(view)
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        seconds = getattr(settings, 'MICRO_CACHE_SECONDS', 5)
+        if not seconds or request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+        key = f'microcache:{Change.latest()}:{request.method}:{path}'
+        cached = cache.get(key)
+        if cached is not None:
+            return _restore(cached, 'hit')
+
+        with _inflight_lock:
+            entry = _inflight.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                # Someone else may have rendered it while we waited
+                cached = cache.get(key)
+                if cached is not None:
+                    return _restore(cached, 'coalesced')
+                response = view(request, *args, **kwargs)
+                if _cacheable(request, response):
+                    cache.set(key, (response.status_code, list(response.items()), response.content), seconds)
+                response['X-Micro-Cache'] = 'miss'
+                return response
+        finally:
+            with _inflight_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del _inflight[key]
+    return wrapped
+
+
+def _async_micro_cache(view):
+    @functools.wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        seconds = getattr(settings, 'MICRO_CACHE_SECONDS', 5)
+        if not seconds or request.method not in ('GET', 'HEAD') or (await request.auser()).is_authenticated:
+            return await view(request, *args, **kwargs)
+
+        path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+        key = f'microcache:{await Change.alatest()}:{request.method}:{path}'
+        cached = await cache.aget(key)
+        if cached is not None:
+            return _restore(cached, 'hit')
+
+        with _inflight_lock:
+            future = _pending.get(key)
+            leader = future is None
+            if leader:
+                future = _pending[key] = concurrent.futures.Future()
+        if not leader:
+            cached = await asyncio.wrap_future(future)
+            if cached is not None:
+                return _restore(cached, 'coalesced')
+            # The first request's response could not be shared
+            return await view(request, *args, **kwargs)
+
+        entry = None
+        try:
+            response = await view(request, *args, **kwargs)
+            if _cacheable(request, response):
+                entry = (response.status_code, list(response.items()), response.content)
+                await cache.aset(key, entry, seconds)
+            response['X-Micro-Cache'] = 'miss'
+            return response
+        finally:
+            with _inflight_lock:
+                del _pending[key]
+            future.set_result(entry)
+    return wrapped
+
+
+def _cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # The CSRF middleware is about to set a cookie for this response
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def _restore(cached, state):
+    status, headers, content = cached
+    response = HttpResponse(content, status=status)
+    for name, value in headers:
+        response[name] = value
+    response['X-Micro-Cache'] = state
+    return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 13:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0013_alter_tournamentround_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='match',
+            name='room',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='matches.room'),
+        ),
+        migrations.CreateModel(
+            name='QuestionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.PositiveSmallIntegerField()),
+                ('is_home', models.BooleanField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Correct'), (2, 'Error'), (3, 'Foul'), (4, 'Bonus')])),
+                ('points', models.SmallIntegerField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_events', to='matches.match')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0015_match_version_resultsubmission'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('is_complete', False)), fields=['timeslot', 'match_number'], name='match_upcoming_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('is_complete', False)), fields=['match_number'], name='match_upcoming_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['home_source_match', 'home_source_take_winner'], name='match_home_destination_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['away_source_match', 'away_source_take_winner'], name='match_away_destination_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['home_team', 'timeslot'], name='match_home_team_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['away_team', 'timeslot'], name='match_away_team_idx'),
+        ),
+    ]
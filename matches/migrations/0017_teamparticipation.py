@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-19 14:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# A frozen copy of matches.participation as it was when this migration was
+# written, so later changes to that module can't change what it does.
+GRAPH_FIELDS = (
+    'id', 'match_number', 'is_complete', 'home_team_id', 'away_team_id',
+    'home_source_match_id', 'away_source_match_id', 'timeslot__start_time',
+)
+
+
+def project_slots(matches):
+    known = {}
+    rows = []
+    for match in sorted(matches, key=lambda m: m['match_number']):
+        candidates = set()
+        for is_home, side in ((True, 'home'), (False, 'away')):
+            team_id = match[f'{side}_team_id']
+            if team_id:
+                rows.append((team_id, match['id'], is_home, True, match['timeslot__start_time']))
+                candidates.add(team_id)
+                continue
+            source = known.get(match[f'{side}_source_match_id'])
+            if source and not source[0] and source[1] < match['match_number']:
+                for team_id in source[2]:
+                    rows.append((team_id, match['id'], is_home, False, match['timeslot__start_time']))
+                candidates |= source[2]
+        known[match['id']] = (match['is_complete'], match['match_number'], candidates)
+    return rows
+
+
+def populate(apps, schema_editor):
+    Match = apps.get_model('matches', 'Match')
+    TeamParticipation = apps.get_model('matches', 'TeamParticipation')
+    TeamParticipation.objects.bulk_create([
+        TeamParticipation(team_id=team_id, match_id=match_id, is_home=is_home, confirmed=confirmed, start_time=start_time)
+        for team_id, match_id, is_home, confirmed, start_time in project_slots(Match.objects.values(*GRAPH_FIELDS))
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0016_match_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamParticipation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_home', models.BooleanField()),
+                ('confirmed', models.BooleanField()),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participations', to='matches.match')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participations', to='matches.team')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['team', 'start_time'], name='participation_schedule_idx')],
+                'constraints': [models.UniqueConstraint(fields=('team', 'match', 'is_home'), name='unique_team_match_side')],
+            },
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0019_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='map_images',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
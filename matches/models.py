@@ -1,10 +1,24 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.utils.functional import cached_property
 # Create your models here.
 
+class MatchVersionConflict(Exception):
+    """Raised when a Match was changed by someone else since it was loaded"""
+    def __init__(self, current):
+        super().__init__("Match was changed by someone else")
+        # The rows as they are now (a deleted match is simply missing)
+        self.current = current
+
+class MatchAlreadyComplete(Exception):
+    """Raised when scoring is added to a match that has been completed"""
+    def __init__(self):
+        super().__init__("Match is already complete")
+
 class Region(models.Model):
     name = models.CharField(unique=True, max_length=100)
     color = models.CharField(max_length=50)
@@ -23,8 +37,14 @@ class Team(models.Model):
     def all_matches(self):
         """Returns all matches where this team participates"""
         return Match.objects.filter(
-            models.Q(home_team=self) | models.Q(away_team=self)
-        ).distinct().order_by('timeslot__start_time')
+            participations__team=self, participations__confirmed=True
+        ).order_by('timeslot__start_time')
+
+    def schedule(self):
+        """This team's TeamParticipations, confirmed and projected, in time order"""
+        return self.participations.select_related(
+            'match__home_source_match', 'match__away_source_match',
+        ).order_by('start_time', 'match__match_number')
 
     def clean(self):
         if self.emoji:
@@ -34,7 +54,7 @@ class Team(models.Model):
     class Meta:
         ordering = ['region', 'name']
 
-    @property
+    @cached_property
     def display_name(self):
         if self.emoji:
             return self.emoji + ' ' + self.name
@@ -46,6 +66,8 @@ class Team(models.Model):
 class Room(models.Model):
     name = models.CharField(unique=True, max_length=100)
     map = models.ImageField(upload_to='images/', null=True, blank=True)
+    # The resized copies of the map (see matches.images) and the upload they were made from
+    map_images = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['name']
@@ -66,6 +88,10 @@ class Timeslot(models.Model):
         ordering = ['start_time']
 
     def __str__(self):
+        return self.label
+
+    @cached_property
+    def label(self):
         local_time = timezone.localtime(self.start_time)
         # %b = Short month (Mar), %-d = Day (15), %-I:%M%p = Time (2:40PM)
         formatted = local_time.strftime("%b %-d %-I:%M%p")
@@ -90,6 +116,10 @@ class TournamentRound(models.Model):
             )
         ]
     def __str__(self):
+        return self.label
+
+    @cached_property
+    def label(self):
         if self.bracket:
             return str(self.bracket) + ' ' + self.name
         return self.name
@@ -116,6 +146,9 @@ class Match(models.Model):
     home_score = models.IntegerField(blank=True, null=True)
     away_score = models.IntegerField(blank=True, null=True)
 
+    # Bumped on every change so offline scorekeepers can tell their copy is stale
+    version = models.PositiveIntegerField(default=1)
+
     def clean(self):
         # what sorts of things are invalid?
         if self.home_team == self.away_team and self.home_team is not None:
@@ -161,7 +194,7 @@ class Match(models.Model):
     def is_won_by_away_team(self):
         return self.is_won_by(self.away_team)
 
-    @property
+    @cached_property
     def winner_destination(self):
         # First, look for matches where this winner goes to home slot
         home_destination = Match.objects.filter(
@@ -179,7 +212,7 @@ class Match(models.Model):
         if away_destination:
             return away_destination
     
-    @property
+    @cached_property
     def loser_destination(self):
         # First, look for matches where this loser goes to home slot
         home_destination = Match.objects.filter(
@@ -198,6 +231,40 @@ class Match(models.Model):
             return away_destination
         pass
 
+    @staticmethod
+    def attach_destinations(matches):
+        """Fill in winner_destination and loser_destination for many matches with one query"""
+        by_id = {m.pk: m for m in matches}
+        Match._assign_destinations(matches, by_id, Match._destinations_of(by_id))
+
+    @staticmethod
+    async def aattach_destinations(matches):
+        """attach_destinations() for async views"""
+        by_id = {m.pk: m for m in matches}
+        destinations = [dest async for dest in Match._destinations_of(by_id)]
+        Match._assign_destinations(matches, by_id, destinations)
+
+    @staticmethod
+    def _destinations_of(match_ids):
+        return Match.objects.filter(
+            models.Q(home_source_match__in=match_ids) | models.Q(away_source_match__in=match_ids)
+        )
+
+    @staticmethod
+    def _assign_destinations(matches, by_id, destinations):
+        found = {}
+        for dest in destinations:
+            # A home slot wins over an away slot, like the single lookups above
+            for side in ('away', 'home'):
+                source_id = getattr(dest, f'{side}_source_match_id')
+                if source_id in by_id:
+                    key = (source_id, getattr(dest, f'{side}_source_take_winner'))
+                    if side == 'home' or key not in found:
+                        found[key] = dest
+        for match in matches:
+            match.winner_destination = found.get((match.pk, True))
+            match.loser_destination = found.get((match.pk, False))
+
     @property
     def home_team_name(self):
         if self.home_team:
@@ -251,9 +318,220 @@ class Match(models.Model):
         else:
             return None
 
+    def save_versioned(self, update_fields):
+        """Save update_fields only if nobody has changed the row since this instance's version"""
+        values = {name: getattr(self, name) for name in update_fields}
+        updated = Match.objects.filter(pk=self.pk, version=self.version).update(
+            version=models.F('version') + 1, **values
+        )
+        if not updated:
+            raise MatchVersionConflict(list(Match.objects.filter(pk=self.pk)))
+        self.version += 1
+        Change.record(Match, [self.pk])
+
+    def add_question_events(self, events):
+        """Save a batch of QuestionEvents and add their points to the running scores.
+
+        Raises MatchAlreadyComplete, saving nothing, if the match has been
+        completed, even by a save that lands at the same moment.
+        """
+        for event in events:
+            event.match = self
+        home_delta = sum(e.points for e in events if e.is_home)
+        away_delta = sum(e.points for e in events if not e.is_home)
+
+        with transaction.atomic():
+            # The row is checked and updated in one statement, so a completion can't slip in between
+            updated = Match.objects.filter(pk=self.pk, is_complete=False).update(
+                home_score=Coalesce(models.F('home_score'), 0) + home_delta,
+                away_score=Coalesce(models.F('away_score'), 0) + away_delta,
+                version=models.F('version') + 1,
+            )
+            if not updated:
+                raise MatchAlreadyComplete()
+            created = QuestionEvent.objects.bulk_create(events)
+            Change.record(Match, [self.pk])
+        self.refresh_from_db(fields=['home_score', 'away_score', 'version'])
+        return created
+
     class Meta:
         verbose_name_plural = "matches"
         unique_together = ('timeslot', 'room')
+        indexes = [
+            # Upcoming matches, in schedule order and in match number order.
+            # Partial, so they only hold the matches that still need a result.
+            models.Index(fields=['timeslot', 'match_number'], condition=models.Q(is_complete=False), name='match_upcoming_slot_idx'),
+            models.Index(fields=['match_number'], condition=models.Q(is_complete=False), name='match_upcoming_number_idx'),
+            # Where the winner or loser of a match goes next
+            models.Index(fields=['home_source_match', 'home_source_take_winner'], name='match_home_destination_idx'),
+            models.Index(fields=['away_source_match', 'away_source_take_winner'], name='match_away_destination_idx'),
+            # Every match a team plays in, on either side
+            models.Index(fields=['home_team', 'timeslot'], name='match_home_team_idx'),
+            models.Index(fields=['away_team', 'timeslot'], name='match_away_team_idx'),
+        ]
 
     def __str__(self):
         return str(f"{self.match_number}: {self.home_team_name} vs. {self.away_team_name}")
+
+class QuestionEvent(models.Model):
+    """A single scored event (correct answer, error, foul, bonus) in a match"""
+    class Kind(models.IntegerChoices):
+        CORRECT = 1, 'Correct'
+        ERROR = 2, 'Error'
+        FOUL = 3, 'Foul'
+        BONUS = 4, 'Bonus'
+
+    DEFAULT_POINTS = {
+        Kind.CORRECT: 20,
+        Kind.ERROR: -10,
+        Kind.FOUL: -10,
+        Kind.BONUS: 10,
+    }
+    # Most points a single event may add or take away
+    MAX_POINTS = 100
+
+    # Kept to small integers only: a full match is a few dozen of these rows
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='question_events')
+    question = models.PositiveSmallIntegerField()
+    is_home = models.BooleanField()
+    kind = models.PositiveSmallIntegerField(choices=Kind.choices)
+    points = models.SmallIntegerField()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        side = 'home' if self.is_home else 'away'
+        return f"Match {self.match_id} Q{self.question}: {self.get_kind_display()} ({side}, {self.points:+d})"
+
+class ResultSubmission(models.Model):
+    """A result sent by a scorekeeper device, remembered by its idempotency key"""
+    class Status(models.TextChoices):
+        APPLIED = 'applied', 'Applied'
+        CONFLICT = 'conflict', 'Conflict'
+
+    key = models.CharField(unique=True, max_length=64)
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='submissions')
+    base_version = models.PositiveIntegerField()
+    home_score = models.IntegerField()
+    away_score = models.IntegerField()
+    status = models.CharField(max_length=10, choices=Status.choices)
+    # The match version this submission produced, when it was applied
+    version = models.PositiveIntegerField(null=True, blank=True)
+    submitted_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f"{self.key} (match {self.match_id}, {self.status})"
+
+class TeamParticipation(models.Model):
+    """A team's place in a match, either confirmed or still reachable through the bracket.
+
+    Kept up to date by matches.participation whenever the schedule changes or
+    results are propagated, so a team's whole schedule is one index range scan.
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='participations')
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='participations')
+    is_home = models.BooleanField()
+    # False when the team only gets here if earlier results go its way
+    confirmed = models.BooleanField()
+    # Copied from the match's timeslot so the schedule sorts without a join
+    start_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['team', 'match', 'is_home'], name='unique_team_match_side'),
+        ]
+        indexes = [
+            models.Index(fields=['team', 'start_time'], name='participation_schedule_idx'),
+        ]
+
+    def __str__(self):
+        state = 'confirmed' if self.confirmed else 'projected'
+        return f"{self.team} in match {self.match_id} ({state})"
+
+class Change(models.Model):
+    """One row for each save or delete of tournament data, in the order they happened.
+
+    The id of the latest row is the tournament's change stamp. Anything built
+    from the data (caches, exports, open pages) can compare stamps to see that
+    it is stale, and read the rows after its own stamp to see what changed.
+    Saves are recorded by signals; bulk writes and conditional updates, which
+    send no signals, call record() themselves.
+    """
+    model_name = models.CharField(max_length=40)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        action = 'deleted' if self.deleted else 'saved'
+        return f"{self.model_name} {self.object_id} {action}"
+
+    @classmethod
+    def record(cls, model, ids, deleted=False):
+        """Note that the given rows of model were saved (or deleted)"""
+        cls.objects.bulk_create([
+            cls(model_name=model._meta.model_name, object_id=pk, deleted=deleted) for pk in ids
+        ], batch_size=500)
+
+    @classmethod
+    def latest(cls):
+        """The current change stamp, 0 before anything has changed"""
+        return cls.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    @classmethod
+    async def alatest(cls):
+        return await cls.objects.order_by('-pk').values_list('pk', flat=True).afirst() or 0
+
+# Models whose saves and deletes are recorded as Changes
+CHANGE_TRACKED_MODELS = [Region, Team, Room, Timeslot, TournamentBracket, TournamentRound, Match]
+
+class Job(models.Model):
+    """A piece of slow work for the run_jobs worker, queued with matches.jobs.enqueue()"""
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    kind = models.CharField(max_length=40)
+    arguments = models.JSONField(default=dict, blank=True)
+    # Only one pending job per key: queueing another replaces its arguments
+    dedup_key = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # Percent done, with a word on what the job is doing
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status='pending') & ~models.Q(dedup_key=''),
+                name='unique_pending_job',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['run_after'], condition=models.Q(status='pending'), name='job_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+    def set_progress(self, done, total, message=''):
+        """Record how far the job has got, for the admin pages"""
+        self.progress = min(100, int(100 * done / total)) if total else 100
+        self.message = message[:200]
+        Job.objects.filter(pk=self.pk).update(progress=self.progress, message=self.message)
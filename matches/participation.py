@@ -0,0 +1,98 @@
+"""Keeps the TeamParticipation table in step with the schedule and the bracket"""
+from django.db import transaction
+from django.db.models import Q
+from .models import Match, TeamParticipation
+
+# Everything needed to work out who can reach each match
+GRAPH_FIELDS = (
+    'id', 'match_number', 'is_complete', 'home_team_id', 'away_team_id',
+    'home_source_match_id', 'away_source_match_id', 'timeslot__start_time',
+)
+
+
+def project_slots(matches, upstream=None):
+    """Work out which teams are in, or can still reach, each slot of the given matches.
+
+    matches are dicts with the GRAPH_FIELDS keys. upstream maps the ids of
+    source matches outside that list to (is_complete, match_number, team ids
+    that can be in it). Returns (team_id, match_id, is_home, confirmed,
+    start_time) tuples. Migration 0017 keeps its own copy of this.
+    """
+    known = dict(upstream or {})
+    rows = []
+    # Sources always have lower match numbers, so one pass in that order sees them first
+    for match in sorted(matches, key=lambda m: m['match_number']):
+        candidates = set()
+        for is_home, side in ((True, 'home'), (False, 'away')):
+            team_id = match[f'{side}_team_id']
+            if team_id:
+                rows.append((team_id, match['id'], is_home, True, match['timeslot__start_time']))
+                candidates.add(team_id)
+                continue
+            source = known.get(match[f'{side}_source_match_id'])
+            # A finished source has already sent its team here (or had none to send)
+            if source and not source[0] and source[1] < match['match_number']:
+                for team_id in source[2]:
+                    rows.append((team_id, match['id'], is_home, False, match['timeslot__start_time']))
+                candidates |= source[2]
+        known[match['id']] = (match['is_complete'], match['match_number'], candidates)
+    return rows
+
+
+def _downstream(match_ids):
+    """The given matches plus every match fed by them, one query per bracket level"""
+    found = {row['id']: row for row in Match.objects.filter(pk__in=match_ids).values(*GRAPH_FIELDS)}
+    frontier = set(found)
+    while frontier:
+        level = Match.objects.filter(
+            Q(home_source_match__in=frontier) | Q(away_source_match__in=frontier)
+        ).values(*GRAPH_FIELDS)
+        frontier = set()
+        for row in level:
+            if row['id'] not in found:
+                found[row['id']] = row
+                frontier.add(row['id'])
+    return list(found.values())
+
+
+def _upstream(matches):
+    """What project_slots needs to know about sources feeding into matches from outside"""
+    inside = {m['id'] for m in matches}
+    sources = {
+        m[f'{side}_source_match_id'] for m in matches for side in ('home', 'away')
+    } - inside - {None}
+    upstream = {
+        row['id']: (row['is_complete'], row['match_number'], set())
+        for row in Match.objects.filter(pk__in=sources).values('id', 'is_complete', 'match_number')
+    }
+    for match_id, team_id in TeamParticipation.objects.filter(match__in=sources).values_list('match_id', 'team_id'):
+        upstream[match_id][2].add(team_id)
+    return upstream
+
+
+def refresh_participation(match_ids=None):
+    """Rebuild the TeamParticipation rows of the given matches and everything downstream of them.
+
+    With no match ids, rebuilds the whole table.
+    """
+    if match_ids is None:
+        matches = list(Match.objects.values(*GRAPH_FIELDS))
+        upstream = {}
+        stale = TeamParticipation.objects.all()
+    else:
+        matches = _downstream(match_ids)
+        upstream = _upstream(matches)
+        stale = TeamParticipation.objects.filter(match__in=[m['id'] for m in matches])
+
+    rows = project_slots(matches, upstream)
+    with transaction.atomic():
+        stale.delete()
+        TeamParticipation.objects.bulk_create([
+            TeamParticipation(team_id=team_id, match_id=match_id, is_home=is_home, confirmed=confirmed, start_time=start_time)
+            for team_id, match_id, is_home, confirmed, start_time in rows
+        ], batch_size=500)
+
+
+def retime_participation(timeslot):
+    """Copy a timeslot's new start time onto the participation rows of its matches"""
+    TeamParticipation.objects.filter(match__timeslot=timeslot).update(start_time=timeslot.start_time)
@@ -0,0 +1,86 @@
+"""Planning timeslots over several days, around breaks.
+
+A plan is a list of days, each a window (say 8:00 to 17:00) cut into slots
+of a fixed length, plus blocked intervals (lunch, devotions) that no slot
+may overlap; the next slot after a break starts as the break ends. The
+whole plan is written at once: one insert for the timeslots, skipping any
+that exist, and optionally one for an empty match per room in each slot
+for the schedulers to fill in.
+"""
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Change, Match, Timeslot
+
+
+def day_starts(day, start, end, interval, breaks):
+    """Naive start times on day of interval-minute slots that fit between start and end and miss the breaks.
+
+    breaks are (start, end) times of day.
+    """
+    current = datetime.combine(day, start)
+    stop = datetime.combine(day, end)
+    length = timedelta(minutes=interval)
+    breaks = sorted((datetime.combine(day, a), datetime.combine(day, b)) for a, b in breaks)
+    starts = []
+    while current + length <= stop:
+        clash = next((b for a, b in breaks if current < b and current + length > a), None)
+        if clash is not None:
+            current = clash
+            continue
+        starts.append(current)
+        current += length
+    return starts
+
+
+def plan(days, blocked):
+    """The sorted, aware start times of a plan.
+
+    days are (date, start, end, interval) windows, and may repeat a date to
+    give it several windows. blocked are (date, start, end) intervals, with
+    a date of None for a break taken every day.
+    """
+    starts = set()
+    for day, start, end, interval in days:
+        breaks = [(a, b) for on, a, b in blocked if on is None or on == day]
+        starts.update(timezone.make_aware(s) for s in day_starts(day, start, end, interval, breaks))
+    return sorted(starts)
+
+
+def preview(starts):
+    """(day, [(start, already exists)]) for each day of a plan, in local time"""
+    existing = set(Timeslot.objects.filter(start_time__in=starts).values_list('start_time', flat=True))
+    rows = [(timezone.localtime(start), start in existing) for start in starts]
+    return [(day, list(slots)) for day, slots in groupby(rows, key=lambda row: row[0].date())]
+
+
+def create(starts, rooms=()):
+    """Insert the timeslots of a plan that don't exist yet, and an empty match per room in any slot without one.
+
+    Returns (ids of the new timeslots, new matches). New matches are
+    numbered after the highest match number, in time and then room order.
+    """
+    with transaction.atomic():
+        # Ids only grow, and the transaction keeps other writers out, so new rows are those past the last id
+        last = Timeslot.objects.aggregate(last=Max('pk'))['last'] or 0
+        Timeslot.objects.bulk_create([Timeslot(start_time=start) for start in starts], ignore_conflicts=True, batch_size=500)
+        slots = dict(Timeslot.objects.filter(start_time__in=starts).values_list('pk', 'start_time'))
+        new_slots = sorted(pk for pk in slots if pk > last)
+        Change.record(Timeslot, new_slots)
+
+        matches = []
+        if rooms:
+            taken = set(Match.objects.filter(timeslot__in=slots, room__in=rooms).values_list('timeslot_id', 'room_id'))
+            number = Match.objects.aggregate(last=Max('match_number'))['last'] or 0
+            for slot in sorted(slots, key=slots.get):
+                for room in rooms:
+                    if (slot, room.pk) not in taken:
+                        number += 1
+                        matches.append(Match(match_number=number, timeslot_id=slot, room=room))
+            matches = Match.objects.bulk_create(matches, batch_size=500)
+            Change.record(Match, [match.pk for match in matches])
+    return new_slots, matches
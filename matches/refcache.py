@@ -0,0 +1,137 @@
+"""Process-local copies of the small reference tables that every match card reads.
+
+Regions, teams, rooms, timeslots, rounds and brackets barely change once an
+event is running, but list pages used to join and format them for every row.
+Each table is loaded whole with one query the first time it is needed, and
+its display strings are computed once per row. A save or delete in this
+process drops the table straight away (see matches.signals); saves made by
+other processes are noticed through the change stamp.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+
+from .models import Change, Region, Team, Room, Timeslot, TournamentBracket, TournamentRound
+
+REFERENCE_MODELS = [Region, Team, Room, Timeslot, TournamentBracket, TournamentRound]
+
+# Tables a match's foreign keys point into
+ATTACHED_MODELS = [Timeslot, Room, TournamentRound, Team]
+
+# Tables whose rows point into another table, and so must be reloaded with it
+DEPENDENTS = {
+    'region': ['team'],
+    'tournamentbracket': ['tournamentround'],
+}
+
+_tables = {}
+_checked = None
+_lock = threading.RLock()
+
+
+def invalidate(model_name):
+    """Forget a table (and the tables built on it); the next reader reloads it"""
+    with _lock:
+        _tables.pop(model_name, None)
+        for dependent in DEPENDENTS.get(model_name, []):
+            invalidate(dependent)
+
+
+def clear():
+    global _checked
+    with _lock:
+        _tables.clear()
+        _checked = None
+
+
+def _catch_up():
+    """Drop any table another process has changed since we last looked"""
+    global _checked
+    stamp = Change.latest()
+    if _checked is None or stamp < _checked:
+        # First use, or a different database (tests, scratch databases)
+        _tables.clear()
+    elif stamp > _checked and _tables:
+        changed = Change.objects.filter(
+            pk__gt=_checked, model_name__in=[m._meta.model_name for m in REFERENCE_MODELS]
+        ).values_list('model_name', flat=True).distinct()
+        for model_name in changed:
+            invalidate(model_name)
+    _checked = stamp
+
+
+def _load(model):
+    rows = model.objects.in_bulk()
+    if model is Team:
+        regions = table(Region, check=False)
+        for team in rows.values():
+            Team.region.field.set_cached_value(team, regions.get(team.region_id))
+    elif model is TournamentRound:
+        brackets = table(TournamentBracket, check=False)
+        for tournament_round in rows.values():
+            TournamentRound.bracket.field.set_cached_value(tournament_round, brackets.get(tournament_round.bracket_id))
+    for row in rows.values():
+        # Computed now so the formatting happens once per process, not per card
+        str(row)
+        if model is Team:
+            row.display_name
+    return rows
+
+
+def table(model, check=True):
+    """Every row of a reference model, by id"""
+    name = model._meta.model_name
+    with _lock:
+        if check:
+            _catch_up()
+        rows = _tables.get(name)
+        if rows is None:
+            rows = _tables[name] = _load(model)
+        return rows
+
+
+async def atable(model):
+    """table() for async views; only reloading a table leaves the event loop"""
+    rows = await _current([model])
+    if rows is None:
+        return await sync_to_async(table)(model)
+    return rows[0]
+
+
+def attach(matches):
+    """Fill in the reference rows of each match from memory instead of joins"""
+    with _lock:
+        _catch_up()
+        tables = [table(model, check=False) for model in ATTACHED_MODELS]
+    return _fill(matches, *tables)
+
+
+async def aattach(matches):
+    """attach() for async views"""
+    tables = await _current(ATTACHED_MODELS)
+    if tables is None:
+        return await sync_to_async(attach)(matches)
+    return _fill(matches, *tables)
+
+
+async def _current(models):
+    """The loaded tables of models if they are up to date with the change stamp, else None"""
+    stamp = await Change.alatest()
+    with _lock:
+        if stamp != _checked:
+            return None
+        rows = [_tables.get(model._meta.model_name) for model in models]
+    return None if any(r is None for r in rows) else rows
+
+
+def _fill(matches, timeslots, rooms, rounds, teams):
+    for match in matches:
+        for field, rows, value in (
+            (match._meta.get_field('timeslot'), timeslots, match.timeslot_id),
+            (match._meta.get_field('room'), rooms, match.room_id),
+            (match._meta.get_field('tournament_round'), rounds, match.tournament_round_id),
+            (match._meta.get_field('home_team'), teams, match.home_team_id),
+            (match._meta.get_field('away_team'), teams, match.away_team_id),
+        ):
+            field.set_cached_value(match, rows.get(value) if value is not None else None)
+    return matches
@@ -0,0 +1,334 @@
+"""Seeding teams into the first round of a bracket, keeping regions apart.
+
+The bracket's shape is read from its matches with one query: the open team
+slots (sides with no source match) in bracket order, and for each slot the
+chain of matches its winner plays through. Seeds go into the slots in the
+standard order (1 v 16, 8 v 9, ... for 16 slots), so the top seeds can only
+meet late. Seeds past the number of teams are byes: the team drawn against
+one goes straight into the match its first-round winner would play, and its
+first-round match is left without teams.
+
+Teams of the same region are then pushed apart by swapping teams between
+seeds of the same band (3-4, 5-8, 9-16, ...), which the standard order
+treats alike, so no team is seeded much above or below its rating. A pair
+that would meet in a round costs more the earlier that round is; a swap is
+kept when it lowers the total. Each team's cost is read from counts of its
+region's teams under every match, so trying a swap costs a walk down two
+slot chains rather than a pass over every pair, and 512 teams settle in well
+under a second. The result is written with one bulk_update.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from . import refcache
+from .models import Change, Match, TournamentRound
+from .participation import refresh_participation
+
+# Passes over the bands before the optimizer settles for what it has
+MAX_PASSES = 8
+
+SIDES = ('home', 'away')
+
+
+class SeedingError(ValueError):
+    pass
+
+
+def seed_order(size):
+    """The seed in each slot of a bracket of size slots (a power of two), in bracket order"""
+    order = [1]
+    while len(order) < size:
+        total = 2 * len(order) + 1
+        order = [seed for top in order for seed in (top, total - top)]
+    return order
+
+
+def bands(size):
+    """Seed numbers that the standard order treats alike: [1], [2], [3, 4], [5..8], ..."""
+    found = [[seed] for seed in (1, 2) if seed <= size]
+    start = 2
+    while start < size:
+        found.append(list(range(start + 1, min(2 * start, size) + 1)))
+        start *= 2
+    return found
+
+
+class Shape:
+    """The open team slots of a bracket, in bracket order, and the matches each one leads through"""
+
+    def __init__(self, bracket):
+        rows = {row['id']: row for row in Match.objects.filter(tournament_round__bracket=bracket).values(
+            'id', 'match_number', 'tournament_round_id',
+            'home_source_match_id', 'home_source_take_winner', 'away_source_match_id', 'away_source_take_winner',
+        )}
+        self.matches = rows
+        # Where the winner of each match goes next, within the bracket
+        parent = {}
+        for row in sorted(rows.values(), key=lambda row: row['match_number']):
+            for side in SIDES:
+                source = rows.get(row[f'{side}_source_match_id'])
+                if source and row[f'{side}_source_take_winner'] and source['match_number'] < row['match_number']:
+                    parent.setdefault(source['id'], row['id'])
+
+        self.slots = []
+        roots = sorted((pk for pk in rows if pk not in parent), key=lambda pk: rows[pk]['match_number'])
+        for root in roots:
+            self._collect(root, parent)
+        if not self.slots:
+            raise SeedingError(f"{bracket} has no open team slots to seed")
+        size = len(self.slots)
+        if size & (size - 1):
+            raise SeedingError(f"{bracket} has {size} open team slots; seeding needs a power of two")
+
+        # Rounds from the bottom: 1 for a match fed by no match of the bracket
+        self.parent = parent
+        self.height = {}
+        for row in sorted(rows.values(), key=lambda row: row['match_number']):
+            self.height.setdefault(row['id'], 1)
+            up = parent.get(row['id'])
+            if up is not None:
+                self.height[up] = max(self.height.get(up, 1), self.height[row['id']] + 1)
+        self.rounds = max(self.height[self._top(match)] for match, _ in self.slots)
+        self.paths = [self._path(match) for match, _ in self.slots]
+        if len({len(path) for path in self.paths}) != 1:
+            raise SeedingError(f"The first round of {bracket} is uneven; seeding needs every slot to be the same number of wins from the final")
+        self.ancestors = [{match for match, _ in path} for path in self.paths]
+
+    def _collect(self, pk, parent):
+        """Add the open slots that feed match pk, home side first"""
+        row = self.matches[pk]
+        for side in SIDES:
+            source = row[f'{side}_source_match_id']
+            if source is None:
+                self.slots.append((pk, side))
+            elif parent.get(source) == pk:
+                self._collect(source, parent)
+
+    def destination(self, pk):
+        """(match id, side) that the winner of match pk goes into"""
+        parent = self.matches[self.parent[pk]]
+        side = 'home' if parent['home_source_match_id'] == pk and parent['home_source_take_winner'] else 'away'
+        return parent['id'], side
+
+    def _top(self, pk):
+        while pk in self.parent:
+            pk = self.parent[pk]
+        return pk
+
+    def _path(self, pk):
+        """(match, weight) from a slot's own match to the last match its winner can reach.
+
+        Two teams meeting in the first round cost 2 ** (rounds - 1), in the
+        final 1, so one early meeting outweighs any number of later ones.
+        """
+        path = []
+        while pk is not None:
+            path.append((pk, 2 ** max(self.rounds - self.height[pk], 0)))
+            pk = self.parent.get(pk)
+        return path
+
+
+class Seeding:
+    """Teams by seed, placed in the slots of a Shape"""
+
+    def __init__(self, shape, teams):
+        if len(teams) > len(shape.slots):
+            raise SeedingError(f"{len(teams)} teams do not fit in {len(shape.slots)} slots")
+        if 2 * len(teams) <= len(shape.slots):
+            # Otherwise some first-round matches would have no team at all, and byes would run on into round two
+            raise SeedingError(f"{len(teams)} teams need a bracket with fewer than {2 * len(teams)} slots")
+        self.shape = shape
+        # Seed number -> team, and bracket position of each seed
+        self.teams = {seed: team for seed, team in enumerate(teams, 1)}
+        self.position = {seed: i for i, seed in enumerate(seed_order(len(shape.slots)))}
+        self.regions = {seed: team.region_id for seed, team in self.teams.items()}
+        self.counts = {}
+        for seed, region in self.regions.items():
+            self._count(region, self.position[seed], 1)
+        # Cost of each seed where it is, dropped for a whole region when one of its teams moves
+        self.costs = {}
+
+    def _count(self, region, position, step):
+        counts = self.counts.setdefault(region, Counter())
+        for match, _ in self.shape.paths[position]:
+            counts[match] += step
+
+    def cost(self, region, position, moved_from):
+        """What a team of region pays at position, once moved there from moved_from.
+
+        The region's count under each match, less the team at its old place,
+        plus the team at its new one, is how many teammates it has met by
+        then; each new one costs that match's weight.
+        """
+        counts = self.counts[region]
+        left = self.shape.ancestors[moved_from]
+        total = 0
+        below = 1
+        for match, weight in self.shape.paths[position]:
+            here = counts[match] - (match in left) + 1
+            total += weight * (here - below)
+            below = here
+        return total
+
+    def separate_regions(self):
+        """Swap teams within bands while it lowers the cost; returns the number of swaps"""
+        swaps = 0
+        groups = [[seed for seed in band if seed in self.teams] for band in bands(len(self.shape.slots))]
+        for _ in range(MAX_PASSES):
+            improved = False
+            for band in groups:
+                for i, a in enumerate(band):
+                    for b in band[i + 1:]:
+                        if self._try_swap(a, b):
+                            swaps += 1
+                            improved = True
+            if not improved:
+                break
+        return swaps
+
+    def _current(self, seed):
+        if seed not in self.costs:
+            position = self.position[seed]
+            self.costs[seed] = self.cost(self.regions[seed], position, position)
+        return self.costs[seed]
+
+    def _try_swap(self, a, b):
+        region_a, region_b = self.regions[a], self.regions[b]
+        if region_a == region_b:
+            return False
+        at_a, at_b = self.position[a], self.position[b]
+        before_a = self._current(a)
+        before_b = self._current(b)
+        # The regions differ, so each team's cost only depends on its own move
+        if self.cost(region_a, at_b, at_a) + self.cost(region_b, at_a, at_b) >= before_a + before_b:
+            return False
+        self._count(region_a, at_a, -1)
+        self._count(region_a, at_b, 1)
+        self._count(region_b, at_b, -1)
+        self._count(region_b, at_a, 1)
+        self.teams[a], self.teams[b] = self.teams[b], self.teams[a]
+        self.regions[a], self.regions[b] = region_b, region_a
+        self.costs = {seed: cost for seed, cost in self.costs.items() if self.regions[seed] not in (region_a, region_b)}
+        return True
+
+    def meetings(self):
+        """Same-region pairs that could meet in each round, as {height: pairs}, 1 being the first round.
+
+        A pair counts in the round of the one match both teams can reach,
+        whoever else wins on the way there.
+        """
+        regions = {slot: team.region_id for slot, (_, team) in self.slot_teams().items()}
+        found = Counter()
+        for region, counts in self.counts.items():
+            for match, count in counts.items():
+                if count < 2:
+                    continue
+                home, away = (self._under(region, regions, match, side) for side in SIDES)
+                found[self.shape.height[match]] += home * away
+        return found
+
+    def _under(self, region, regions, match, side):
+        """How many teams of region can come into a side of match"""
+        source = self.shape.matches[match][f'{side}_source_match_id']
+        if source is None:
+            return int(regions.get((match, side)) == region)
+        return self.counts[region][source] if self.shape.parent.get(source) == match else 0
+
+    def slot_teams(self):
+        """(match id, side) -> (seed, team) for every filled slot"""
+        return {self.shape.slots[self.position[seed]]: (seed, team) for seed, team in self.teams.items()}
+
+    def byes(self):
+        """First-round match id -> (seed, team) of the team it sends straight on, for each match with a bye"""
+        filled = self.slot_teams()
+        found = {}
+        for match in dict.fromkeys(match for match, _ in self.shape.slots):
+            teams = [filled[match, side] for side in SIDES if (match, side) in filled]
+            if len(teams) == 1:
+                found[match] = teams[0]
+        return found
+
+    def pairings(self):
+        """(match, home, away, next match) for each first-round match in bracket order.
+
+        home and away are (seed, team) or None for a bye; next match is the
+        one a team with a bye goes straight into.
+        """
+        filled = self.slot_teams()
+        rows = []
+        for match in dict.fromkeys(match for match, _ in self.shape.slots):
+            home, away = filled.get((match, 'home')), filled.get((match, 'away'))
+            bye = None
+            if (home is None) != (away is None):
+                bye = self.shape.matches[self.shape.destination(match)[0]]
+            rows.append((self.shape.matches[match], home, away, bye))
+        return rows
+
+
+def seed(bracket, teams, separate=True):
+    """Place teams (best first) into bracket, pushing regions apart if separate; nothing is saved.
+
+    Returns (seeding, same-region meetings by round before, and after).
+    """
+    shape = Shape(bracket)
+    seeding = Seeding(shape, list(teams))
+    before = seeding.meetings()
+    if separate:
+        seeding.separate_regions()
+    return seeding, before, seeding.meetings()
+
+
+def round_names(shape):
+    """A name for each height of the bracket, from the round most of its matches are in"""
+    rounds = refcache.table(TournamentRound)
+    found = {}
+    for match, height in shape.height.items():
+        found.setdefault(height, Counter())[shape.matches[match]['tournament_round_id']] += 1
+    names = {}
+    for height, counts in found.items():
+        round_id = counts.most_common(1)[0][0]
+        names[height] = rounds[round_id].name if round_id in rounds else f'Round {height}'
+    return names
+
+
+def apply(seeding):
+    """Write a seeding's teams into its bracket with one bulk update; returns the changed matches.
+
+    Fills the first-round slots, and the second-round slots that byes send
+    teams into; a first-round match with a bye is left without teams, and
+    second-round slots fed by a real match are cleared. Refuses once a
+    seeded match has been played, as its result would no longer match its
+    teams.
+    """
+    shape = seeding.shape
+    first_round = list(dict.fromkeys(match for match, _ in shape.slots))
+    byes = seeding.byes()
+    filled = {slot: team for slot, team in seeding.slot_teams().items() if slot[0] not in byes}
+    for match in first_round:
+        if match in shape.parent:
+            filled[shape.destination(match)] = byes.get(match)
+    with transaction.atomic():
+        ids = list(dict.fromkeys(first_round + [match for match, _ in filled]))
+        matches = Match.objects.select_for_update().in_bulk(ids)
+        changed = []
+        for pk in ids:
+            match = matches[pk]
+            if match.is_complete:
+                raise SeedingError(f"Match {match.match_number} has already been played")
+            updated = False
+            for side in SIDES:
+                if (pk, side) not in shape.slots and (pk, side) not in filled:
+                    continue
+                team = filled.get((pk, side))
+                team_id = team[1].pk if team else None
+                if getattr(match, f'{side}_team_id') != team_id:
+                    setattr(match, f'{side}_team_id', team_id)
+                    updated = True
+            if updated:
+                match.version += 1
+                changed.append(match)
+        Match.objects.bulk_update(changed, ['home_team', 'away_team', 'version'], batch_size=500)
+        Change.record(Match, [match.pk for match in changed])
+        refresh_participation([match.pk for match in changed])
+    return changed
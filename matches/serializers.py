@@ -0,0 +1,79 @@
+"""Flat JSON-ready dicts of tournament rows, shared by the static export and the API"""
+from . import images, refcache
+from .models import Match
+
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+
+def match_data(match):
+    """A match with its reference rows flattened in; attach them with refcache first"""
+    return {
+        'id': match.pk,
+        'match_number': match.match_number,
+        'round_id': match.tournament_round_id,
+        'round': match.tournament_round.name if match.tournament_round else None,
+        'bracket_id': match.tournament_round.bracket_id if match.tournament_round else None,
+        'timeslot_id': match.timeslot_id,
+        'start_time': isoformat(match.start_time),
+        'room_id': match.room_id,
+        'room': match.room.name if match.room else None,
+        'home_team_id': match.home_team_id,
+        'home_team': match.home_team.name if match.home_team else None,
+        'home_source_match_id': match.home_source_match_id,
+        'home_source_take_winner': match.home_source_take_winner,
+        'away_team_id': match.away_team_id,
+        'away_team': match.away_team.name if match.away_team else None,
+        'away_source_match_id': match.away_source_match_id,
+        'away_source_take_winner': match.away_source_take_winner,
+        'home_score': match.home_score,
+        'away_score': match.away_score,
+        'is_complete': match.is_complete,
+        'version': match.version,
+    }
+
+
+def team_data(team):
+    return {
+        'id': team.pk,
+        'name': team.name,
+        'emoji': team.emoji,
+        'region_id': team.region_id,
+        'region': team.region.name,
+        'color': team.region.color,
+    }
+
+
+def region_data(region):
+    return {'id': region.pk, 'name': region.name, 'color': region.color}
+
+
+def room_data(room):
+    return {'id': room.pk, 'name': room.name, 'map': images.largest_url(room)}
+
+
+def timeslot_data(timeslot):
+    return {'id': timeslot.pk, 'start_time': isoformat(timeslot.start_time), 'label': timeslot.label}
+
+
+def bracket_data(bracket, rounds):
+    return {
+        'id': bracket.pk,
+        'name': bracket.name,
+        'priority': bracket.priority,
+        'rounds': [{'id': r.pk, 'name': r.name} for r in rounds if r.bracket_id == bracket.pk],
+    }
+
+
+def load_matches(queryset):
+    """Evaluate a Match queryset with its reference rows attached from memory"""
+    return refcache.attach(list(queryset.order_by('match_number')))
+
+
+async def aload_matches(queryset):
+    return await refcache.aattach([m async for m in queryset.order_by('match_number')])
+
+
+def all_matches():
+    return [match_data(m) for m in load_matches(Match.objects.all())]
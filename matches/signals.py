@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import images, jobs, refcache
+from .models import Change, CHANGE_TRACKED_MODELS, Room
+
+
+def record_save(sender, instance, **kwargs):
+    Change.record(sender, [instance.pk])
+    if sender in refcache.REFERENCE_MODELS:
+        refcache.invalidate(sender._meta.model_name)
+
+
+def record_delete(sender, instance, **kwargs):
+    Change.record(sender, [instance.pk], deleted=True)
+    if sender in refcache.REFERENCE_MODELS:
+        refcache.invalidate(sender._meta.model_name)
+
+
+def queue_map_processing(sender, instance, **kwargs):
+    """Resize a room's map in the background whenever a different one is uploaded"""
+    if images.is_stale(instance):
+        transaction.on_commit(lambda: jobs.enqueue(
+            'process_room_map', dedup_key=f'room-map-{instance.pk}', room_id=instance.pk,
+        ))
+
+
+for model in CHANGE_TRACKED_MODELS:
+    post_save.connect(record_save, sender=model, dispatch_uid=f'change-save-{model._meta.model_name}')
+    post_delete.connect(record_delete, sender=model, dispatch_uid=f'change-delete-{model._meta.model_name}')
+post_save.connect(queue_map_processing, sender=Room, dispatch_uid='room-map-processing')
@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models import F
+from .bracket import propagate_results
+from .models import Change, Match, ResultSubmission
+
+
+def apply_submissions(submissions, user=None):
+    """Apply a batch of queued results from a scorekeeper device in one transaction.
+
+    Each submission is a dict with key, match, version, home_score and
+    away_score. A key that was already seen is reported as a duplicate and
+    not applied again, and a submission based on an older version of its
+    match is rejected as a conflict. Returns one report per submission.
+    """
+    keys = [item['key'] for item in submissions]
+    match_ids = {item['match'] for item in submissions}
+
+    with transaction.atomic():
+        seen = {r.key: r for r in ResultSubmission.objects.filter(key__in=keys)}
+        existing = set(Match.objects.filter(pk__in=match_ids).values_list('pk', flat=True))
+        statuses = []
+        recorded = []
+        applied = []
+
+        for item in submissions:
+            if item['key'] in seen:
+                statuses.append('duplicate')
+                continue
+            if item['match'] not in existing:
+                statuses.append('missing')
+                continue
+
+            # Only succeeds if nobody has changed the match since the device loaded it
+            updated = Match.objects.filter(pk=item['match'], version=item['version']).update(
+                home_score=item['home_score'],
+                away_score=item['away_score'],
+                is_complete=True,
+                version=F('version') + 1,
+            )
+            record = ResultSubmission(
+                key=item['key'],
+                match_id=item['match'],
+                base_version=item['version'],
+                home_score=item['home_score'],
+                away_score=item['away_score'],
+                status=ResultSubmission.Status.APPLIED if updated else ResultSubmission.Status.CONFLICT,
+                version=item['version'] + 1 if updated else None,
+                submitted_by=user,
+            )
+            seen[record.key] = record
+            recorded.append(record)
+            statuses.append(record.status)
+            if updated:
+                applied.append(item['match'])
+
+        ResultSubmission.objects.bulk_create(recorded)
+        Change.record(Match, applied)
+        if applied:
+            propagate_results(Match.objects.filter(pk__in=applied))
+        current = Match.objects.in_bulk(match_ids)
+
+    reports = []
+    for item, status in zip(submissions, statuses):
+        report = {'key': item['key'], 'match': item['match'], 'status': status}
+        match = current.get(item['match'])
+        if match:
+            report['version'] = match.version
+        if status == 'duplicate':
+            report['original_status'] = seen[item['key']].status
+        if status == ResultSubmission.Status.CONFLICT:
+            report['current'] = {
+                'home_score': match.home_score,
+                'away_score': match.away_score,
+                'is_complete': match.is_complete,
+            }
+        reports.append(report)
+    return reports
@@ -0,0 +1,121 @@
+// Queues result submissions while the venue network is down and replays them
+// once it comes back. Every submission carries its own idempotency key, so
+// replaying one the server already applied does no harm.
+const SYNC_URL = "{% url 'scorekeeper_sync' %}";
+const OUTBOX_DB = 'scorekeeper-outbox';
+const OUTBOX_STORE = 'submissions';
+
+function openOutbox() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(OUTBOX_DB, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore(OUTBOX_STORE, { autoIncrement: true });
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function outboxRequest(mode, action) {
+    return openOutbox().then(db => new Promise((resolve, reject) => {
+        const request = action(db.transaction(OUTBOX_STORE, mode).objectStore(OUTBOX_STORE));
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    }));
+}
+
+const enqueue = entry => outboxRequest('readwrite', store => store.add(entry));
+const dequeue = id => outboxRequest('readwrite', store => store.delete(id));
+const queuedIds = () => outboxRequest('readonly', store => store.getAllKeys());
+const queuedEntry = id => outboxRequest('readonly', store => store.get(id));
+
+async function notifyPages(message) {
+    const pages = await self.clients.matchAll({ type: 'window' });
+    pages.forEach(page => page.postMessage(message));
+}
+
+// The CSRF token rotates when the scorekeeper logs in again, so a page asking
+// for a flush sends its current one; it replaces the token each entry was
+// queued with. A background sync uses the last token a page sent, if any.
+let currentCsrfToken = null;
+
+async function flush() {
+    // Oldest first, so the server sees results in the order they were entered
+    for (const id of await queuedIds()) {
+        const entry = await queuedEntry(id);
+        const headers = currentCsrfToken ? { ...entry.headers, 'X-CSRFToken': currentCsrfToken } : entry.headers;
+        let response;
+        try {
+            response = await fetch(SYNC_URL, {
+                method: 'POST',
+                headers: headers,
+                body: entry.body,
+                credentials: 'same-origin',
+            });
+        } catch (err) {
+            return; // Still offline; the next sync or 'online' event retries
+        }
+        if (response.status >= 500) {
+            return; // The batch was rolled back, so keep it for the next attempt
+        }
+        // An expired session is redirected to the login page, which fetch follows to
+        // a 200 HTML page; a stale CSRF token is a 403. Neither applied anything.
+        const data = response.redirected ? null : await response.json().catch(() => null);
+        if (response.status === 401 || response.status === 403 || data === null) {
+            await notifyPages({ type: 'login-needed' });
+            return; // Keep everything until the scorekeeper logs in again
+        }
+        // Only a batch the server applied, or one it rejected as invalid, is done with
+        const applied = response.ok && Array.isArray(data.results);
+        const rejected = response.status === 400 && (data.errors || data.error);
+        if (!applied && !rejected) {
+            return;
+        }
+        await dequeue(id);
+        await notifyPages({ type: 'synced', status: response.status, data: data });
+    }
+}
+
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', event => event.waitUntil(self.clients.claim()));
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'POST' || new URL(request.url).pathname !== SYNC_URL) {
+        return;
+    }
+    event.respondWith((async () => {
+        const body = await request.clone().text();
+        try {
+            return await fetch(request);
+        } catch (err) {
+            await enqueue({
+                body: body,
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': request.headers.get('X-CSRFToken'),
+                },
+            });
+            if (self.registration.sync) {
+                await self.registration.sync.register('flush-results').catch(() => {});
+            }
+            return new Response(JSON.stringify({ queued: true }), {
+                status: 202,
+                headers: { 'Content-Type': 'application/json' },
+            });
+        }
+    })());
+});
+
+self.addEventListener('sync', event => {
+    if (event.tag === 'flush-results') {
+        event.waitUntil(flush());
+    }
+});
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'flush') {
+        if (event.data.csrfToken) {
+            currentCsrfToken = event.data.csrfToken;
+        }
+        event.waitUntil(flush());
+    }
+});
@@ -1,3 +1,129 @@
 from django.test import TestCase
 
-# Create your tests here.
+from . import metrics, seeding, whatif
+from .models import Match, Region, Team, TournamentBracket, TournamentRound
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='East', color='red')
+        cls.team = Team.objects.create(name='Alpha', region=region)
+
+    def queries_recorded(self, view):
+        counts, total = metrics.QUERY_COUNT.series.get(view, ([0], 0))
+        return counts[-1], total
+
+    def test_sync_view_queries_are_counted(self):
+        requests, queries = self.queries_recorded('team_detail')
+        self.client.get(f'/teams/{self.team.pk}/')
+        after = self.queries_recorded('team_detail')
+        self.assertEqual(after[0], requests + 1)
+        self.assertGreater(after[1], queries)
+
+    async def test_async_view_queries_are_counted(self):
+        # The async ORM runs its queries on another thread's connection
+        requests, queries = self.queries_recorded('matches_list')
+        await self.async_client.get('/matches/')
+        after = self.queries_recorded('matches_list')
+        self.assertEqual(after[0], requests + 1)
+        self.assertGreater(after[1], queries)
+
+
+def eight_team_bracket():
+    """Four first-round matches with open slots, their winners in 5 and 6, the final in 7 and third place in 8"""
+    bracket = TournamentBracket.objects.create(name='Main', priority=1)
+    rounds = [TournamentRound.objects.create(bracket=bracket, name=name) for name in ('Round 1', 'Semifinals', 'Finals')]
+    matches = [Match.objects.create(match_number=n, tournament_round=rounds[0]) for n in range(1, 5)]
+    for n, (home, away) in enumerate([(matches[0], matches[1]), (matches[2], matches[3])], 5):
+        matches.append(Match.objects.create(
+            match_number=n, tournament_round=rounds[1],
+            home_source_match=home, home_source_take_winner=True, away_source_match=away, away_source_take_winner=True,
+        ))
+    for n, winner in ((7, True), (8, False)):
+        matches.append(Match.objects.create(
+            match_number=n, tournament_round=rounds[2],
+            home_source_match=matches[4], home_source_take_winner=winner,
+            away_source_match=matches[5], away_source_take_winner=winner,
+        ))
+    return bracket, matches
+
+
+class SeedingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bracket, cls.matches = eight_team_bracket()
+        east = Region.objects.create(name='East', color='red')
+        west = Region.objects.create(name='West', color='blue')
+        # Seeds 1 v 8, 4 v 5 and 2 v 7 are all same-region pairs in the standard order
+        regions = [east, west, east, west, west, west, west, east]
+        cls.teams = [Team.objects.create(name=f'Seed {i}', region=region) for i, region in enumerate(regions, 1)]
+
+    def test_seed_order(self):
+        self.assertEqual(seeding.seed_order(16), [1, 16, 8, 9, 4, 13, 5, 12, 2, 15, 7, 10, 3, 14, 6, 11])
+
+    def test_bands(self):
+        self.assertEqual(seeding.bands(16), [[1], [2], [3, 4], [5, 6, 7, 8], list(range(9, 17))])
+
+    def test_regions_are_kept_apart_within_bands(self):
+        result, before, after = seeding.seed(self.bracket, self.teams)
+        self.assertEqual(before[1], 3)
+        self.assertEqual(after[1], 1)
+        bands = {seed: i for i, band in enumerate(seeding.bands(8)) for seed in band}
+        for seed, team in result.teams.items():
+            self.assertEqual(bands[seed], bands[self.teams.index(team) + 1])
+
+    def test_apply_sends_byes_into_the_second_round(self):
+        # Six teams in eight slots: seeds 1 and 2 have byes
+        result, _, _ = seeding.seed(self.bracket, self.teams[:6], separate=False)
+        seeding.apply(result)
+        teams = {m.match_number: (m.home_team, m.away_team) for m in Match.objects.all()}
+        self.assertEqual(teams[1], (None, None))
+        self.assertEqual(teams[3], (None, None))
+        self.assertEqual(teams[2], (self.teams[3], self.teams[4]))
+        self.assertEqual(teams[4], (self.teams[2], self.teams[5]))
+        self.assertEqual(teams[5], (self.teams[0], None))
+        self.assertEqual(teams[6], (self.teams[1], None))
+
+
+class WhatIfTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bracket, cls.matches = eight_team_bracket()
+        region = Region.objects.create(name='East', color='red')
+        cls.teams = [Team.objects.create(name=f'Team {i}', region=region) for i in range(8)]
+        for i, match in enumerate(cls.matches[:4]):
+            match.home_team, match.away_team = cls.teams[2 * i], cls.teams[2 * i + 1]
+            match.save()
+
+    def setUp(self):
+        # Built directly, as the cached graph is keyed on change stamps that a rolled back test can reuse
+        self.graph = whatif.Graph(0, list(Match.objects.values(*whatif.GRAPH_FIELDS)))
+
+    def pk(self, number):
+        return self.matches[number - 1].pk
+
+    def test_won_chain_reaches_the_final(self):
+        team = self.teams[0].pk
+        winners = whatif.parse(self.graph, team, won=[1, 5])
+        matches, changed, sides = whatif.play(self.graph, winners)
+        self.assertEqual(matches[self.pk(5)]['home_team_id'], team)
+        self.assertEqual(matches[self.pk(7)]['home_team_id'], team)
+        self.assertEqual(sides[self.pk(5)], 'home')
+        self.assertTrue({self.pk(1), self.pk(5), self.pk(7)} <= changed)
+        self.assertNotIn(self.pk(8), changed)
+
+    def test_lost_chain_drops_to_third_place(self):
+        team, opponent = self.teams[0].pk, self.teams[2].pk
+        winners = whatif.parse(self.graph, team, won=[1], lost=[5], winners=[(2, opponent)])
+        self.assertEqual(winners[self.pk(5)], opponent)
+        matches, changed, sides = whatif.play(self.graph, winners)
+        self.assertEqual(matches[self.pk(7)]['home_team_id'], opponent)
+        self.assertEqual(matches[self.pk(8)]['home_team_id'], team)
+        self.assertEqual(sides[self.pk(5)], 'away')
+        # The stored bracket is untouched
+        self.assertIsNone(self.graph.matches[self.pk(8)]['home_team_id'])
+
+    def test_winner_must_be_playing(self):
+        with self.assertRaises(whatif.ScenarioError):
+            whatif.play(self.graph, {self.pk(5): self.teams[4].pk})
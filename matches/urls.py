@@ -1,18 +1,38 @@
 from django.urls import path, include
-from . import views
-from .views import TeamCreateView, RoomCreateView, MatchCreateView, MatchResultView
+from . import api, metrics, views
+from .views import TeamCreateView, RoomCreateView, MatchCreateView, MatchUpdateView, MatchResultView
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('metrics', metrics.metrics_view, name='metrics'),
     path('teams/<int:team_id>/', views.team_detail, name='team_detail'),
+    path('teams/<int:team_id>/calendar.ics', views.team_calendar, name='team_calendar'),
     path('teams/', views.teams_list, name='teams_list'),
     path('regions/<int:region_id>/', views.region_detail, name='region_detail'),
     path('regions/', views.regions_list, name='regions_list'),
     path('rooms/<int:room_id>/', views.room_detail, name='room_detail'),
+    path('rooms/<int:room_id>/kiosk/', views.room_kiosk, name='room_kiosk'),
+    path('rooms/<int:room_id>/kiosk/poll/', views.room_kiosk_poll, name='room_kiosk_poll'),
+    path('rooms/maps/<str:name>', views.room_map_image, name='room_map_image'),
     path('rooms/', views.rooms_list, name='rooms_list'),
     path('matches/<int:match_id>/', views.match_detail, name='match_detail'),
+    path('matches/<int:match_id>/questions/', views.match_questions, name='match_questions'),
+    path('matches/<int:match_id>/live/', views.match_live, name='match_live'),
     path('matches/', views.matches_list, name='matches_list'),
+    path('brackets/', views.brackets_view, name='brackets'),
+    path('brackets/<int:bracket_id>/changes/', views.bracket_changes, name='bracket_changes'),
     path('scorekeeper/', views.scorekeeper, name='scorekeeper'),
+    path('scorekeeper/batch/', views.scorekeeper_batch, name='scorekeeper_batch'),
+    path('scorekeeper/sync/', views.scorekeeper_sync, name='scorekeeper_sync'),
+    path('scorekeeper/sw.js', views.scorekeeper_service_worker, name='scorekeeper_sw'),
+
+    # Read-only JSON API
+    path('api/v1/matches/', api.matches, name='api_matches'),
+    path('api/v1/teams/', api.teams, name='api_teams'),
+    path('api/v1/rooms/', api.rooms, name='api_rooms'),
+    path('api/v1/timeslots/', api.timeslots, name='api_timeslots'),
+    path('api/v1/brackets/', api.brackets, name='api_brackets'),
+    path('api/v1/whatif/', api.whatif_view, name='api_whatif'),
 
     # Import Django authentication views
     path('accounts/', include("django.contrib.auth.urls")),
@@ -23,8 +43,10 @@ urlpatterns = [
     path('rooms/add/', RoomCreateView.as_view(), name='room_create'),
     path('matches/add/', MatchCreateView.as_view(), name='match_create'),
     path('matches/result/<int:pk>/', MatchResultView.as_view(), name='match_result'),
-    path('timeslots/add/', views.generate_timeslots_view, name='timeslots_add')
+    path('timeslots/add/', views.generate_timeslots_view, name='timeslots_add'),
+    path('brackets/seed/', views.seed_bracket_view, name='bracket_seed'),
+    path('analytics/', views.analytics_view, name='analytics'),
 
     # Edit forms
-    # path('matches/edit/<int:pk>', MatchUpdateView.as_view(), name='match_edit')
+    path('matches/edit/<int:pk>/', MatchUpdateView.as_view(), name='match_edit'),
 ]
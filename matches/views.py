@@ -1,7 +1,24 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from .models import Region, Team, Room, Match
-from .forms import TeamForm, RoomForm, MatchForm, MatchResultForm, GenerateTimeslotsForm
-from django.http import Http404
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.template.loader import render_to_string
+from .models import Region, Team, Room, Match, MatchAlreadyComplete, MatchVersionConflict, QuestionEvent, TournamentBracket, Change
+from .bracket import propagate_results
+from .kiosk import aroom_changed, aroom_queue
+from .layout import changed_fragments, current_layout
+from . import analytics, images, planner, refcache, seeding
+from .microcache import micro_cache
+from .forms import TeamForm, RoomForm, MatchForm, MatchResultForm, BatchResultFormSet, BatchFilterForm, ResultSubmissionForm, QuestionEventForm, TimeslotPlanForm, TimeslotPlanDayForm, TimeslotPlanDayFormSet, MatchFilterForm, SeedingForm
+from .sync import apply_submissions
+from django.db import transaction
+from django.db.models import Q
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 from django.urls import reverse_lazy, reverse
 from django.views.generic.edit import CreateView, UpdateView
 from django.contrib import messages
@@ -9,81 +26,312 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import authenticate, login
+from django.utils import timezone
 
 # Create your views here.
+
+# Templates can still load the session or user lazily, which the ORM only allows off the event loop
+arender = sync_to_async(render)
+
+@micro_cache
 def home(request):
     return render(request, 'home.html')
 
+@micro_cache
 def teams_list(request):
     """View for a list of all Teams"""
     t = Team.objects.all().order_by('name')
     return render(request, 'teams.html', {'teams': t})
 
-def team_detail(request, team_id):
+@micro_cache
+async def team_detail(request, team_id):
     """View for details about a specific Team"""
     try:
-        t = Team.objects.get(pk=team_id)
-        m = t.all_matches().order_by('match_number')
-        
+        t = await Team.objects.select_related('region').aget(pk=team_id)
     except Team.DoesNotExist:
         raise Http404("Team does not exist")
-    return render(request, 'team.html', {'team': t, 'matches': m})
-
+    confirmed, projected = split_participations([p async for p in t.schedule()])
+    await refcache.aattach(confirmed + projected)
+    await Match.aattach_destinations(confirmed + projected)
+    return await arender(request, 'team.html', {'team': t, 'matches': confirmed, 'projected': projected})
+
+def split_schedule(team):
+    """A team's confirmed matches and the matches it could still reach, each in time order"""
+    confirmed, projected = split_participations(team.schedule())
+    refcache.attach(confirmed + projected)
+    Match.attach_destinations(confirmed + projected)
+    return confirmed, projected
+
+def split_participations(participations):
+    confirmed, projected = [], {}
+    for participation in participations:
+        if participation.confirmed:
+            confirmed.append(participation.match)
+        else:
+            # A team can be projected into both sides of a match
+            projected.setdefault(participation.match_id, participation.match)
+    return confirmed, list(projected.values())
+
+# How long a calendar entry for a match lasts
+CALENDAR_MATCH_MINUTES = 30
+
+@micro_cache
+def team_calendar(request, team_id):
+    """iCalendar feed of a team's matches, with possible matches marked tentative"""
+    team = get_object_or_404(Team, pk=team_id)
+    confirmed, projected = split_schedule(team)
+    stamp = ical_time(timezone.now())
+    lines = [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//tourneyman//schedule//EN',
+        f'X-WR-CALNAME:{ical_text(team.name)}',
+    ]
+    for match, status in [(m, 'CONFIRMED') for m in confirmed] + [(m, 'TENTATIVE') for m in projected]:
+        if not match.start_time:
+            continue
+        summary = f'Match {match.match_number}: {match.home_team_name} vs. {match.away_team_name}'
+        if status == 'TENTATIVE':
+            summary = 'Possible ' + summary
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:match-{match.pk}-team-{team.pk}@tourneyman',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{ical_time(match.start_time)}',
+            f'DTEND:{ical_time(match.start_time + timedelta(minutes=CALENDAR_MATCH_MINUTES))}',
+            f'SUMMARY:{ical_text(summary)}',
+            f'LOCATION:{ical_text(match.room.name if match.room else "")}',
+            f'URL:{request.build_absolute_uri(reverse("match_detail", args=[match.pk]))}',
+            f'STATUS:{status}',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    response = HttpResponse('\r\n'.join(lines) + '\r\n', content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = f'inline; filename="team-{team.pk}.ics"'
+    return response
+
+def ical_time(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def ical_text(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+@micro_cache
 def regions_list(request):
     """View for a list of all Regions"""
     r = Region.objects.all().order_by('name')
     return render(request, 'regions.html', {'regions': r})
 
-def region_detail(request, region_id):
+@micro_cache
+async def region_detail(request, region_id):
     """View for details about a specific Region"""
     try:
-        r = Region.objects.get(pk=region_id)
-        t = r.team_set.all()
+        r = await Region.objects.aget(pk=region_id)
     except Region.DoesNotExist:
         raise Http404("Region does not exist")
-    return render(request, 'region.html', {'region': r, 'teams': t})
+    t = [team async for team in r.team_set.all()]
+    return await arender(request, 'region.html', {'region': r, 'teams': t})
 
+@micro_cache
 def rooms_list(request):
     """View for a list of all Rooms"""
     r = Room.objects.all().order_by('name')
     return render(request, 'rooms.html', {'rooms': r})
 
-def room_detail(request, room_id):
+@micro_cache
+async def room_detail(request, room_id):
     """View for details about a specific Room"""
     try:
-        r = Room.objects.get(pk=room_id)
-        m = r.all_matches().order_by('match_number')
-    except Region.DoesNotExist:
+        r = await Room.objects.aget(pk=room_id)
+    except Room.DoesNotExist:
         raise Http404("Room does not exist")
-    return render(request, 'room.html', {'room': r, 'matches': m})
-
-def matches_list(request):
-    view_format = request.GET.get('format', 'timeslot')
-    if view_format == 'bracket':
-        m = Match.objects.all().order_by('tournament_round', 'timeslot', 'match_number')
-    elif view_format == 'room':
-        m = Match.objects.all().order_by('room', 'timeslot', 'match_number')
-    else:
-        m = Match.objects.all().order_by('timeslot', 'match_number')
-
-    incomplete = m.filter(is_complete=False)
-    complete = m.filter(is_complete=True)
-    return render(request, 'matches.html', {'complete_matches': complete, 'incomplete_matches': incomplete})
-
-def match_detail(request, match_id):
+    m = await refcache.aattach([match async for match in r.all_matches().select_related(
+        'home_source_match', 'away_source_match'
+    ).order_by('match_number')])
+    await Match.aattach_destinations(m)
+    return await arender(request, 'room.html', {'room': r, 'map': images.picture(r), 'matches': m})
+
+def room_map_image(request, name):
+    """A resized room map; its name changes with its content, so browsers can keep it for good"""
+    if not images.NAME_PATTERN.match(name):
+        raise Http404("No such map")
+    try:
+        image = default_storage.open(f'{images.DIRECTORY}/{name}')
+    except FileNotFoundError:
+        raise Http404("No such map")
+    response = FileResponse(image, content_type=images.content_type(name))
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@micro_cache
+async def room_kiosk(request, room_id):
+    """Full-screen display for the tablet at a room's door"""
+    room = await aget_object_or_404(Room, pk=room_id)
+    version = await Change.alatest()
+    return await arender(request, 'room_kiosk.html', {'room': room, 'queue': await aroom_queue(room), 'version': version})
+
+# How long a kiosk update request waits for something to change
+KIOSK_POLL_SECONDS = 25
+# Under WSGI, how long a kiosk waits before asking again
+KIOSK_RETRY_SECONDS = 10
+
+async def room_kiosk_poll(request, room_id):
+    """Long-poll for a kiosk: answers as soon as the room's matches change, or after KIOSK_POLL_SECONDS.
+
+    Only under ASGI, where a waiting request costs nothing but a coroutine;
+    a WSGI worker would be tied up by each kiosk, so there the answer comes
+    at once with a Retry-After for the next request.
+    """
+    room = await aget_object_or_404(Room, pk=room_id)
+    try:
+        version = int(request.GET.get('version', 0))
+    except ValueError:
+        version = 0
+    long_poll = isinstance(request, ASGIRequest)
+    queue = await aroom_queue(room)
+    deadline = time.monotonic() + (KIOSK_POLL_SECONDS if long_poll else 0)
+    while True:
+        latest = await Change.alatest()
+        if latest > version:
+            if await aroom_changed(room, queue, version, latest):
+                version = latest
+                queue = await aroom_queue(room)
+                break
+            # Nothing this kiosk shows; skip past these changes next time
+            version = latest
+        if time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(LIVE_POLL_SECONDS)
+    # Sent on timeouts too, so projected start times keep moving with the clock
+    html = await sync_to_async(render_to_string)('room_kiosk_queue.html', {'queue': queue}, request)
+    response = JsonResponse({'version': version, 'html': html})
+    if not long_poll:
+        response['Retry-After'] = str(KIOSK_RETRY_SECONDS)
+    return response
+
+# Matches per page of the matches list
+MATCHES_PAGE_SIZE = 50
+
+@micro_cache
+async def matches_list(request):
+    """View for the schedule of matches, filtered and paged in start time order"""
+    if request.GET.get('format') == 'bracket':
+        return redirect('brackets')
+    filters = MatchFilterForm(request.GET)
+    m = Match.objects.select_related('home_source_match', 'away_source_match')
+    # Validating the room, bracket and round choices looks them up
+    if await sync_to_async(filters.is_valid)():
+        m = filters.filter(m)
+    page, next_cursor = await keyset_page(m, request.GET.get('after', ''), MATCHES_PAGE_SIZE)
+    await Match.aattach_destinations(page)
+
+    next_query = None
+    if next_cursor:
+        query = request.GET.copy()
+        query['after'] = next_cursor
+        next_query = query.urlencode()
+    first_query = None
+    if 'after' in request.GET:
+        query = request.GET.copy()
+        del query['after']
+        first_query = query.urlencode()
+    return await arender(request, 'matches.html', {
+        'filters': filters, 'matches': page, 'next_query': next_query, 'first_query': first_query,
+    })
+
+async def keyset_page(queryset, cursor, size):
+    """One page of matches in (start time, match number) order, starting after cursor.
+
+    A cursor is "<start time>~<match number>" of the last match on the previous
+    page, or "~<match number>" once the page reaches matches with no timeslot,
+    which come last. Each page is an index range scan however deep it is.
+    Returns the page, with reference rows attached, and the cursor for the next
+    one (None on the last page).
+    """
+    start, number = parse_cursor(cursor)
+    rows = []
+    if number is None or start is not None:
+        rows = [m async for m in scheduled_after(queryset, start, number)[:size + 1]]
+    if len(rows) <= size:
+        rows += [m async for m in unscheduled_after(queryset, start, number)[:size + 1 - len(rows)]]
+    return cut_page(await refcache.aattach(rows), size)
+
+def parse_cursor(cursor):
+    start, number = None, None
+    if cursor:
+        try:
+            start_text, number_text = cursor.split('~')
+            start = datetime.fromisoformat(start_text) if start_text else None
+            number = int(number_text)
+        except ValueError:
+            raise Http404("Invalid page")
+    return start, number
+
+def scheduled_after(queryset, start, number):
+    scheduled = queryset.order_by('timeslot__start_time', 'match_number')
+    if start is not None:
+        return scheduled.filter(
+            Q(timeslot__start_time__gt=start) | Q(timeslot__start_time=start, match_number__gt=number)
+        )
+    # A range on start_time, even an open one, lets SQLite walk the timeslot
+    # index instead of scanning and sorting every match
+    return scheduled.filter(timeslot__start_time__gte=datetime.min.replace(tzinfo=dt_timezone.utc))
+
+def unscheduled_after(queryset, start, number):
+    unscheduled = queryset.filter(timeslot__isnull=True).order_by('match_number')
+    if number is not None and start is None:
+        unscheduled = unscheduled.filter(match_number__gt=number)
+    return unscheduled
+
+def cut_page(rows, size):
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, f"{last.start_time.isoformat() if last.timeslot else ''}~{last.match_number}"
+
+@micro_cache
+def brackets_view(request):
+    """View for every bracket drawn as a tree, in priority order"""
+    layouts = [current_layout(b) for b in TournamentBracket.objects.order_by('priority')]
+    return render(request, 'brackets.html', {'layouts': layouts})
+
+@micro_cache
+async def bracket_changes(request, bracket_id):
+    """JSON with the redrawn pieces of a bracket since the version a page was drawn at"""
+    bracket = await aget_object_or_404(TournamentBracket, pk=bracket_id)
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+    # The layout is kept in memory; only catching it up with the change log queries
+    layout = await sync_to_async(current_layout)(bracket)
+    if since < layout.structure_version:
+        # Boxes have moved, been added or removed; only a full redraw will do
+        return JsonResponse({'version': layout.version, 'reload': True})
+    fragments = await sync_to_async(changed_fragments)(layout, since)
+    return JsonResponse({'version': layout.version, 'reload': False, 'fragments': fragments})
+
+@micro_cache
+async def match_detail(request, match_id):
     """View for details about a specific Match"""
     try:
-        m = Match.objects.get(pk=match_id)
+        m = await Match.objects.select_related('home_source_match', 'away_source_match').aget(pk=match_id)
     except Match.DoesNotExist:
         raise Http404("Match does not exist")
-    return render(request, 'match.html', {'match': m,})
+    await refcache.aattach([m])
+    await Match.aattach_destinations([m])
+    last_event = await m.question_events.order_by('-id').values_list('id', flat=True).afirst()
+    return await arender(request, 'match.html', {'match': m, 'last_event_id': last_event or 0})
 
 
 
-def scorekeeper(request):
+async def scorekeeper(request):
     """View for scorekeepers, allowing them to enter results for active games"""
-    m = Match.objects.all().filter(is_complete=False).order_by('match_number')
-    return render(request, 'scorekeeper.html', {'matches': m})
+    m = await refcache.aattach([match async for match in Match.objects.filter(is_complete=False).select_related(
+        'home_source_match', 'away_source_match'
+    ).order_by('match_number')])
+    await Match.aattach_destinations(m)
+    can_record = await ais_bracket_manager(await request.auser())
+    return await arender(request, 'scorekeeper.html', {'matches': m, 'can_record': can_record})
 
 def profile_view(request):
     return redirect('home')
@@ -91,6 +339,9 @@ def profile_view(request):
 def is_bracket_manager(user):
     return user.groups.filter(name='Bracket Managers').exists() or user.is_staff
 
+async def ais_bracket_manager(user):
+    return user.is_staff or await user.groups.filter(name='Bracket Managers').aexists()
+
 @user_passes_test(is_bracket_manager)
 def match_result(request, match_id):
     match = get_object_or_404(Match, id=match_id)
@@ -105,17 +356,202 @@ def match_result(request, match_id):
     
     return render(request, 'match_result_form.html', {'match': match})
 
-def generate_timeslots_view(request):
-    if request.method== 'POST':
-        form = GenerateTimeslotsForm(request.POST)
-        if form.is_valid():
-            timeslots = form.save()
-            messages.success(request, f'Successfully generated {len(timeslots)} timeslots')
-            return redirect('matches_list')
+@user_passes_test(is_bracket_manager)
+def scorekeeper_batch(request):
+    """Enter results for many matches at once between rounds"""
+    ready = Match.objects.filter(
+        is_complete=False, home_team__isnull=False, away_team__isnull=False
+    ).select_related('home_team', 'away_team', 'room', 'timeslot').order_by('timeslot__start_time', 'match_number')
+    # One timeslot at a time; the whole tournament would outgrow DATA_UPLOAD_MAX_NUMBER_FIELDS
+    filters = BatchFilterForm(request.GET, ready=ready)
+    ready = filters.filter(ready)
+
+    if request.method == 'POST':
+        formset = BatchResultFormSet(request.POST, queryset=ready)
+        if formset.is_valid():
+            try:
+                saved = formset.save()
+            except MatchVersionConflict:
+                # The conflicting rows now carry errors; show the batch again
+                pass
+            else:
+                messages.success(request, f'Saved {len(saved)} results')
+                return redirect('scorekeeper')
     else:
-        form = GenerateTimeslotsForm()
+        formset = BatchResultFormSet(queryset=ready)
+
+    return render(request, 'scorekeeper_batch.html', {'formset': formset, 'filters': filters})
 
-    return render(request, 'timeslot_generation_form.html', {'form': form })
+@user_passes_test(is_bracket_manager)
+@require_POST
+def scorekeeper_sync(request):
+    """Apply a queued batch of results from a scorekeeper device, posted as JSON"""
+    try:
+        items = json.loads(request.body)['submissions']
+    except (ValueError, KeyError, TypeError):
+        items = None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JsonResponse({'error': 'Expected a JSON object with a "submissions" list'}, status=400)
+
+    forms = [ResultSubmissionForm(item) for item in items]
+    errors = {i: form.errors.get_json_data() for i, form in enumerate(forms) if not form.is_valid()}
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    results = apply_submissions([form.cleaned_data for form in forms], user=request.user)
+    return JsonResponse({'results': results})
+
+def scorekeeper_service_worker(request):
+    """Service worker that queues result submissions while the device is offline"""
+    response = render(request, 'scorekeeper-sw.js', content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@user_passes_test(is_bracket_manager)
+@require_POST
+def match_questions(request, match_id):
+    """Record a batch of scored questions for a match, posted as JSON"""
+    match = get_object_or_404(Match, id=match_id)
+    if match.is_complete:
+        return JsonResponse({'error': 'Match is already complete'}, status=409)
+
+    try:
+        items = json.loads(request.body)['questions']
+    except (ValueError, KeyError, TypeError):
+        items = None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JsonResponse({'error': 'Expected a JSON object with a "questions" list'}, status=400)
+
+    forms = [QuestionEventForm(item) for item in items]
+    errors = {i: form.errors.get_json_data() for i, form in enumerate(forms) if not form.is_valid()}
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    try:
+        events = match.add_question_events([form.save(commit=False) for form in forms])
+    except MatchAlreadyComplete as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return JsonResponse({
+        'match': match.id,
+        'events': [event.id for event in events],
+        'home_score': match.home_score,
+        'away_score': match.away_score,
+        'version': match.version,
+    })
+
+LIVE_STREAM_SECONDS = 30
+LIVE_POLL_SECONDS = 1
+
+async def match_live(request, match_id):
+    """Server-sent event stream of score deltas for a match"""
+    match = await aget_object_or_404(Match, id=match_id)
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('after') or 0)
+    except ValueError:
+        last_id = 0
+
+    # Under ASGI the stream waits on the event loop; a WSGI server needs a plain
+    # iterator (it would buffer an async one whole) and gives it a thread anyway
+    if isinstance(request, ASGIRequest):
+        stream = alive_events(match.id, last_id)
+    else:
+        stream = live_events(match.id, last_id)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def live_events(match_id, last_id):
+    # Browsers reconnect on their own and resume from the Last-Event-ID
+    yield 'retry: 2000\n\n'
+    deadline = time.monotonic() + LIVE_STREAM_SECONDS
+    while time.monotonic() < deadline:
+        events = list(live_query(match_id, last_id))
+        if events:
+            last_id = events[-1]['id']
+            yield live_message(events)
+        elif Match.objects.filter(id=match_id, is_complete=True).exists():
+            yield 'event: complete\ndata: {}\n\n'
+            return
+        time.sleep(LIVE_POLL_SECONDS)
+
+async def alive_events(match_id, last_id):
+    """live_events() for ASGI"""
+    yield 'retry: 2000\n\n'
+    deadline = time.monotonic() + LIVE_STREAM_SECONDS
+    while time.monotonic() < deadline:
+        events = [e async for e in live_query(match_id, last_id)]
+        if events:
+            last_id = events[-1]['id']
+            yield live_message(events)
+        elif await Match.objects.filter(id=match_id, is_complete=True).aexists():
+            yield 'event: complete\ndata: {}\n\n'
+            return
+        await asyncio.sleep(LIVE_POLL_SECONDS)
+
+def live_query(match_id, last_id):
+    return QuestionEvent.objects.filter(match_id=match_id, id__gt=last_id).values('id', 'question', 'is_home', 'kind', 'points')
+
+def live_message(events):
+    payload = {
+        'home_delta': sum(e['points'] for e in events if e['is_home']),
+        'away_delta': sum(e['points'] for e in events if not e['is_home']),
+        'events': events,
+    }
+    return f"id: {events[-1]['id']}\nevent: score\ndata: {json.dumps(payload)}\n\n"
+
+@user_passes_test(lambda user: user.is_staff)
+def generate_timeslots_view(request):
+    """Plan timeslots over several days around breaks, preview them, then create them all at once"""
+    if request.method == 'POST':
+        form = TimeslotPlanForm(request.POST)
+        days = TimeslotPlanDayFormSet(request.POST, prefix='days')
+        if form.is_valid() and days.is_valid():
+            starts = planner.plan(days.days(), form.cleaned_data['blocked'])
+            if 'create' in request.POST:
+                slots, matches = planner.create(starts, list(form.cleaned_data['rooms']))
+                messages.success(request, f'Created {len(slots)} timeslots and {len(matches)} empty matches')
+                return redirect('matches_list')
+            return render(request, 'timeslot_generation_form.html', {
+                'form': form, 'days': days, 'preview': planner.preview(starts), 'count': len(starts),
+            })
+    else:
+        form = TimeslotPlanForm()
+        days = TimeslotPlanDayFormSet(prefix='days', initial=TimeslotPlanDayForm.first_day())
+
+    return render(request, 'timeslot_generation_form.html', {'form': form, 'days': days})
+
+@user_passes_test(lambda user: user.is_staff)
+def seed_bracket_view(request):
+    """Seed teams into a bracket's first round with regions kept apart, preview the pairings, then save them"""
+    form = SeedingForm(request.POST or None)
+    context = {'form': form}
+    if request.method == 'POST' and form.is_valid():
+        bracket = form.cleaned_data['bracket']
+        try:
+            result, before, after = seeding.seed(bracket, form.cleaned_data['teams'], form.cleaned_data['separate_regions'])
+            if 'apply' in request.POST:
+                changed = seeding.apply(result)
+                messages.success(request, f'Seeded {len(form.cleaned_data["teams"])} teams into {bracket}; {len(changed)} matches changed')
+                return redirect('brackets')
+        except seeding.SeedingError as e:
+            form.add_error(None, str(e))
+        else:
+            names = seeding.round_names(result.shape)
+            context.update({
+                'pairings': result.pairings(),
+                'meetings': [(names.get(height), before[height], after[height]) for height in sorted(set(before) | set(after))],
+            })
+    return render(request, 'bracket_seeding_form.html', context)
+
+@user_passes_test(lambda user: user.is_staff)
+def analytics_view(request):
+    """Room utilization, team waits and a heatmap of the schedule, or the schedule matrix as CSV"""
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="schedule.csv"'
+        analytics.write_csv(response)
+        return response
+    return render(request, 'analytics.html', {'report': analytics.report()})
 
 # def login_view(request):
 #     username = request.POST["username"]
@@ -154,6 +590,22 @@ class RoomCreateView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMixi
     def get_success_url(self):
         return reverse('room_create')
 
+class VersionedSaveMixin:
+    """Shows a MatchVersionConflict raised while saving as form errors instead of overwriting"""
+    def after_save(self):
+        pass
+
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                self.after_save()
+        except MatchVersionConflict as conflict:
+            form.show_conflict(conflict.current[0] if conflict.current else None)
+            return self.form_invalid(form)
+        messages.success(self.request, self.get_success_message(form.cleaned_data))
+        return HttpResponseRedirect(self.get_success_url())
+
 class MatchCreateView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMixin, CreateView):
     model = Match
     form_class = MatchForm
@@ -166,7 +618,19 @@ class MatchCreateView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMix
     def get_success_url(self):
         return reverse('match_create')
 
-class MatchResultView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMixin, UpdateView):
+class MatchUpdateView(LoginRequiredMixin, UserPassesTestMixin, VersionedSaveMixin, SuccessMessageMixin, UpdateView):
+    model = Match
+    form_class = MatchForm
+    template_name = 'match_form.html'
+    success_message = "Match %(match_number)s was saved!"
+
+    def test_func(self):
+            return self.request.user.is_staff # Only staff can access this view
+
+    def get_success_url(self):
+        return reverse('match_detail', args=[self.object.pk])
+
+class MatchResultView(LoginRequiredMixin, UserPassesTestMixin, VersionedSaveMixin, SuccessMessageMixin, UpdateView):
     model = Match
     form_class = MatchResultForm
     template_name = "match_result_form.html"
@@ -175,5 +639,8 @@ class MatchResultView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMix
     def test_func(self):
             return self.request.user.is_staff # Only staff can access this view
 
+    def after_save(self):
+        propagate_results([self.object])
+
     def get_success_url(self):
         return reverse('matches_list')
@@ -0,0 +1,258 @@
+"""Answering "if we win match 14 and lose 22, where do we play next?" without touching the database.
+
+The bracket graph (every match's teams, sources, result, slot and room) is
+loaded with one query and kept in memory until the change stamp moves, so
+it is shared by every request against the same version of the tournament.
+A scenario is a set of hypothetical winners. It is played through a
+copy-on-write view of the graph in match number order, with the same rules
+propagate_results uses for real scores: the winner or loser of a decided
+match takes its destination slots, a real result further down is applied to
+whichever teams now reach it, and links towards lower match numbers are
+ignored. The team's schedule is then projected from the result with
+project_slots, exactly as TeamParticipation is built.
+"""
+import threading
+
+from . import refcache
+from .models import Change, Match, Room, Team, TournamentRound
+from .participation import project_slots
+
+GRAPH_FIELDS = (
+    'id', 'match_number', 'is_complete', 'home_team_id', 'away_team_id', 'home_score', 'away_score',
+    'home_source_match_id', 'home_source_take_winner', 'away_source_match_id', 'away_source_take_winner',
+    'timeslot_id', 'timeslot__start_time', 'room_id', 'tournament_round_id',
+)
+
+# Most results a single scenario may set
+MAX_RESULTS = 64
+
+_graph = None
+_lock = threading.Lock()
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+class Graph:
+    """The bracket as it stands at one change stamp; shared between requests, so never modified"""
+
+    def __init__(self, stamp, rows):
+        self.stamp = stamp
+        self.matches = {row['id']: row for row in rows}
+        self.by_number = {row['match_number']: row['id'] for row in rows}
+        self.order = sorted(self.matches, key=lambda pk: self.matches[pk]['match_number'])
+        # Matches fed by each match, to know which ones a scenario can reach
+        self.fed = {}
+        for row in rows:
+            for side in ('home', 'away'):
+                source = row[f'{side}_source_match_id']
+                if source is not None:
+                    self.fed.setdefault(source, []).append(row['id'])
+
+
+def graph():
+    """The bracket graph for the current change stamp, loaded once per stamp"""
+    global _graph
+    stamp = Change.latest()
+    with _lock:
+        if _graph is None or _graph.stamp != stamp:
+            _graph = Graph(stamp, list(Match.objects.values(*GRAPH_FIELDS)))
+        return _graph
+
+
+def winner_side(match):
+    """'home' or 'away' for a match with a real, untied result, else None"""
+    if not match['is_complete'] or match['home_score'] is None or match['away_score'] is None:
+        return None
+    if match['home_score'] == match['away_score']:
+        return None
+    return 'home' if match['home_score'] > match['away_score'] else 'away'
+
+
+def play(graph, winners):
+    """Apply hypothetical winners ({match id: team id}) to the graph.
+
+    Returns (matches, changed, sides): every match as a dict, with the
+    scenario's teams filled in and its decided matches marked complete, the
+    ids of the matches whose teams or result the scenario changed, and the
+    winning side of each decided match the scenario reaches. Raises
+    ScenarioError if a winner is not playing in its match once the earlier
+    results of the scenario are in.
+    """
+    matches = dict(graph.matches)
+    sides = {}
+    changed = set()
+    # Decided matches whose winner or loser may now differ from the stored bracket
+    moved = set()
+    reachable = _reachable(graph, winners)
+
+    for pk in graph.order:
+        if pk not in reachable:
+            continue
+        match = matches[pk]
+        teams = {}
+        for side in ('home', 'away'):
+            source_id = match[f'{side}_source_match_id']
+            if source_id not in moved or matches[source_id]['match_number'] >= match['match_number']:
+                continue
+            source = matches[source_id]
+            side_won = sides.get(source_id)
+            if side_won is None:
+                teams[side] = None
+            else:
+                took = side_won if match[f'{side}_source_take_winner'] else _other(side_won)
+                teams[side] = source[f'{took}_team_id']
+        teams = {side: team for side, team in teams.items() if team != match[f'{side}_team_id']}
+        if teams:
+            match = matches[pk] = {**match, **{f'{side}_team_id': team for side, team in teams.items()}}
+            changed.add(pk)
+
+        if pk in winners:
+            team = winners[pk]
+            side = 'home' if match['home_team_id'] == team else 'away' if match['away_team_id'] == team else None
+            if side is None:
+                raise ScenarioError(f"{_team_name(team)} is not playing in match {match['match_number']} in this scenario")
+            if side != winner_side(match):
+                match = matches[pk] = {**match, 'is_complete': True}
+                changed.add(pk)
+            sides[pk] = side
+            moved.add(pk)
+        elif match['is_complete']:
+            sides[pk] = winner_side(match)
+            if pk in changed:
+                moved.add(pk)
+    return matches, changed, sides
+
+
+def _reachable(graph, winners):
+    """The matches downstream of the scenario's results, which are all that can change"""
+    found = set()
+    frontier = list(winners)
+    while frontier:
+        pk = frontier.pop()
+        if pk not in found:
+            found.add(pk)
+            frontier.extend(graph.fed.get(pk, ()))
+    return found
+
+
+def _other(side):
+    return 'away' if side == 'home' else 'home'
+
+
+def _team_name(team_id):
+    team = refcache.table(Team, check=False).get(team_id)
+    return team.display_name if team else f'Team {team_id}'
+
+
+def parse(graph, team_id, won=(), lost=(), winners=()):
+    """The hypothetical winners {match id: team id} of a scenario given as match numbers.
+
+    won and lost are match numbers the team wins and loses, winners are
+    (match number, team id) pairs for anyone's matches. Losing needs to know
+    the opponent, so it is resolved once the earlier results are in.
+    """
+    numbers = list(won) + list(lost) + [number for number, _ in winners]
+    if len(numbers) > MAX_RESULTS:
+        raise ScenarioError(f"A scenario can set at most {MAX_RESULTS} results")
+    if len(set(numbers)) != len(numbers):
+        raise ScenarioError("Each match can only have one result")
+    for number in numbers:
+        if number not in graph.by_number:
+            raise ScenarioError(f"There is no match {number}")
+
+    chosen = {graph.by_number[number]: team for number, team in winners}
+    chosen.update({graph.by_number[number]: team_id for number in won})
+    losses = {graph.by_number[number] for number in lost}
+    if not losses:
+        return chosen
+    # Play the scenario a match at a time, so the opponent in each lost match is known
+    for pk in sorted(losses, key=lambda pk: graph.matches[pk]['match_number']):
+        number = graph.matches[pk]['match_number']
+        earlier = {k: v for k, v in chosen.items() if graph.matches[k]['match_number'] < number}
+        match = play(graph, earlier)[0][pk]
+        if team_id not in (match['home_team_id'], match['away_team_id']):
+            raise ScenarioError(f"{_team_name(team_id)} is not playing in match {match['match_number']} in this scenario")
+        opponent = match['away_team_id'] if match['home_team_id'] == team_id else match['home_team_id']
+        if opponent is None:
+            raise ScenarioError(f"Match {match['match_number']} has no opponent yet in this scenario")
+        chosen[pk] = opponent
+    return chosen
+
+
+def schedule(team_id, won=(), lost=(), winners=()):
+    """Where a team plays if the given results happen; reads the database only to load the graph"""
+    current = graph()
+    # Brings the reference tables up to date once; the names below read them without checking again
+    if team_id not in refcache.table(Team):
+        raise ScenarioError(f"There is no team {team_id}")
+    chosen = parse(current, team_id, won, lost, winners)
+    matches, changed, sides = play(current, chosen)
+    rows = [
+        (match_id, is_home, confirmed)
+        for team, match_id, is_home, confirmed, _ in project_slots(matches.values())
+        if team == team_id
+    ]
+    rows.sort(key=lambda row: matches[row[0]]['match_number'])
+    return {
+        'version': current.stamp,
+        'team_id': team_id,
+        'results': [
+            {'match_number': matches[pk]['match_number'], 'winner_id': team, 'winner': _team_name(team)}
+            for pk, team in sorted(chosen.items(), key=lambda item: matches[item[0]]['match_number'])
+        ],
+        'schedule': [
+            _slot_data(matches, sides, matches[match_id], is_home, confirmed, match_id in changed)
+            for match_id, is_home, confirmed in rows
+        ],
+        'changed': [
+            _match_data(matches[pk]) for pk in sorted(changed, key=lambda pk: matches[pk]['match_number'])
+        ],
+    }
+
+
+def _slot_data(matches, sides, match, is_home, confirmed, changed):
+    side, other = ('home', 'away') if is_home else ('away', 'home')
+    opponent = match[f'{other}_team_id']
+    return {
+        **_match_data(match),
+        'side': side,
+        'confirmed': confirmed,
+        'changed': changed,
+        'opponent_id': opponent,
+        'opponent': _team_name(opponent) if opponent else _source_label(matches, match, other),
+        'result': _result(sides, match, side),
+    }
+
+
+def _match_data(match):
+    room = refcache.table(Room, check=False).get(match['room_id'])
+    tournament_round = refcache.table(TournamentRound, check=False).get(match['tournament_round_id'])
+    start = match['timeslot__start_time']
+    return {
+        'id': match['id'],
+        'match_number': match['match_number'],
+        'round': str(tournament_round) if tournament_round else None,
+        'start_time': start.isoformat() if start else None,
+        'room': room.name if room else None,
+        'home_team_id': match['home_team_id'],
+        'home_team': _team_name(match['home_team_id']) if match['home_team_id'] else None,
+        'away_team_id': match['away_team_id'],
+        'away_team': _team_name(match['away_team_id']) if match['away_team_id'] else None,
+    }
+
+
+def _source_label(matches, match, side):
+    source = matches.get(match[f'{side}_source_match_id'])
+    if source is None:
+        return None
+    outcome = 'Winner' if match[f'{side}_source_take_winner'] else 'Loser'
+    return f"{outcome} of match {source['match_number']}"
+
+
+def _result(sides, match, side):
+    won = sides[match['id']] if match['id'] in sides else winner_side(match)
+    if won is None:
+        return None
+    return 'won' if won == side else 'lost'
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quiztournament.settings')
+# Read by the settings, which tune the database connections for ASGI
+os.environ['QUIZTOURNAMENT_SERVER'] = 'asgi'
 
 application = get_asgi_application()
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'matches.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,8 +61,14 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compile each template once per process instead of on every render
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -71,15 +79,42 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'quiztournament.wsgi.application'
+ASGI_APPLICATION = 'quiztournament.asgi.application'
+
+# asgi.py sets this before the settings load
+SERVING_ASGI = os.environ.get('QUIZTOURNAMENT_SERVER') == 'asgi'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite is tuned for many scorekeepers writing while spectators read:
+# WAL lets readers carry on during a write, writers wait for the lock instead
+# of failing with "database is locked", and transactions take the write lock
+# up front so they never fail halfway through upgrading from a read.
+# https://docs.djangoproject.com/en/5.2/ref/databases/#sqlite-notes
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reuse connections between requests rather than reopening the file each time.
+        # Not under ASGI, where Django's request signals that close stale connections
+        # don't run on the threads the async views' queries use.
+        'CONN_MAX_AGE': 0 if SERVING_ASGI else 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a writer waits on the lock before giving up
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-32000;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA mmap_size=134217728;'
+            ),
+        },
     }
 }
 
@@ -129,4 +164,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
-LOGOUT_REDIRECT_URL = "home"
\ No newline at end of file
+LOGOUT_REDIRECT_URL = "home"
+
+# How long anonymous visitors may be served an already rendered public page.
+# Any save to the tournament makes cached pages stale immediately regardless.
+MICRO_CACHE_SECONDS = 5
+
+# Addresses allowed to read /metrics without logging in
+INTERNAL_IPS = ['127.0.0.1']
+
+# Log requests at least this many seconds slow, with their queries (None turns it off)
+SLOW_REQUEST_SECONDS = None